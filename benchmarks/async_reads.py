@@ -0,0 +1,43 @@
+"""
+Times reading a collection over HTTP from a fake Notion server with simulated latency, at increasing read concurrency.
+
+Row records are left out of query results, like Notion does for large queries, so every chunk of `--batch-size` rows is
+its own syncRecordValues request. Read time should fall close to linearly up to the concurrency.
+
+Usage: python benchmarks/async_reads.py [--rows 2000] [--latency 0.2] [--concurrency 1 2 4 8 16]
+"""
+import argparse
+import logging
+import time
+
+from tests.fakes import FakeHTTPServer, FakeNotionBackend, HTTPNotionClient
+from thought.core import CollectionExtension
+
+logging.disable(logging.WARNING)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the server takes to answer each request')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    backend = FakeNotionBackend(rows=args.rows, query_records=False)
+    with FakeHTTPServer(latency=args.latency, respond=lambda path, body: backend.handle(path.lstrip('/'), body)) as server:
+        print(f"{'concurrency':>11} {'seconds':>8} {'speedup':>8} {'in flight':>9}")
+        baseline = None
+        for concurrency in args.concurrency:
+            client = HTTPNotionClient(server.url)
+            collection = client.get_collection_view(backend.url).collection
+            server.max_concurrent = 0
+            start = time.perf_counter()
+            CollectionExtension(collection, concurrency=concurrency).asdataframe(batch_size=args.batch_size)
+            seconds = time.perf_counter() - start
+            baseline = baseline or seconds
+            print(f"{concurrency:>11} {seconds:>8.2f} {baseline / seconds:>7.1f}x {server.max_concurrent:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Reports per column memory use of decoded collection rows before and after converting them to compact dtypes.
+
+Usage: python benchmarks/columnar_memory.py [--rows 20000]
+"""
+import argparse
+import logging
+
+from tests.fakes import FakeNotionBackend, FakeNotionClient
+from thought.schema import SCHEMAS, memory_usage
+
+logging.disable(logging.WARNING)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    args = parser.parse_args()
+
+    backend = FakeNotionBackend(rows=args.rows, duplicate_rate=args.duplicate_rate)
+    collection = FakeNotionClient(backend).get_collection_view(backend.url).collection
+    schema = SCHEMAS.get(collection)
+    dataframe = schema.frame([backend.records['block'][x] for x in backend.row_ids], collection)
+    compacted = schema.compact(dataframe)
+
+    before = dataframe.memory_usage(deep=True)
+    after = compacted.memory_usage(deep=True)
+    print(f"{'column':<12} {'dtype':<22} {'before':>12} {'after':>12} {'ratio':>7}")
+    for column in dataframe.columns:
+        print(f"{column:<12} {str(compacted[column].dtype):<22} {before[column]:>12} {after[column]:>12} "
+              f"{before[column] / after[column]:>6.1f}x")
+    total_before, total_after = memory_usage(dataframe), memory_usage(compacted)
+    print(f"{'total':<12} {'':<22} {total_before:>12} {total_after:>12} {total_before / total_after:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmarks candidate pair counts and wall time of each dedupe index strategy, and of the hash engine, on synthetic collections.
+
+Usage: python benchmarks/dedupe_indexing.py [--sizes 1000 10000 100000] [--max-full-rows 2000]
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from thought.core import CollectionExtension
+from thought.dedupe import INDEX_STRATEGIES, build_index
+
+logging.disable(logging.WARNING)
+
+
+def synthetic_collection(rows: int, duplicate_rate: float = 0.1, seed: int = 0) -> pd.DataFrame:
+    '''
+        Builds a bookmark-like dataframe where roughly `duplicate_rate` of rows are exact copies of earlier rows
+    '''
+    rng = np.random.default_rng(seed)
+    unique = max(1, int(rows * (1 - duplicate_rate)))
+    source = rng.integers(0, unique, rows)
+    source[:unique] = np.arange(unique)
+    return pd.DataFrame({
+        'title': [f'title {x}' for x in source],
+        'url': [f'https://example.com/{x}' for x in source],
+        'tags': [[f'tag{x % 7}', f'tag{x % 11}'] for x in source],
+        'id': [f'block-{x}' for x in range(rows)],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--max-full-rows', type=int, default=2000, help="Skip the full index above this many rows, its feature matrix does not fit in memory much beyond that")
+    args = parser.parse_args()
+
+    fields = ['title', 'url', 'tags']
+    extension = CollectionExtension(collection=None)
+    print(f"{'rows':>8} {'strategy':<20} {'pairs':>12} {'index s':>9} {'dedupe s':>9} {'kept':>8}")
+    for size in args.sizes:
+        dataframe = synthetic_collection(size)
+        for strategy in INDEX_STRATEGIES:
+            if strategy == 'full' and size > args.max_full_rows:
+                print(f"{size:>8} {strategy:<20} {'skipped':>12}")
+                continue
+            start = time.perf_counter()
+            pairs = build_index(dataframe, strategy=strategy, comparison_fields=fields, on=['url'])
+            index_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            kept = extension.dedupe(dataframe, comparison_fields=fields, index_strategy=strategy, block_on=['url'], engine='recordlinkage')
+            dedupe_time = time.perf_counter() - start
+            print(f"{size:>8} {strategy:<20} {len(pairs):>12} {index_time:>9.3f} {dedupe_time:>9.3f} {len(kept):>8}")
+
+        start = time.perf_counter()
+        kept = extension.dedupe(dataframe, comparison_fields=fields, engine='hash')
+        dedupe_time = time.perf_counter() - start
+        print(f"{size:>8} {'hash engine':<20} {'-':>12} {'-':>9} {dedupe_time:>9.3f} {len(kept):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Measures the peak python memory of exporting a collection against its row count, which should stay flat for a fixed chunk size.
+
+Rows are generated lazily chunk by chunk, standing in for a collection read through the snapshot cache.
+
+Usage: python benchmarks/export_memory.py [--rows 10000 100000] [--chunk-size 1000] [--format parquet]
+"""
+import argparse
+import logging
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from tests.fakes import FakeNotionBackend, FakeNotionClient, synthetic_row
+from thought.core import CollectionExtension
+from thought.export import export_collection
+from thought.settings import EXPORT_CHUNK_SIZE, EXPORT_FORMATS
+
+logging.disable(logging.WARNING)
+
+
+class SyntheticCollection(CollectionExtension):
+    """A collection whose rows are synthesised on the fly"""
+    rows: int = 0
+
+    def iter_rows(self, batch_size=EXPORT_CHUNK_SIZE, **kwargs):
+        backend = FakeNotionBackend(rows=0)
+        for start in range(0, self.rows, batch_size):
+            backend.records['block'].clear()
+            for number in range(start, min(start + batch_size, self.rows)):
+                backend.add_row(**synthetic_row(number))
+            yield self.schema.frame(list(backend.records['block'].values()), self.collection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000])
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='parquet')
+    args = parser.parse_args()
+
+    backend = FakeNotionBackend(rows=0)
+    collection = FakeNotionClient(backend).get_collection_view(backend.url).collection
+    print(f"{'rows':>8} {'format':<8} {'seconds':>8} {'peak MB':>8} {'file MB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = Path(directory) / f'export.{args.format}'
+            extension = SyntheticCollection(collection)
+            extension.rows = rows
+            tracemalloc.start()
+            start = time.perf_counter()
+            export_collection(extension, path, format=args.format, chunk_size=args.chunk_size)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{rows:>8} {args.format:<8} {seconds:>8.2f} {peak / 2 ** 20:>8.1f} {path.stat().st_size / 2 ** 20:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Times a full hash dedupe against the persistent duplicate key index, on a cached collection that gains a few new rows
+between runs.
+
+The first indexed run hashes every row, later runs only hash the new ones, so their time should stay flat as the
+collection grows while the full dedupe's grows with it.
+
+Usage: python benchmarks/incremental_dedupe.py [--rows 20000] [--new 500] [--runs 3]
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from tests.fakes import SCHEMA, FakeNotionBackend, FakeNotionClient, synthetic_row
+from thought.cache import SnapshotCache
+from thought.core import CollectionExtension
+
+logging.disable(logging.WARNING)
+
+DAY = 24 * 60 * 60 * 1000
+FIELDS = ['title', 'url', 'tags']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--new', type=int, default=500, help='Rows added before each later run')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    schema = dict(SCHEMA, edit={'name': 'Edited', 'type': 'last_edited_time'})
+    backend = FakeNotionBackend(rows=args.rows, duplicate_rate=0.1, schema=schema)
+    client = FakeNotionClient(backend)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = SnapshotCache(path=Path(directory) / 'snapshots.sqlite')
+        collection = CollectionExtension(client.get_collection_view(backend.url).collection, cache=cache)
+        print(f"{'run':>3} {'rows':>8} {'full':>8} {'indexed':>8} {'hashed':>8} {'duplicates':>10}")
+        for run in range(args.runs):
+            if run:
+                backend.clock += DAY
+                for number in range(args.new):
+                    backend.add_row(**synthetic_row(args.rows * 10 + run * args.new + number))
+
+            start = time.perf_counter()
+            collection.dedupe(collection.asdataframe(), comparison_fields=FIELDS)
+            full = time.perf_counter() - start
+
+            start = time.perf_counter()
+            duplicates, stats = collection.indexed_duplicates(FIELDS)
+            indexed = time.perf_counter() - start
+            print(f"{run:>3} {stats.size:>8} {full:>7.2f}s {indexed:>7.2f}s {stats.hashed:>8} {len(duplicates):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Benchmarks decoding raw row records into a DataFrame through notion-py's get_all_properties against the compiled schema.
+
+Usage: python benchmarks/property_decode.py [--rows 50000]
+"""
+import argparse
+import logging
+import time
+
+import pandas as pd
+from tests.fakes import FakeNotionBackend, FakeNotionClient
+from thought.schema import CompiledSchema
+
+logging.disable(logging.WARNING)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    backend = FakeNotionBackend(rows=args.rows)
+    client = FakeNotionClient(backend)
+    collection = client.get_collection_view(backend.url).collection
+    records = [backend.records['block'][x] for x in backend.row_ids]
+    client._store.store_recordmap({'block': {x['id']: {'role': 'editor', 'value': x} for x in records}})
+
+    start = time.perf_counter()
+    blocks = [client.get_block(x['id']) for x in records]
+    pd.DataFrame([dict(x.get_all_properties(), id=x.id) for x in blocks])
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    CompiledSchema(collection.get_schema_properties()).frame(records, collection)
+    after = time.perf_counter() - start
+
+    print(f"{'rows':>8} {'notion-py s':>12} {'compiled s':>11} {'speedup':>8}")
+    print(f"{args.rows:>8} {before:>12.3f} {after:>11.3f} {before / after:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Runs the benchmark suite against the in-process fake Notion and Instapaper backends, so numbers are comparable across
+commits without live accounts.
+
+Each benchmark builds its synthetic collection outside the timed section, then times one call `--repeat` times. Results can
+be saved as JSON and compared against an earlier run, e.g.
+
+    python benchmarks/suite.py --output before.json
+    git checkout my-branch
+    python benchmarks/suite.py --compare before.json
+
+Usage: python benchmarks/suite.py [--rows 2000] [--duplicate-rate 0.1] [--schema bookmarks] [--latency 0.0] [--repeat 3]
+                                  [--only asdataframe dedupe_hash ...] [--output results.json] [--compare results.json]
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+from unittest import mock
+
+import pandas as pd
+from tests.fakes import (
+    BOOKMARK_SCHEMA,
+    SCHEMA,
+    FakeInstapaperSession,
+    FakeNotionBackend,
+    FakeNotionClient,
+    bookmarks,
+    synthetic_row,
+)
+from thought.cache import SnapshotCache
+from thought.core import CollectionExtension, CollectionViewExtension
+from thought.service import GenericService
+from thought.services.instapaper import BookmarkState, InstapaperAPI
+
+logging.disable(logging.WARNING)
+
+DAY = 24 * 60 * 60 * 1000
+FIELDS = ['title', 'url', 'tags']
+
+# synthetic collection schemas, rows only get the synthetic values of properties their schema has
+SCHEMAS = {
+    'bookmarks': SCHEMA,
+    'minimal': {key: SCHEMA[key] for key in ('titl', 'urll', 'tags')},
+    'wide': dict(SCHEMA,
+                 edit={'name': 'Edited', 'type': 'last_edited_time'},
+                 crea={'name': 'Created', 'type': 'created_time'},
+                 note={'name': 'Notes', 'type': 'text'},
+                 stat={'name': 'Status', 'type': 'select', 'options': []}),
+}
+
+# benchmark name: setup taking the run's parameters and returning the call to time
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Callable[[], object]]] = {}
+
+
+def benchmark(setup: Callable) -> Callable:
+    BENCHMARKS[setup.__name__] = setup
+    return setup
+
+
+def backend(args: argparse.Namespace, schema: Dict = None, rows: int = None) -> FakeNotionBackend:
+    schema = schema or SCHEMAS[args.schema]
+    # the edit time is needed for the snapshot cache's incremental refresh
+    schema = dict(schema, edit={'name': 'Edited', 'type': 'last_edited_time'})
+    return FakeNotionBackend(rows=args.rows if rows is None else rows, duplicate_rate=args.duplicate_rate,
+                             seed=args.seed, schema=schema, latency=args.latency)
+
+
+def collection(fake: FakeNotionBackend, cache: SnapshotCache = None) -> CollectionExtension:
+    client = FakeNotionClient(fake)
+    return CollectionExtension(client.get_collection_view(fake.url).collection, cache=cache, concurrency=1)
+
+
+@benchmark
+def cli_startup(args):
+    '''`thought --help` in a fresh interpreter'''
+    directory = tempfile.mkdtemp()
+    return lambda: subprocess.run([sys.executable, '-m', 'thought.cli', '--help'], cwd=directory,
+                                  capture_output=True, check=True)
+
+
+@benchmark
+def asdataframe(args):
+    '''reading every row through the record API'''
+    return collection(backend(args)).asdataframe
+
+
+@benchmark
+def asdataframe_cached(args):
+    '''reading every row through an up to date snapshot cache'''
+    directory = tempfile.mkdtemp()
+    fake = backend(args)
+    extension = collection(fake, cache=SnapshotCache(path=Path(directory) / 'snapshots.sqlite'))
+    extension.asdataframe()
+    # rows edited on the snapshot's last day are fetched again, so move past it
+    fake.clock += 2 * DAY
+    return extension.asdataframe
+
+
+@benchmark
+def dedupe_hash(args):
+    '''exact dedupe of a read collection with the hash engine'''
+    extension = collection(backend(args))
+    dataframe = extension.asdataframe()
+    return lambda: extension.dedupe(dataframe, comparison_fields=FIELDS, engine='hash')
+
+
+@benchmark
+def dedupe_recordlinkage(args):
+    '''exact dedupe of a read collection by comparing hash indexed candidate pairs'''
+    extension = collection(backend(args))
+    dataframe = extension.asdataframe()
+    return lambda: extension.dedupe(dataframe, comparison_fields=FIELDS, engine='recordlinkage', workers=1)
+
+
+@benchmark
+def dedupe_partitioned(args):
+    '''out-of-core exact dedupe of a collection read chunk by chunk, within 16MB per partition'''
+    extension = collection(backend(args))
+    return lambda: extension.partitioned_duplicates(FIELDS, max_memory=16 * 1024 ** 2)
+
+
+@benchmark
+def dedupe_incremental(args):
+    '''indexed dedupe after 1% new rows'''
+    directory = tempfile.mkdtemp()
+    fake = backend(args)
+    extension = collection(fake, cache=SnapshotCache(path=Path(directory) / 'snapshots.sqlite'))
+    extension.indexed_duplicates(FIELDS)
+    fake.clock += DAY
+    for number in range(max(1, args.rows // 100)):
+        fake.add_row(**synthetic_row(args.rows * 10 + number, args.seed))
+    return lambda: extension.indexed_duplicates(FIELDS)
+
+
+@benchmark
+def sort(args):
+    '''sorting the multi-select values of every row and the view'''
+    fake = backend(args, schema=SCHEMA)
+    view = FakeNotionClient(fake).get_collection_view(fake.url)
+    return lambda: CollectionViewExtension(view).sort('tags')
+
+
+@benchmark
+def sync_load(args):
+    '''upserting a service's bookmarks, 10% of them new and 10% changed'''
+    fake = backend(args, schema=BOOKMARK_SCHEMA, rows=0)
+    for bookmark in bookmarks(range(args.rows)).to_dict('records'):
+        fake.add_row(**bookmark)
+    extension = collection(fake)
+    data = bookmarks(range(args.rows + args.rows // 10))
+    data.loc[data.index[:args.rows // 10], 'title'] = 'Changed title'
+    return lambda: GenericService().load(data, extension, style='upsert', key='bookmark_id')
+
+
+@benchmark
+def instapaper_extract(args):
+    '''listing every bookmark of a folder from bookmarks/list, 500 per page'''
+    session = FakeInstapaperSession({'archive': {str(x): f'h{x}' for x in range(args.rows)}}, latency=args.latency)
+    with mock.patch.object(InstapaperAPI, 'authorize'):
+        service = InstapaperAPI()
+    service.client = session
+    service._state = BookmarkState(Path(tempfile.mkdtemp()) / 'state.json')
+    return lambda: service.bookmarks('archive', incremental=False)
+
+
+def commit() -> str:
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    return result.stdout.strip() or 'unknown'
+
+
+def run(args: argparse.Namespace, names: List[str] = None) -> Dict:
+    '''
+        Runs benchmarks, returning the run's parameters and the seconds of every repeat per benchmark
+    '''
+    results = {}
+    for name in names or list(BENCHMARKS):
+        times = []
+        for _ in range(args.repeat):
+            call = BENCHMARKS[name](args)
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+        results[name] = {'min': min(times), 'median': statistics.median(times), 'times': times}
+    parameters = {x: getattr(args, x) for x in ('rows', 'duplicate_rate', 'schema', 'latency', 'seed', 'repeat')}
+    return {'commit': commit(), 'python': platform.python_version(), 'pandas': pd.__version__,
+            'parameters': parameters, 'results': results}
+
+
+def table(run: Dict, baseline: Dict = None) -> str:
+    '''
+        Formats a run's results, with the change in median against a baseline run when given
+    '''
+    header = ('benchmark', 'min', 'median') + (('baseline', 'change') if baseline else ())
+    rows = [header]
+    for name, result in run['results'].items():
+        row = (name, f"{result['min']:.4f}s", f"{result['median']:.4f}s")
+        if baseline:
+            before = baseline['results'].get(name)
+            row += (f"{before['median']:.4f}s", f"{result['median'] / before['median']:.2f}x") if before else ('-', '-')
+        rows.append(row)
+    widths = [max(len(row[x]) for row in rows) for x in range(len(header))]
+    return '\n'.join('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--schema', choices=list(SCHEMAS), default='bookmarks')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every fake Notion and Instapaper request takes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=None)
+    parser.add_argument('--output', default=None, help='Save the results as JSON')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    return parser
+
+
+def main():
+    args = parser().parse_args()
+    results = run(args, args.only)
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    if baseline and baseline['parameters'] != results['parameters']:
+        print(f"baseline {baseline['commit']} ran with different parameters: {baseline['parameters']}")
+    print(f"commit {results['commit']}, {results['parameters']['rows']} rows")
+    print(table(results, baseline))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
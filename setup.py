@@ -36,8 +36,14 @@ setup(
         'console_scripts': [
             'thought=thought.cli:cli',
         ],
+        'thought.services': [
+            'instapaper=thought.services.instapaper:InstapaperAPI',
+        ],
     },
     install_requires=requirements,
+    extras_require={
+        'arrow': ['pyarrow'],
+    },
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -0,0 +1,378 @@
+"""Local on-disk snapshot cache of collection rows"""
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from notion.collection import Collection
+from thought.client import prefetch_blocks
+from thought.settings import CACHE_DIRECTORY, NOTION_BATCH_SIZE, NOTION_CONCURRENCY
+from thought.utils import default_field, now
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rows (
+    collection_id TEXT NOT NULL,
+    block_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    last_edited_time INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (collection_id, block_id)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    collection_id TEXT PRIMARY KEY,
+    last_edited_time INTEGER NOT NULL,
+    refreshed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS collections (
+    page_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    block_id TEXT NOT NULL,
+    PRIMARY KEY (page_id, block_id)
+);
+CREATE TABLE IF NOT EXISTS dedupe_keys (
+    collection_id TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    block_id TEXT NOT NULL,
+    last_edited_time INTEGER NOT NULL,
+    version INTEGER,
+    high INTEGER,
+    low INTEGER,
+    PRIMARY KEY (collection_id, fields, block_id)
+);
+CREATE INDEX IF NOT EXISTS dedupe_keys_key ON dedupe_keys (collection_id, fields, high, low);
+'''
+
+
+@dataclass
+class CacheStats:
+    """
+    Counts of rows served from the snapshot versus fetched from Notion during a refresh
+    """
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclass
+class LocalStore:
+    """
+    A local SQLite database, with one connection per thread since sqlite connections can't be shared between threads
+    """
+    path: Path = default_field(Path(CACHE_DIRECTORY) / 'snapshots.sqlite')
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        columns = [x[1] for x in self.connection.execute('PRAGMA table_info(dedupe_keys)')]
+        if columns and ('digest' in columns or 'version' not in columns):
+            # duplicate key indexes of 64-bit digests, or without record versions, are dropped, and rebuilt from the
+            # snapshot rows on their next use
+            with self.connection:
+                self.connection.execute('DROP TABLE dedupe_keys')
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = sqlite3.connect(str(self.path), timeout=30)
+        return self._local.connection
+
+
+@dataclass
+class SnapshotCache(LocalStore):
+    """
+    A SQLite snapshot of collection rows keyed by block id, holding each row's raw Notion record and `last_edited_time`.
+
+    A refresh only queries rows edited at or after the newest `last_edited_time` in the snapshot, which needs a "Last edited time" property in the collection schema.
+    Without one, or when rows have been deleted since the snapshot, the whole collection is fetched again.
+    """
+    refresh: bool = False
+    stats: CacheStats = default_field(CacheStats(), init=False)
+
+    def _watermark(self, collection_id: str) -> int:
+        row = self.connection.execute('SELECT last_edited_time FROM snapshots WHERE collection_id = ?',
+                                      (collection_id,)).fetchone()
+        return row[0] if row else None
+
+    def _versions(self, collection_id: str, since: int) -> Dict[str, Tuple[int, int]]:
+        '''
+            Returns the cached `last_edited_time` and version of every row edited at or after `since`, by block id
+        '''
+        cursor = self.connection.execute('SELECT block_id, last_edited_time, record FROM rows '
+                                         'WHERE collection_id = ? AND last_edited_time >= ?', (collection_id, since))
+        return {block_id: (edited, json.loads(record).get('version')) for block_id, edited, record in cursor}
+
+    def _count(self, collection_id: str) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM rows WHERE collection_id = ?',
+                                       (collection_id,)).fetchone()[0]
+
+    @staticmethod
+    def _edited_property(collection: Collection) -> str:
+        for prop in collection.get_schema_properties():
+            if prop['type'] == 'last_edited_time':
+                return prop['id']
+        return None
+
+    def _store(self, collection_id: str, records: List[Dict], start: int = None) -> None:
+        '''
+            Upserts raw block records. New rows are appended after existing ones, rows keeping their position, unless `start`
+            sets the positions of every record.
+        '''
+        positions = {}
+        if start is None:
+            start = self.connection.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM rows WHERE collection_id = ?',
+                                            (collection_id,)).fetchone()[0]
+            if records:
+                positions = dict(self.connection.execute('SELECT block_id, position FROM rows WHERE collection_id = ?',
+                                                         (collection_id,)).fetchall())
+        values = []
+        for record in records:
+            position = positions.get(record['id'])
+            if position is None:
+                position, start = start, start + 1
+            values.append((collection_id, record['id'], position,
+                           record.get('last_edited_time', 0), json.dumps(record)))
+        self.connection.executemany('INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)', values)
+
+    def _save_watermark(self, collection_id: str) -> None:
+        watermark = self.connection.execute('SELECT COALESCE(MAX(last_edited_time), 0) FROM rows WHERE collection_id = ?',
+                                            (collection_id,)).fetchone()[0]
+        self.connection.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)',
+                                (collection_id, watermark, now().isoformat()))
+
+    def _full_refresh(self, collection: Collection, concurrency: int = NOTION_CONCURRENCY,
+                      batch_size: int = NOTION_BATCH_SIZE) -> List[Dict]:
+        '''
+            Replaces a collection's snapshot with every row, serialized and written `batch_size` rows at a time.
+
+            notion-py keeps each record the query returns in its client's record store, so the records themselves are held
+            in memory until the client is dropped, only their serialized copies are bounded.
+        '''
+        rows = collection.get_rows(limit=-1)
+        prefetch_blocks(collection._client, [block.id for block in rows], concurrency=concurrency)
+        records = []
+        with self.connection:
+            self.connection.execute('DELETE FROM rows WHERE collection_id = ?', (collection.id,))
+            for start in range(0, len(rows), batch_size):
+                # the records are notion-py's own, listing them doesn't copy them
+                chunk = [block.get() for block in rows[start:start + batch_size]]
+                self._store(collection.id, chunk, start=start)
+                records.extend(chunk)
+            self._save_watermark(collection.id)
+        self.stats.misses += len(records)
+        return records
+
+    def update(self, collection: Collection, concurrency: int = NOTION_CONCURRENCY) -> List[Dict]:
+        '''
+            Brings a collection's snapshot up to date, fetching only rows edited since the last snapshot where possible.
+            Row records missing from query results are fetched `concurrency` chunks at a time.
+
+            Returns
+            -------
+            The raw records fetched, every row's after a full refresh
+        '''
+        watermark = None if self.refresh else self._watermark(collection.id)
+        edited_property = self._edited_property(collection)
+        if watermark is None or edited_property is None:
+            if watermark is not None:
+                logger.warning("%s has no last edited time property, fetching the whole collection", collection.id)
+            return self._full_refresh(collection, concurrency)
+
+        # the date filter has day granularity, so drop rows edited earlier on the watermark's day client side
+        since = datetime.fromtimestamp(watermark / 1000, tz=timezone.utc).date().isoformat()
+        edited_filter = {'operator': 'and',
+                         'filters': [{'property': edited_property,
+                                      'filter': {'operator': 'date_is_on_or_after',
+                                                 'value': {'type': 'exact',
+                                                           'value': {'type': 'date', 'start_date': since}}}}]}
+        rows = collection.get_rows(limit=-1, filter=edited_filter)
+        prefetch_blocks(collection._client, [block.id for block in rows], concurrency=concurrency)
+        # edit times have minute granularity, so rows stamped with the watermark itself may have changed since, unless
+        # their cached edit time and version are the same
+        unchanged = self._versions(collection.id, watermark)
+        records = [x for x in (block.get() for block in rows) if x.get('last_edited_time', 0) >= watermark
+                   and unchanged.get(x['id']) != (x.get('last_edited_time', 0), x.get('version'))]
+        cached = self._count(collection.id)
+        new = len({x['id'] for x in records} - set(self.block_ids(collection.id)))
+
+        # a count that doesn't add up means rows were removed since the snapshot
+        total = collection.get_rows(limit=0).total
+        if cached + new != total:
+            logger.info("%s rows changed count since the last snapshot, fetching the whole collection", collection.id)
+            return self._full_refresh(collection, concurrency)
+
+        with self.connection:
+            self._store(collection.id, records)
+            self._save_watermark(collection.id)
+        self.stats.misses += len(records)
+        self.stats.hits += total - len(records)
+        return records
+
+    def remove(self, collection_id: str, block_ids: List[str]) -> None:
+        '''
+            Drops rows archived through this process, keeping the snapshot's row count in step with the collection
+        '''
+        with self.connection:
+            self.connection.executemany('DELETE FROM rows WHERE collection_id = ? AND block_id = ?',
+                                        [(collection_id, x) for x in block_ids])
+
+    def block_ids(self, collection_id: str) -> List[str]:
+        return [x[0] for x in self.connection.execute(
+            'SELECT block_id FROM rows WHERE collection_id = ? ORDER BY position', (collection_id,))]
+
+    def records(self, collection_id: str, batch_size: int) -> Iterator[List[Dict]]:
+        '''
+            Yields a collection's cached raw block records in batches of at most `batch_size`, in collection order
+        '''
+        cursor = self.connection.execute('SELECT record FROM rows WHERE collection_id = ? ORDER BY position',
+                                         (collection_id,))
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield [json.loads(x[0]) for x in batch]
+
+
+@dataclass
+class CollectionIndex(LocalStore):
+    """
+    A name to block id index of the collections under a page, so a collection can be found without loading every child of the page
+    """
+
+    def get(self, page_id: str, name: str) -> List[str]:
+        return [x[0] for x in self.connection.execute(
+            'SELECT block_id FROM collections WHERE page_id = ? AND name = ? ORDER BY block_id', (page_id, name))]
+
+    def add(self, page_id: str, name: str, block_id: str) -> None:
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO collections VALUES (?, ?, ?)', (page_id, name, block_id))
+
+    def rebuild(self, page_id: str, names: Dict[str, List[str]]) -> None:
+        '''
+            Replaces a page's entries with the block ids of each collection name
+        '''
+        with self.connection:
+            self.connection.execute('DELETE FROM collections WHERE page_id = ?', (page_id,))
+            self.connection.executemany('INSERT OR REPLACE INTO collections VALUES (?, ?, ?)',
+                                        [(page_id, name, block_id) for name, block_ids in names.items()
+                                         for block_id in block_ids])
+
+
+@dataclass
+class IndexStats:
+    """
+    Size and upkeep of a duplicate key index
+    """
+    size: int = 0  # indexed rows
+    keys: int = 0  # distinct digests
+    duplicate_keys: int = 0  # digests shared by more than one row
+    hashed: int = 0  # rows hashed by the last update
+    removed: int = 0  # rows dropped by the last update
+    seconds: float = 0.0  # time the last update or rebuild took
+
+    def __str__(self):
+        return (f"{self.size} rows, {self.keys} keys, {self.duplicate_keys} duplicated, "
+                f"{self.hashed} hashed and {self.removed} removed in {self.seconds:.2f}s")
+
+
+@dataclass
+class DuplicateIndex(LocalStore):
+    """
+    A persistent index of the 128-bit digests of each snapshot row's comparison fields, as signed `high` and `low` halves,
+    per collection and set of fields.
+
+    Kept next to the snapshot rows in the same database, so the rows that changed since they were indexed are found with a
+    join on `last_edited_time` and the record `version`, and only those are hashed again. Notion rounds edit times to the
+    minute, the version tells apart edits made within it. Rows with a missing comparison value are indexed without a
+    digest, since they never match.
+    """
+
+    @staticmethod
+    def _fields(fields: List[str]) -> str:
+        return ','.join(fields)
+
+    def changed(self, collection_id: str, fields: List[str], batch_size: int) -> Iterator[List[Dict]]:
+        '''
+            Yields the raw records of snapshot rows that are new or edited since they were indexed
+        '''
+        cursor = self.connection.execute(
+            'SELECT r.record FROM rows r LEFT JOIN dedupe_keys d '
+            'ON d.collection_id = r.collection_id AND d.fields = ? AND d.block_id = r.block_id '
+            'WHERE r.collection_id = ? AND (d.block_id IS NULL OR d.last_edited_time != r.last_edited_time '
+            "OR d.version IS NOT json_extract(r.record, '$.version')) "
+            'ORDER BY r.position', (self._fields(fields), collection_id))
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield [json.loads(x[0]) for x in batch]
+
+    def store(self, collection_id: str, fields: List[str], keys: Iterable[Tuple[str, int, int, int, int]]) -> None:
+        '''
+            Upserts (block id, last edited time, version, high, low) entries
+        '''
+        fields = self._fields(fields)
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO dedupe_keys VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        [(collection_id, fields, block_id, edited, version, high, low)
+                                         for block_id, edited, version, high, low in keys])
+
+    def prune(self, collection_id: str, fields: List[str]) -> int:
+        '''
+            Drops entries of rows no longer in the snapshot, returning how many
+        '''
+        with self.connection:
+            return self.connection.execute(
+                'DELETE FROM dedupe_keys WHERE collection_id = ? AND fields = ? '
+                'AND block_id NOT IN (SELECT block_id FROM rows WHERE collection_id = ?)',
+                (collection_id, self._fields(fields), collection_id)).rowcount
+
+    def groups(self, collection_id: str, fields: List[str], block_ids: List[str] = None) -> Dict[Tuple[int, int], List[str]]:
+        '''
+            Returns the block ids sharing each digest that more than one row has, in collection order, only the digests of
+            `block_ids` when given. Entries of rows edited since they were indexed are left out until they're indexed again.
+        '''
+        fields = self._fields(fields)
+        if block_ids is None:
+            keys = ('SELECT high, low FROM dedupe_keys WHERE collection_id = ? AND fields = ? AND high IS NOT NULL '
+                    'GROUP BY high, low HAVING COUNT(*) > 1')
+            parameters = [collection_id, fields]
+        else:
+            keys = ('SELECT high, low FROM dedupe_keys WHERE collection_id = ? AND fields = ? AND high IS NOT NULL '
+                    'AND block_id IN (SELECT value FROM json_each(?))')
+            parameters = [collection_id, fields, json.dumps(list(block_ids))]
+        groups = {}
+        for high, low, block_id in self.connection.execute(
+                'SELECT d.high, d.low, d.block_id FROM dedupe_keys d JOIN rows r '
+                'ON r.collection_id = d.collection_id AND r.block_id = d.block_id '
+                'AND r.last_edited_time = d.last_edited_time '
+                "AND d.version IS json_extract(r.record, '$.version') "
+                f'WHERE d.collection_id = ? AND d.fields = ? AND (d.high, d.low) IN ({keys}) '
+                'ORDER BY d.high, d.low, r.position', [collection_id, fields] + parameters):
+            groups.setdefault((high, low), []).append(block_id)
+        return {key: group for key, group in groups.items() if len(group) > 1}
+
+    def stats(self, collection_id: str, fields: List[str]) -> IndexStats:
+        size = self.connection.execute('SELECT COUNT(*) FROM dedupe_keys WHERE collection_id = ? AND fields = ?',
+                                       (collection_id, self._fields(fields))).fetchone()[0]
+        keys, duplicate_keys = self.connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(rows > 1), 0) FROM (SELECT COUNT(*) AS rows FROM dedupe_keys '
+            'WHERE collection_id = ? AND fields = ? AND high IS NOT NULL GROUP BY high, low)',
+            (collection_id, self._fields(fields))).fetchone()
+        return IndexStats(size=size, keys=keys, duplicate_keys=duplicate_keys)
+
+    def clear(self, collection_id: str, fields: List[str]) -> None:
+        with self.connection:
+            self.connection.execute('DELETE FROM dedupe_keys WHERE collection_id = ? AND fields = ?',
+                                    (collection_id, self._fields(fields)))
@@ -4,20 +4,31 @@ import sys
 
 import click
 
-from thought.client import NotionAPI
-from thought.core import CollectionExtension, CollectionViewExtension, Output
-from thought.exceptions import (
-    CollectionMustAlreadyExistException,
-    LoadDestinationNotUniqueException,
-)
-from thought.service import GenericService, Registry
-from thought.services.instapaper import InstapaperAPI
+# heavy modules (pandas, recordlinkage, notion) are imported inside the commands that use them, keeping `--help` fast
 from thought.settings import (
     LOGGING_DATE_FORMAT,
     LOGGING_FORMAT,
     LOGGING_PATH,
+    DEDUPE_CHUNK_SIZE,
+    DEDUPE_ENGINE,
+    DEDUPE_ENGINES,
+    DEDUPE_INDEX_STRATEGIES,
+    DEDUPE_INDEX_STRATEGY,
+    DEDUPE_MATCH_THRESHOLD,
+    DEDUPE_WINDOW,
+    DEDUPE_WORKERS,
+    EXPORT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    INSTAPAPER_ALL_FOLDERS,
+    INSTAPAPER_BOOKMARKS_DIRECTORY,
+    LOAD_STYLES,
+    NOTION_CONCURRENCY,
     NOTION_SERVICES_DIRECTORY,
     SERVICES_CONFIGURATION_PATH,
+    SYNC_WORKERS,
+    WATCH_INTERVAL,
+    WATCH_MAX_BATCH,
+    WATCH_MAX_INTERVAL,
 )
 
 FILE_NAME = __name__
@@ -35,34 +46,142 @@ logger = logging.getLogger()
 
 class Config:
     """Configuration Object"""
+    no_cache: bool = False
+    refresh: bool = False
+    concurrency: int = NOTION_CONCURRENCY
 
     def add_url_prefix(url):
         prefix = 'https://www.notion.so/'
         return prefix + url
 
+    @property
+    def client(self):
+        # created on first use, so commands that never talk to Notion don't pay for a client
+        if '_client' not in self.__dict__:
+            from thought.client import NotionAPI
+            self._client = NotionAPI().client
+        return self._client
+
+    @property
+    def registry(self):
+        if '_registry' not in self.__dict__:
+            from thought.service import Registry
+            self._registry = Registry()
+        return self._registry
+
+    @property
+    def cache(self):
+        if '_cache' not in self.__dict__:
+            from thought.cache import SnapshotCache
+            self._cache = None if self.no_cache else SnapshotCache(refresh=self.refresh)
+        return self._cache
+
 CONTEXT = click.make_pass_decorator(Config, ensure=True)
 
 
+class ByteSize(click.ParamType):
+    """A size in bytes, with an optional KB, MB or GB suffix"""
+    name = 'size'
+    units = {'GB': 1024 ** 3, 'MB': 1024 ** 2, 'KB': 1024, 'B': 1}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        text = str(value).strip().upper()
+        for unit, factor in self.units.items():
+            if text.endswith(unit):
+                text, multiplier = text[:-len(unit)], factor
+                break
+        else:
+            multiplier = 1
+        try:
+            return int(float(text) * multiplier)
+        except ValueError:
+            self.fail(f"{value} is not a size, e.g. 512MB", param, ctx)
+
+
+def report_transport():
+    # only commands that sent requests have imported the transport
+    transport = sys.modules.get('thought.transport')
+    if transport is not None and transport.TRANSPORT.metrics.requests:
+        click.echo(f"http: {transport.TRANSPORT.metrics}", err=True)
+
+
+def report_profile(stats: str, trace: str):
+    from thought.profile import PROFILER
+
+    PROFILER.disable()
+    click.echo(PROFILER.table(), err=True)
+    if stats:
+        PROFILER.dump_stats(stats)
+        click.echo(f"cProfile stats written to {stats}", err=True)
+    if trace:
+        PROFILER.dump_trace(trace)
+        click.echo(f"span trace written to {trace}", err=True)
+
+
 @click.group()
 @click.option('--service_config_directory', default='../services/', help='Directory where {service}.toml configuration file is loaded from. Defaults to \'/services/\'')
+@click.option('--no-cache', is_flag=True, default=False, help='Read collections straight from Notion instead of through the local snapshot cache')
+@click.option('--refresh', is_flag=True, default=False, help='Rebuild the local snapshot cache of every collection read from scratch')
+@click.option('--concurrency', default=NOTION_CONCURRENCY, help='Number of Notion record chunks fetched at once when reading collections. Above 1 reads go through the async client')
+@click.option('--profile', is_flag=True, default=False, help='Time the fetch, decode, index, compare, classify and write stages and print a summary table to stderr')
+@click.option('--profile-stats', type=click.Path(dir_okay=False, writable=True), default=None, help='Write a cProfile of the whole command to this pstats file. Implies --profile')
+@click.option('--profile-trace', type=click.Path(dir_okay=False, writable=True), default=None, help='Write every stage span to this JSON trace file, viewable in chrome://tracing or Perfetto. Implies --profile')
 @CONTEXT
 def cli(ctx,
-        service_config_directory):
+        service_config_directory,
+        no_cache: bool,
+        refresh: bool,
+        concurrency: int,
+        profile: bool,
+        profile_stats: str,
+        profile_trace: str):
     '''
         Thought - A Notion CLI
     '''
     ctx.service_config_directory = service_config_directory
-    ctx.registry = Registry()
-    ctx.client = NotionAPI().client
+    ctx.no_cache = no_cache
+    ctx.refresh = refresh
+    ctx.concurrency = concurrency
+    click.get_current_context().call_on_close(report_transport)
+    if profile or profile_stats or profile_trace:
+        from thought.profile import PROFILER
+        PROFILER.enable(cprofile=bool(profile_stats))
+        click.get_current_context().call_on_close(lambda: report_profile(profile_stats, profile_trace))
 
 
 @cli.command('dedupe')
 @click.argument('collection_url')
 @click.option('-f', '--field', multiple=True, help='Deduplication field. Can be one or many. Defaults to all collection object properties')
+@click.option('--index-strategy', type=click.Choice(DEDUPE_INDEX_STRATEGIES), default=DEDUPE_INDEX_STRATEGY, help='How candidate duplicate pairs are generated. Defaults to "hash", an O(n) grouping on the deduplication fields')
+@click.option('--block-on', multiple=True, help='Field to block or sort on for the "block" and "sortedneighbourhood" strategies. Can be one or many. Defaults to the deduplication fields')
+@click.option('--window', default=DEDUPE_WINDOW, help='Window size for the "sortedneighbourhood" strategy')
+@click.option('--engine', type=click.Choice(DEDUPE_ENGINES), default=DEDUPE_ENGINE, help='"hash" finds exact duplicates in one hashed pass, "recordlinkage" indexes and compares candidate pairs. Defaults to "auto"')
+@click.option('-c', '--compare', multiple=True, help='Per field comparison as field[:method[:threshold[:weight]]], method being one of exact, string, url, numeric or date. e.g. "title:string:0.9" or "url:url". Can be one or many')
+@click.option('--match-threshold', default=DEDUPE_MATCH_THRESHOLD, help='Weighted comparison score, 0 to 1, for a pair to count as duplicates. Defaults to 1, every field matching')
+@click.option('--workers', default=DEDUPE_WORKERS, help='Number of processes to compare candidate pairs with. Defaults to the number of CPUs')
+@click.option('--chunk-size', default=DEDUPE_CHUNK_SIZE, help='Number of candidate pairs compared per block')
+@click.option('--incremental', is_flag=True, default=False, help='Find exact duplicates through a duplicate key index kept in the snapshot cache, only hashing rows added or edited since the last run. Needs the cache')
+@click.option('--rebuild', is_flag=True, default=False, help='Drop the duplicate key index and hash every row again. Implies --incremental')
+@click.option('--max-memory', type=ByteSize(), default=None, help='Find exact duplicates out of core: key digests are spilled to disk in hash partitions, each deduped within this much memory, e.g. 512MB. Only the dedupe is bounded: while a cold or outdated snapshot cache is refreshed, notion-py holds every row record fetched in memory')
+@click.option('--dry-run', is_flag=True, default=False, help='Print the rows that would be archived without changing the collection')
 @CONTEXT
 def dedupe(ctx,
            collection_url: str,
-           field):
+           field,
+           index_strategy: str,
+           block_on,
+           window: int,
+           engine: str,
+           compare,
+           match_threshold: float,
+           workers: int,
+           chunk_size: int,
+           incremental: bool,
+           rebuild: bool,
+           max_memory: int,
+           dry_run: bool):
     '''
         Removes dupelicate items in a specified collection view
 
@@ -70,14 +189,65 @@ def dedupe(ctx,
         ---------
 
         collection: A URL to a collection view
+
+        Options
+        ---------
+        index_strategy: One of full, block, sortedneighbourhood or hash
+        block_on: Fields to block or sort on
+        window: Sorted neighbourhood window size
+        engine: One of auto, hash or recordlinkage
+        compare: Per field comparison specs
+        match_threshold: Score a candidate pair needs to be classified as a duplicate
+        workers: Number of comparison processes
+        chunk_size: Candidate pairs per comparison block
+        incremental: Use the persistent duplicate key index
+        rebuild: Rebuild the duplicate key index
+        max_memory: Bytes each partition of an out-of-core dedupe is deduped in
+        dry_run: Only print the change plan
     '''
+    from thought.core import CollectionExtension, SyncPlan
+    from thought.dedupe import Comparator
+
     client = ctx.client
     col_view = client.get_collection_view(collection_url)
-    collection = CollectionExtension(col_view.collection)
-    deduped_df = collection.dedupe(comparison_fields=list(field)) if field else collection.dedupe()
-    collection.sync(deduped_df, id_col='id') # call to sync collection objects property data with dataframe records using object id as key
-    # above does nothing...
-    breakpoint()
+    collection = CollectionExtension(col_view.collection, cache=ctx.cache, concurrency=ctx.concurrency)
+    if incremental or rebuild or max_memory:
+        if max_memory and (incremental or rebuild):
+            raise click.UsageError("pick one of --incremental and --max-memory")
+        if (incremental or rebuild) and ctx.cache is None:
+            raise click.UsageError("--incremental needs the snapshot cache, drop --no-cache")
+        if compare or engine == 'recordlinkage':
+            raise click.UsageError("--incremental and --max-memory only find exact duplicates, drop --compare and --engine")
+        if max_memory:
+            duplicates = collection.partitioned_duplicates(list(field), max_memory=max_memory)
+        else:
+            duplicates, stats = collection.indexed_duplicates(list(field), rebuild=rebuild)
+            click.echo(f"duplicate index: {stats}")
+        # only the duplicates' block ids are archived, without reading the collection into a dataframe
+        plan = collection._write(SyncPlan(archives=duplicates), dry_run=dry_run)
+        if ctx.cache is not None and not dry_run:
+            ctx.cache.remove(collection.collection.id, duplicates)
+        click.echo(plan)
+        if plan.stats:
+            click.echo(plan.stats)
+        return
+
+    dataframe = collection.asdataframe()
+    deduped_df = collection.dedupe(dataframe,
+                                   comparison_fields=list(field),
+                                   index_strategy=index_strategy,
+                                   block_on=list(block_on),
+                                   window=window,
+                                   engine=engine,
+                                   comparators=[Comparator.from_spec(x) for x in compare],
+                                   match_threshold=match_threshold,
+                                   workers=workers,
+                                   chunk_size=chunk_size)
+    # sync collection objects property data with dataframe records using object id as key, archiving the duplicates
+    plan = collection.sync(deduped_df, id_col='id', current_df=dataframe, dry_run=dry_run)
+    click.echo(plan)
+    if plan.stats:
+        click.echo(plan.stats)
 
 @cli.command('sort')
 @click.argument('url')
@@ -88,12 +258,16 @@ def dedupe(ctx,
 @click.option('--sort_multiselect_record_values', is_flag=True, default=False, help="If the provided field is a multi-select and the --sort_multiselect_record_values flag is passed, \
                                                                                      sorts each record's multi-select field value before sorting the entire collection view by \
                                                                                      the multi-select field")
+@click.option('--descending', is_flag=True, default=False, help='Sort in descending order')
+@click.option('--dry-run', is_flag=True, default=False, help='Count the rows that would be rewritten without changing the collection')
 @CONTEXT
 def sort(ctx,
          url,
          field,
-         sort_field_values,
-         sort_multiselect_values) -> None:
+         sort_multiselect_schema_values: bool,
+         sort_multiselect_record_values: bool,
+         descending: bool,
+         dry_run: bool) -> None:
     '''
         Sorts a provided field's attributes in alpha-numeric order
 
@@ -105,28 +279,57 @@ def sort(ctx,
 
         Options
         ---------
-        sort_field_values: Sorts a multi-select field's possible values instead of sorting the collection view's actual records
-        sort_multiselect_values: If the provided field is a multi-select, sorts of the multi-select values before sorting the collection view by the multi-select field
-        ascending: Sorts in ascending order by default
+        sort_multiselect_schema_values: Sorts a multi-select field's possible values
+        sort_multiselect_record_values: If the provided field is a multi-select, sorts of the multi-select values before sorting the collection view by the multi-select field
+        descending: Sorts in descending order instead of ascending
+        dry_run: Only report the rows that would be rewritten
         
     '''
+    from thought.core import CollectionViewExtension
+
     client = ctx.client
     col_view = client.get_collection_view(url)
-    collection_view = CollectionViewExtension(col_view)
-    collection_view.sort(field=field, 
-                         sort_multiselect_values=sort_multiselect_values,
-                         )
+    collection_view = CollectionViewExtension(col_view, cache=ctx.cache, concurrency=ctx.concurrency)
+    report = collection_view.sort(field=field, 
+                                  sort_multiselect_values=sort_multiselect_record_values,
+                                  sort_multiselect_schema_values=sort_multiselect_schema_values,
+                                  ascending=not descending,
+                                  dry_run=dry_run,
+                                  )
+    click.echo(report)
+    if report.stats:
+        click.echo(report.stats)
 
 @cli.command('sync')
-@click.argument('service')#, help='The service you want to sync data from')
-@click.argument('action')#, help='The sync action you want to perform with the specified service')
+@click.argument('service', required=False)#, help='The service you want to sync data from')
+@click.argument('action', required=False)#, help='The sync action you want to perform with the specified service')
 @click.option('--target_collection', default=NOTION_SERVICES_DIRECTORY, help='The target page you want the output of the sync action to persist in. Will create a Collection in this object with the service name as the title.')
 # @click.option('--service_definition', default=SERVICES_CONFIGURATION_PATH, help='The target collection you want the output of the sync action to persist in')
+@click.option('--style', type=click.Choice(LOAD_STYLES), default='upsert', help='"append" creates every row, "upsert" only writes new or changed rows and "replace" also archives rows missing from the service. Defaults to "upsert"')
+@click.option('--key', default=None, help='The field rows are matched on for "upsert" and "replace". Defaults to the service\'s own id field, e.g. "bookmark_id"')
+@click.option('--folder', multiple=True, default=[INSTAPAPER_BOOKMARKS_DIRECTORY], help='A folder to sync from. Can be one or many. Defaults to "archive"')
+@click.option('--all-folders', is_flag=True, default=False, help='Sync from every folder the service has, fetched concurrently')
+@click.option('--full', is_flag=True, default=False, help='Fetch everything from the service instead of only what changed since the last sync. Implied by "--style replace"')
+@click.option('--all', 'sync_all', is_flag=True, default=False, help='Sync every service action that has a {service}_{action} collection on the target page')
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False), help='A TOML manifest of [[sync]] jobs, each with a service, action and optionally a target, style, key and arguments')
+@click.option('--create', is_flag=True, default=False, help='Create missing {service}_{action} collections on the target page, their schema inferred from the synced data')
+@click.option('--workers', default=SYNC_WORKERS, help='Number of sync jobs run at once')
+@click.option('--dry-run', is_flag=True, default=False, help='Print the change plan without changing the collection')
 @CONTEXT
 def sync(ctx,
          service: str,
          action: str,
-         target_collection: str) -> None:
+         target_collection: str,
+         style: str,
+         key: str,
+         folder,
+         all_folders: bool,
+         full: bool,
+         sync_all: bool,
+         manifest: str,
+         create: bool,
+         workers: int,
+         dry_run: bool) -> None:
     '''
         Syncs data from an external data provider to a Collection in your Notion environment.
 
@@ -139,42 +342,215 @@ def sync(ctx,
         Options
         ---------
         target: The target page you want the output of the sync action to persist in. Will create a Collection in this object with the service name as the title.
+        style: One of append, upsert or replace
+        key: The field rows are matched on
+        folder: Folders to sync from
+        all_folders: Sync from every folder
+        full: Fetch everything instead of only what changed since the last sync
+        all: Sync every service action with a collection on the target page
+        manifest: A TOML manifest of sync jobs
+        create: Create missing target collections
+        workers: Number of sync jobs run at once
+        dry_run: Only print the change plan
 
         Example
         ---------
         
         `thought sync instapaper bookmarks`
+        `thought sync --all`
+        `thought sync --manifest sync.toml`
     '''
-    client = ctx.client
-    registry = ctx.registry
-    registered_service = registry.register(service)
-    service_instance = registered_service()
-
-    if not service_instance:
-        logging.INFO("%s service not defined and configured properly. Please refer to docs.".format(service))
-    
-    if not service_instance[action]:
-        logging.INFO("%s action not defined for specified service. Please refer to docs.".format(action))
-
-    data = service_instance.call(action, folder='archive') #TODO: onboard arbitrary key: values from click options here
-    
-    page = client.get_block(target_collection)
-    collection_name = f'{service}_{action}'
-
-    # filter through possible collections in the service pages children, collection
-    collection = [x for x in page.children if collection_name == x.title]
-
-    if not collection:
-        #TODO: create new collection if nothing matches our {service}_{action} nameing pattern -- blocked by API support as of 8/11/20
-        raise CollectionMustAlreadyExistException(f"{collection_name} must already exist")
-    
-    if len(collection) > 1:
-        raise LoadDestinationNotUniqueException(f"Target collection must be unique: remove existing collection {collection_name} or pick a new function name")
-    
-    # drop to base object since we're confident this list should only contain 1 object
-    collection = collection[0].collection
-    service_instance.load(data, collection)
-    breakpoint()
+    from thought.runner import SyncJob, SyncRunner, read_manifest, timing_table
+
+    # flags the user actually passed, --folder always has a default
+    source = click.get_current_context().get_parameter_source('folder')
+    flags = {'--folder': source is not None and source.name != 'DEFAULT', '--all-folders': all_folders, '--full': full}
+    if manifest or sync_all:
+        passed = [flag for flag, given in flags.items() if given]
+        if passed:
+            raise click.UsageError(f"{', '.join(passed)} only apply to a single service and action, "
+                                   f"not to --all or --manifest")
+
+    runner = SyncRunner(ctx.client, registry=ctx.registry, cache=ctx.cache, workers=workers, dry_run=dry_run,
+                        create_missing=create)
+    if manifest:
+        jobs = read_manifest(manifest)
+    elif sync_all:
+        jobs = runner.discover(target_collection)
+    elif service and action:
+        from thought.exceptions import ServiceNotRegisteredException
+
+        #TODO: onboard arbitrary key: values from click options here
+        arguments = {'folder': INSTAPAPER_ALL_FOLDERS if all_folders else list(folder),
+                     'incremental': not (full or style == 'replace')}
+        try:
+            service_class = ctx.registry.register(service)
+        except ServiceNotRegisteredException as e:
+            raise click.UsageError(str(e))
+        # only pass what the action's signature takes
+        arguments = service_class.accepted_arguments(action, arguments)
+        unsupported = [flag for flag, argument in (('--folder', 'folder'), ('--all-folders', 'folder'),
+                                                   ('--full', 'incremental'))
+                       if flags[flag] and argument not in arguments]
+        if unsupported:
+            raise click.UsageError(f"{service} {action} does not support {', '.join(unsupported)}")
+        jobs = [SyncJob(service, action, target=target_collection, style=style, key=key, arguments=arguments)]
+    else:
+        raise click.UsageError("Pass a service and action, --all or --manifest")
+
+    results = runner.run(jobs)
+    if len(results) == 1 and results[0].plan is not None:
+        click.echo(results[0].plan)
+        if results[0].plan.stats:
+            click.echo(results[0].plan.stats)
+    for result in results:
+        for step, seconds in result.timings.items():
+            click.echo(f"{result.job.name} {step}: {seconds:.2f}s")
+    click.echo(timing_table(results))
+    if any(result.error is not None for result in results):
+        sys.exit(1)
+
+
+@cli.command('export')
+@click.argument('collection_url')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'file_format', type=click.Choice(EXPORT_FORMATS), default=None, help='File format. Defaults to the path\'s suffix, or "parquet". parquet and arrow need pyarrow installed')
+@click.option('--chunk-size', default=EXPORT_CHUNK_SIZE, help='Rows held in memory and written at once')
+@CONTEXT
+def export(ctx,
+           collection_url: str,
+           path: str,
+           file_format: str,
+           chunk_size: int) -> None:
+    '''
+        Exports a collection's rows to a Parquet, Arrow IPC or CSV file, chunk by chunk
+
+        Arguments
+        ---------
+
+        collection_url: A URL to a collection view
+        path: The file to write
+
+        Options
+        ---------
+        format: One of parquet, arrow or csv
+        chunk_size: Rows held in memory at once
+
+        Example
+        ---------
+
+        `thought export https://www.notion.so/... bookmarks.parquet`
+    '''
+    from thought.core import Output
+
+    output = Output(ctx.client.get_collection_view(collection_url), cache=ctx.cache, concurrency=ctx.concurrency)
+    rows = output.export(path, format=file_format, chunk_size=chunk_size)
+    click.echo(f"exported {rows} rows to {path}")
+
+
+@cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('collection_url')
+@click.option('--format', 'file_format', type=click.Choice(EXPORT_FORMATS), default=None, help='File format. Defaults to the path\'s suffix, or "parquet"')
+@click.option('--style', type=click.Choice(LOAD_STYLES), default='append', help='"append" creates every row, "upsert" only writes new or changed rows and "replace" also archives rows missing from the file. Defaults to "append"')
+@click.option('--key', default=None, help='The field rows are matched on for "upsert" and "replace"')
+@click.option('--chunk-size', default=EXPORT_CHUNK_SIZE, help='Rows read and written at once')
+@click.option('--dry-run', is_flag=True, default=False, help='Print the change plan without changing the collection')
+@CONTEXT
+def import_(ctx,
+            path: str,
+            collection_url: str,
+            file_format: str,
+            style: str,
+            key: str,
+            chunk_size: int,
+            dry_run: bool) -> None:
+    '''
+        Imports an exported Parquet, Arrow IPC or CSV file into a collection, chunk by chunk
+
+        Arguments
+        ---------
+
+        path: An exported file
+        collection_url: A URL to the collection view rows are loaded into
+
+        Options
+        ---------
+        format: One of parquet, arrow or csv
+        style: One of append, upsert or replace
+        key: The field rows are matched on
+        chunk_size: Rows read and written at once
+        dry_run: Only print the change plan
+    '''
+    from thought.core import CollectionExtension
+    from thought.export import import_collection
+
+    collection = CollectionExtension(ctx.client.get_collection_view(collection_url).collection, cache=ctx.cache,
+                                     concurrency=ctx.concurrency)
+    report = import_collection(collection, path, format=file_format, style=style, key=key, chunk_size=chunk_size,
+                               dry_run=dry_run)
+    click.echo(report)
+    if report.plan.stats:
+        click.echo(report.plan.stats)
+
+
+@cli.command('watch')
+@click.argument('collection_url')
+@click.option('-f', '--field', multiple=True, help='Deduplication field. Can be one or many. Defaults to every writable collection property')
+@click.option('-s', '--sort-field', multiple=True, help='A multi-select field whose values are kept sorted. Can be one or many')
+@click.option('--no-dedupe', is_flag=True, default=False, help='Only keep multi-select values sorted')
+@click.option('--interval', default=WATCH_INTERVAL, help='Seconds between polls for edited rows')
+@click.option('--max-interval', default=WATCH_MAX_INTERVAL, help='Polls slow down to this many seconds while nothing is edited')
+@click.option('--max-batch', default=WATCH_MAX_BATCH, help='Edited rows processed per poll, the rest are processed by the following polls')
+@click.option('--iterations', type=int, default=None, help='Stop after this many polls. Defaults to running until interrupted')
+@click.option('--dry-run', is_flag=True, default=False, help='Log what would be archived or sorted without changing the collection')
+@CONTEXT
+def watch(ctx,
+          collection_url: str,
+          field,
+          sort_field,
+          no_dedupe: bool,
+          interval: float,
+          max_interval: float,
+          max_batch: int,
+          iterations: int,
+          dry_run: bool) -> None:
+    '''
+        Watches a collection, deduping and sorting rows as they are edited
+
+        Rows edited since the snapshot cache's last refresh are polled for and only those rows are checked, against the
+        persistent duplicate index of every row's dedupe fields, brought up to date at start up.
+
+        Arguments
+        ---------
+
+        collection_url: A URL to a collection view
+
+        Options
+        ---------
+        field: Deduplication fields
+        sort_field: Multi-select fields to keep sorted
+        no_dedupe: Only sort
+        interval: Seconds between polls
+        max_interval: Longest wait between polls of an idle collection
+        max_batch: Edited rows processed per poll
+        iterations: Number of polls before stopping
+        dry_run: Only log the changes
+    '''
+    from thought.core import CollectionExtension
+    from thought.watch import Watcher
+
+    if ctx.cache is None:
+        raise click.UsageError("watch reads edits through the snapshot cache, drop --no-cache")
+    collection = CollectionExtension(ctx.client.get_collection_view(collection_url).collection, cache=ctx.cache,
+                                     concurrency=ctx.concurrency)
+    watcher = Watcher(collection, fields=list(field), sort_fields=list(sort_field), dedupe=not no_dedupe,
+                      interval=interval, max_interval=max_interval, max_batch=max_batch, dry_run=dry_run)
+    try:
+        watcher.run(iterations=iterations)
+    except KeyboardInterrupt:
+        pass
+    click.echo(watcher.writer.stats)
 
 
 if __name__ == "__main__":
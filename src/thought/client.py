@@ -1,11 +1,19 @@
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List
 
 from notion.client import NotionClient
-from thought.settings import NOTION_ACCESS_TOKEN
+from thought.settings import NOTION_ACCESS_TOKEN, NOTION_BATCH_SIZE, NOTION_CONCURRENCY
+from thought.transport import TRANSPORT
 
 
 def get_client(token):
-    return NotionClient(token_v2=token)
+    client = NotionClient(token_v2=token)
+    # replaces notion-py's own retrying adapter with the shared, rate limited one
+    TRANSPORT.mount(client.session)
+    return client
 
 
 class NotionAPI:
@@ -21,3 +29,65 @@ class NotionAPI:
 
         if self.client is None:
             self.client = get_client(self.token)
+
+
+@dataclass
+class AsyncNotionAPI:
+    """
+    asyncio front end of a NotionClient that fetches records in chunks, at most `concurrency` requests at a time.
+
+    Requests still go through the client's session, and so through the shared transport's rate limits and retries, on a
+    thread pool sized to the concurrency. Fetched records land in the client's record store like notion-py's own.
+    """
+    client: NotionClient
+    concurrency: int = NOTION_CONCURRENCY
+    chunk_size: int = NOTION_BATCH_SIZE
+
+    async def _post(self, executor: ThreadPoolExecutor, semaphore: asyncio.Semaphore, endpoint: str, data: Dict) -> Dict:
+        async with semaphore:
+            response = await asyncio.get_running_loop().run_in_executor(executor, self.client.post, endpoint, data)
+        return response.json()
+
+    async def get_records(self, table: str, ids: List[str]) -> Dict[str, Dict]:
+        '''
+            Fetches records of a table with one syncRecordValues request per chunk of ids, returning them by id
+        '''
+        semaphore = asyncio.Semaphore(self.concurrency)
+        chunks = [ids[x:x + self.chunk_size] for x in range(0, len(ids), self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = await asyncio.gather(*(
+                self._post(executor, semaphore, 'syncRecordValues',
+                           {'requests': [{'pointer': {'table': table, 'id': x}, 'version': -1} for x in chunk]})
+                for chunk in chunks))
+
+        records = {}
+        for result in results:
+            recordmap = result.get('recordMap', {})
+            # stored from the event loop's thread only, the record store isn't thread safe
+            self.client._store.store_recordmap(recordmap)
+            records.update({x: y['value'] for x, y in recordmap.get(table, {}).items() if y.get('value')})
+        return records
+
+    def fetch(self, table: str, ids: List[str]) -> Dict[str, Dict]:
+        '''
+            Blocking `get_records`, for callers outside of an event loop
+        '''
+        return asyncio.run(self.get_records(table, ids))
+
+
+def prefetch_blocks(client: NotionClient,
+                    block_ids: List[str],
+                    concurrency: int = NOTION_CONCURRENCY,
+                    chunk_size: int = NOTION_BATCH_SIZE) -> None:
+    '''
+        Loads the block records the client's record store is missing, a chunk per request instead of a request per block.
+        Chunks are fetched concurrently through AsyncNotionAPI when `concurrency` is above 1.
+    '''
+    missing = [x for x in block_ids if client._store.get_current_version('block', x) == -1]
+    if not missing:
+        return
+    if concurrency > 1:
+        AsyncNotionAPI(client, concurrency=concurrency, chunk_size=chunk_size).fetch('block', missing)
+        return
+    for start in range(0, len(missing), chunk_size):
+        client.refresh_records(block=missing[start:start + chunk_size])
@@ -1,13 +1,50 @@
 """Main module. If include_dataclasses_scaffolding is enabled, you will see Data Class scaffolding here"""
+import logging
+import time
+from copy import deepcopy
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, List
+from itertools import islice
+from typing import Any, ContextManager, Dict, Iterator, List, Tuple
+from uuid import uuid4
 
+import numpy as np
 import pandas as pd
-from notion.collection import Collection, CollectionView
-from recordlinkage import Compare, Index
-from thought.client import get_client
+from notion.block import Block, CollectionViewPageBlock
+from notion.collection import Collection, CollectionRowBlock, CollectionView
+from notion.operations import build_operation
+from notion.utils import now as notion_now
+from thought.cache import DuplicateIndex, IndexStats, SnapshotCache
+from thought.client import get_client, prefetch_blocks
+from thought.dedupe import (
+    ENGINES,
+    Comparator,
+    build_index,
+    canonicalize,
+    classify,
+    compare,
+    content_digests,
+    exact_duplicates,
+    key_digests,
+    normalized_frame,
+    partitioned_duplicates,
+)
+from thought.profile import PROFILER, Span, SpanRecord
+from thought.schema import SCHEMAS, CompiledSchema, memory_usage
+from thought.settings import (
+    DEDUPE_CHUNK_SIZE,
+    DEDUPE_ENGINE,
+    DEDUPE_INDEX_STRATEGY,
+    DEDUPE_MATCH_THRESHOLD,
+    DEDUPE_MAX_MEMORY,
+    DEDUPE_WINDOW,
+    DEDUPE_WORKERS,
+    EXPORT_CHUNK_SIZE,
+    NOTION_BATCH_SIZE,
+    NOTION_CONCURRENCY,
+)
 from thought.utils import default_field, now
+from thought.writer import BatchWriter, WriteStats
 
 
 @dataclass
@@ -16,6 +53,103 @@ class Metadata:
     The Metadata object. Contains helper functions and generalized metadata
     """
     run_time: datetime = default_field(now(), init=False, repr=False)
+    timings: Dict[str, float] = default_field({}, init=False, repr=False)  # step name: seconds
+
+    @property
+    def spans(self) -> Dict[str, Span]:
+        '''
+            The run's stage totals, shared by every Metadata of the process and empty unless `thought --profile` is on
+        '''
+        return PROFILER.spans
+
+    def span(self, name: str, rows: int = 0) -> ContextManager[SpanRecord]:
+        '''
+            Records a stage span in the run's profiler, see `Profiler.span`
+        '''
+        return PROFILER.span(name, rows)
+
+@dataclass
+class SyncPlan:
+    """
+    The changes that make a collection match a dataframe
+    """
+    creates: List[Dict] = default_field([])  # property values of rows to create
+    updates: Dict[str, Dict] = default_field({})  # block id: changed property values
+    archives: List[str] = default_field([])  # block ids of rows to archive
+    stats: WriteStats = default_field(None, repr=False)
+
+    def __bool__(self):
+        return bool(self.creates or self.updates or self.archives)
+
+    def __str__(self):
+        lines = [f"{len(self.creates)} rows to create, {len(self.updates)} rows to update, {len(self.archives)} rows to archive"]
+        lines += [f"  create {values}" for values in self.creates]
+        lines += [f"  update {block_id} {values}" for block_id, values in self.updates.items()]
+        lines += [f"  archive {block_id}" for block_id in self.archives]
+        return '\n'.join(lines)
+
+
+@dataclass
+class SortReport:
+    """
+    What a sort changed: rows whose multi-select values were rewritten, rows already in order and the write stats
+    """
+    rewritten: int = 0
+    skipped: int = 0
+    stats: WriteStats = default_field(None, repr=False)
+
+    def __str__(self):
+        return f"{self.rewritten} rows rewritten, {self.skipped} rows already in order"
+
+
+def schema_from_dataframe(dataframe: pd.DataFrame, title: str = 'title') -> Dict[str, Dict]:
+    '''
+        Infers a Notion collection schema from a dataframe's columns, naming each property after its column so rows
+        round trip through `asdataframe` unchanged. The `title` column becomes the title property.
+    '''
+    schema = {'title': {'name': title, 'type': 'title'}}
+    for column in dataframe.columns:
+        if column in (title, 'id'):
+            continue
+        values = dataframe[column].dropna()
+        if pd.api.types.is_bool_dtype(dataframe[column]):
+            prop_type = 'checkbox'
+        elif pd.api.types.is_numeric_dtype(dataframe[column]):
+            prop_type = 'number'
+        elif pd.api.types.is_datetime64_any_dtype(dataframe[column]):
+            prop_type = 'date'
+        elif len(values) and all(isinstance(x, (list, tuple)) for x in values):
+            prop_type = 'multi_select'
+        elif column.endswith('url'):
+            prop_type = 'url'
+        else:
+            prop_type = 'text'
+        schema[uuid4().hex[:4]] = {'name': column, 'type': prop_type}
+    return schema
+
+
+def _to_python(value: Any) -> Any:
+    '''
+        Unboxes numpy and pandas scalars and turns missing values into None
+    '''
+    if isinstance(value, (list, tuple, dict)):
+        return value
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _is_empty(value: Any) -> bool:
+    return canonicalize(value) in (None, '', ())
+
+
+def _same_value(left: Any, right: Any) -> bool:
+    if _is_empty(left) and _is_empty(right):
+        return True
+    return canonicalize(left) == canonicalize(right)
+
 
 @dataclass
 class CollectionExtension:
@@ -24,11 +158,35 @@ class CollectionExtension:
     """
     collection: Collection
     metadata: Metadata = default_field(Metadata(), init=False, repr=False)
-    
+    cache: SnapshotCache = default_field(None, repr=False)
+    concurrency: int = default_field(NOTION_CONCURRENCY, repr=False)  # record chunks fetched at once
+
+    @classmethod
+    def create(cls, page: Block, title: str, dataframe: pd.DataFrame, cache: SnapshotCache = None) -> 'CollectionExtension':
+        '''
+            Creates a collection, with a table view, as a child page of `page`, its schema inferred from a dataframe
+        '''
+        client = page._client
+        block = page.children.add_new(CollectionViewPageBlock)
+        block.collection = client.get_collection(
+            client.create_record('collection', parent=block, schema=schema_from_dataframe(dataframe)))
+        block.title = title
+        block.views.add_new(view_type='table')
+        logging.info("created collection %s under %s", title, page.id)
+        return cls(block.collection, cache=cache)
+
     def dedupe(self, 
                dataframe: pd.DataFrame = None, 
                comparison_fields: List = None, 
                keep_first: bool = True,
+               index_strategy: str = DEDUPE_INDEX_STRATEGY,
+               block_on: List = None,
+               window: int = DEDUPE_WINDOW,
+               engine: str = DEDUPE_ENGINE,
+               comparators: List[Comparator] = None,
+               match_threshold: float = DEDUPE_MATCH_THRESHOLD,
+               workers: int = DEDUPE_WORKERS,
+               chunk_size: int = DEDUPE_CHUNK_SIZE,
                **kwargs) -> pd.DataFrame:
         '''
             Function that dedupes an input dataframe
@@ -37,61 +195,512 @@ class CollectionExtension:
             ---------
 
             dataframe:          A pandas DataFrame object to perform deduplication on. If a dataframe is not passed, 
-            comparison_fields:  A List of string field names to perform the deduplication with. If not specified, defaults to all columns in the passed dataframe.
+            comparison_fields:  A List of string field names to perform the deduplication with. If not specified, defaults to the comparators' fields or else all columns in the passed dataframe except `id`.
+            comparators:        A List of `thought.dedupe.Comparator` objects configuring how individual fields are compared. Fields without a comparator are compared exactly.
 
             Parameters
             ----------
             keep_first:         Keeps the first instance of a duplicate record. If false, will keep the last instance of a record. Defaults to True.
+            index_strategy:     How candidate record pairs are generated. One of `thought.dedupe.INDEX_STRATEGIES`. Defaults to `hash`.
+            block_on:           Fields to block or sort on for the `block` and `sortedneighbourhood` strategies. Defaults to the comparison fields.
+            window:             Window size for the `sortedneighbourhood` strategy.
+            engine:             `hash` finds exact duplicates in a single hashed pass over the canonicalised comparison fields, skipping indexing and comparison, and rejects fuzzy comparators or a match_threshold below 1.
+                                `recordlinkage` indexes and compares candidate pairs. `auto` uses `hash` whenever every comparison is exact. Defaults to `auto`.
+            match_threshold:    Weighted comparison score, 0 to 1, a candidate pair needs to be classified as a duplicate. Defaults to 1, every field matching.
+            workers:            Number of processes candidate pair comparison is spread over
+            chunk_size:         Number of candidate pairs compared per block
 
             Returns
             -------
             A pandas dataframe with duplicated records removed
         '''
+        if engine not in ENGINES:
+            raise ValueError(f"{engine} is not a valid dedupe engine, pick one of {ENGINES}")
+
         # if dataframe argument not passed, use internal object records
-        if not dataframe:
+        if dataframe is None:
             dataframe = self.asdataframe()
 
-        # if comparison fields defaults to all fields if not specified
+        # if comparison fields defaults to all fields if not specified. block ids are unique so never compare on them
+        comparators = {x.field: x for x in comparators or []}
         if not comparison_fields:
-            comparison_fields = dataframe.columns.to_list()
-        
-        # Indexation step
-        indexer = Index()
-        # TODO: add flexability for different indexing strategies here
-        indexer.full()
-        candidate_links = indexer.index(dataframe)
+            comparison_fields = list(comparators) or [x for x in dataframe.columns if x != 'id']
+        comparators = [comparators.get(field, Comparator(field)) for field in comparison_fields]
+        exact_fields = [x.field for x in comparators if x.is_exact]
+        if engine == 'hash' and (len(exact_fields) < len(comparators) or match_threshold < 1):
+            fuzzy = [x.field for x in comparators if not x.is_exact]
+            raise ValueError(f"the hash engine only finds exact duplicates, but {fuzzy or 'match_threshold'} "
+                             f"{'are' if fuzzy else 'is'} compared fuzzily, use the recordlinkage or auto engine")
+
+        # every comparison is exact, so a single hashed pass finds the same duplicates as comparing candidate pairs
+        if engine == 'hash' or (engine == 'auto' and len(exact_fields) == len(comparators) and match_threshold >= 1):
+            with self.metadata.span('index', rows=len(dataframe)):
+                index_to_drop = exact_duplicates(dataframe, comparison_fields, keep_first=keep_first)
+            return dataframe.drop(index_to_drop).reset_index()
+
+        # Normalisation step, so list and date cells compare by value and urls / strings compare loosely
+        with self.metadata.span('normalize', rows=len(dataframe)):
+            normalized = normalized_frame(dataframe, comparators)
+
+        # Indexation step. hashing only works on exactly compared fields, so fall back to sorting on the first fuzzy field
+        if index_strategy == 'hash' and not exact_fields:
+            logging.warning("no exactly compared fields to hash on, using a sorted neighbourhood index instead")
+            index_strategy, block_on = 'sortedneighbourhood', block_on or [comparators[0].field]
+        with self.metadata.span('index', rows=len(normalized)):
+            candidate_links = build_index(normalized,
+                                          strategy=index_strategy,
+                                          comparison_fields=exact_fields,
+                                          on=block_on or exact_fields or None,
+                                          window=window)
+        if candidate_links.empty:
+            return dataframe.reset_index()
 
         # Comparison step
-        compare_cl = Compare()
-        # TODO: add flexability for different comparison types here
-        for field in comparison_fields:
-            compare_cl.exact(field, field, label=field)
-        features = compare_cl.compute(candidate_links, dataframe)
+        with self.metadata.span('compare', rows=len(candidate_links)):
+            features = compare(candidate_links, normalized, comparators, workers=workers, chunk_size=chunk_size)
 
         # Classification step
-        num_features = len(comparison_fields)
-        matches = features[features.sum(axis=1) == num_features]
-        index_to_drop = matches.index.get_level_values(0) if keep_first \
-                        else matches.index.get_level_values(1)
+        with self.metadata.span('classify', rows=len(features)):
+            matches = classify(features, comparators, threshold=match_threshold)
+        index_to_drop = matches.get_level_values(0) if keep_first \
+                        else matches.get_level_values(1)
         return dataframe.drop(index_to_drop).reset_index()
 
-    def asdataframe(self) -> pd.DataFrame:
+    @property
+    def schema(self) -> CompiledSchema:
+        '''
+            The collection's compiled schema, shared until the collection's schema version changes
         '''
-            Returns a Collection's Block rows as a pandas data frame using the get_all_properties function.
+        return SCHEMAS.get(self.collection)
+
+    def partitioned_duplicates(self,
+                               comparison_fields: List[str] = None,
+                               keep_first: bool = True,
+                               max_memory: int = DEDUPE_MAX_MEMORY,
+                               batch_size: int = NOTION_BATCH_SIZE,
+                               directory: str = None) -> List[str]:
         '''
-        holder = []
-        rows = self.collection.get_rows()
-        for block in rows:
-            # TODO: add ability to preserve objects here
-            row = block.get_all_properties()
-            row['id'] = block.id
-            holder.append(row)
-        return pd.DataFrame(holder)
+            Finds exact duplicates out of core, for collections too large to dedupe in memory. Rows are read chunk by chunk and
+            only their key digests are kept, spilled to disk in hash partitions that are deduped one at a time, see
+            `thought.dedupe.partitioned_duplicates`.
 
+            Returns the same rows as the hash engine of `dedupe`, without a deduplicated copy of the collection.
+
+            Arguments
+            ---------
 
-    def sync(self, input_df, id_col='id') -> None:
-        import ipdb; ipdb.set_trace()
-        pass
+            comparison_fields:  The fields that must all match. Defaults to every column but `id`.
+
+            Parameters
+            ----------
+            keep_first:         Keeps the first instance of a duplicate record, or the last one if False
+            max_memory:         Bytes a partition is deduped in
+            batch_size:         Rows read and hashed at once
+            directory:          Where partitions are spilled. Defaults to the system's temporary directory.
+
+            Returns
+            -------
+            The block ids of the duplicates, in collection order
+        '''
+        fields = list(comparison_fields or [x for x in self._columns() if x != 'id'])
+        chunks = (chunk[fields + ['id']] for chunk in self.iter_rows(batch_size=batch_size))
+        return partitioned_duplicates(chunks, fields, keep_first=keep_first, max_memory=max_memory, directory=directory)
+
+    def indexed_duplicates(self,
+                           comparison_fields: List[str] = None,
+                           keep_first: bool = True,
+                           rebuild: bool = False,
+                           index: DuplicateIndex = None,
+                           batch_size: int = NOTION_BATCH_SIZE) -> Tuple[List[str], IndexStats]:
+        '''
+            Finds exact duplicates through a persistent DuplicateIndex kept next to the snapshot cache. Only rows new or edited
+            since the last run are hashed.
+
+            Returns the same rows as the hash engine of `dedupe`: every row of a duplicate group but the first (or last) in
+            collection order, rows with a missing comparison value never matching.
+
+            Arguments
+            ---------
+
+            comparison_fields:  The fields that must all match. Defaults to every column but `id`.
+
+            Parameters
+            ----------
+            keep_first:         Keeps the first instance of a duplicate record, or the last one if False
+            rebuild:            Drops the index and hashes every row again
+            index:              The DuplicateIndex. Defaults to one in the snapshot cache's database.
+
+            Returns
+            -------
+            The block ids of the duplicates and the index's IndexStats
+        '''
+        if self.cache is None:
+            raise ValueError("an indexed dedupe needs the snapshot cache")
+        start = time.perf_counter()
+        index = index or DuplicateIndex(path=self.cache.path)
+        collection_id = self.collection.id
+        fields = list(comparison_fields or [x for x in self._columns() if x != 'id'])
+
+        with self.metadata.span('fetch') as span:
+            span.rows = len(self.cache.update(self.collection, concurrency=self.concurrency))
+        if rebuild:
+            index.clear(collection_id, fields)
+        removed = index.prune(collection_id, fields)
+        hashed = 0
+        for records in index.changed(collection_id, fields, batch_size):
+            self._index_keys(index, fields, records)
+            hashed += len(records)
+
+        # colliding digests are grouped by sqlite from the digest index, without reading or hashing unchanged rows
+        with self.metadata.span('classify') as span:
+            groups = index.groups(collection_id, fields)
+            span.rows = sum(len(x) for x in groups.values())
+        duplicates = [block_id for group in groups.values() for block_id in (group[1:] if keep_first else group[:-1])]
+        stats = index.stats(collection_id, fields)
+        stats.hashed, stats.removed, stats.seconds = hashed, removed, time.perf_counter() - start
+        logging.info("duplicate index of %s: %s, %s duplicates", collection_id, stats, len(duplicates))
+        return duplicates, stats
+
+    def _index_keys(self, index: DuplicateIndex, fields: List[str], records: List[Dict],
+                    frame: pd.DataFrame = None) -> None:
+        '''
+            Hashes raw row records, or their already decoded `frame`, into a DuplicateIndex
+        '''
+        frame = self._records_frame(records) if frame is None else frame
+        with self.metadata.span('index', rows=len(records)):
+            digests = key_digests(frame, fields)
+            # sqlite integers are signed
+            digests = dict(zip(digests.index, digests.to_numpy().view('int64').tolist()))
+            index.store(self.collection.id, fields, [(record['id'], record.get('last_edited_time', 0),
+                                                      record.get('version'), *digests.get(label, (None, None)))
+                                                     for label, record in zip(frame.index, records)])
+
+    def _columns(self) -> Dict[str, str]:
+        '''
+            Returns the column names and pandas dtypes of a Collection's rows, derived from the collection schema
+        '''
+        return self.schema.columns
+
+    def _prefetch(self, blocks: List, chunk_size: int = NOTION_BATCH_SIZE) -> None:
+        '''
+            Loads any block records the local record store is missing, a chunk per request instead of one request per block
+        '''
+        prefetch_blocks(self.collection._client, [block.id for block in blocks], concurrency=self.concurrency,
+                        chunk_size=chunk_size)
+
+    def _row_block(self, block_id: str) -> CollectionRowBlock:
+        block = CollectionRowBlock(self.collection._client, block_id)
+        block.__dict__['collection'] = self.collection
+        return block
+
+    def _iter_cached_rows(self, batch_size: int) -> Iterator[pd.DataFrame]:
+        '''
+            Yields rows from the snapshot cache after bringing it up to date
+        '''
+        with self.metadata.span('fetch') as span:
+            span.rows = len(self.cache.update(self.collection, concurrency=self.concurrency))
+        stats = self.cache.stats
+        logging.info("snapshot cache hit ratio %.1f%% (%s rows cached, %s fetched)", stats.hit_ratio * 100, stats.hits, stats.misses)
+
+        for records in self.cache.records(self.collection.id, batch_size):
+            yield self._records_frame(records)
+
+    def _records_frame(self, records: List[Dict]) -> pd.DataFrame:
+        '''
+            Decodes raw row records, from the snapshot cache, into a typed DataFrame
+        '''
+        schema = self.schema
+        with self.metadata.span('decode', rows=len(records)):
+            if schema.needs_store:
+                self.collection._client._store.store_recordmap(
+                    {'block': {x['id']: {'role': 'editor', 'value': x} for x in records}})
+            return schema.frame(records, self.collection)
+
+    def iter_rows(self, batch_size: int = NOTION_BATCH_SIZE, **kwargs) -> Iterator[pd.DataFrame]:
+        '''
+            Yields a Collection's Block rows as typed pandas DataFrame chunks of at most `batch_size` rows, page by page of the query result.
+            Reads through the snapshot cache when one is set and no query arguments are passed.
+
+            Arguments
+            ---------
+
+            batch_size:     Maximum number of rows per chunk
+            kwargs:         Passed on to the notion-py collection query, e.g. `filter` or `sort`
+        '''
+        if self.cache is not None and not kwargs:
+            yield from self._iter_cached_rows(batch_size)
+            return
+
+        schema = self.schema
+        with self.metadata.span('fetch'):
+            rows = self.collection.get_rows(limit=-1, **kwargs)
+            if self.concurrency > 1:
+                # read ahead, every missing chunk is fetched concurrently instead of one chunk per batch
+                self._prefetch(rows, chunk_size=batch_size)
+        rows = iter(rows)
+        while True:
+            with self.metadata.span('fetch') as span:
+                blocks = list(islice(rows, batch_size))
+                self._prefetch(blocks, chunk_size=batch_size)
+                records = [block.get() for block in blocks]
+                span.rows = len(records)
+            if not records:
+                return
+            with self.metadata.span('decode', rows=len(records)):
+                frame = schema.frame(records, self.collection)
+            yield frame
+
+    def asdataframe(self, batch_size: int = NOTION_BATCH_SIZE, compact: bool = False, **kwargs) -> pd.DataFrame:
+        '''
+            Returns a Collection's Block rows as a pandas data frame by concatenating the chunks of `iter_rows`
+
+            Arguments
+            ---------
+
+            batch_size:     Maximum number of rows fetched per chunk
+            compact:        Convert the rows to compact, property type aware dtypes, see `CompiledSchema.compact`.
+                            Multi-selects become bitsets, so compact frames are for analysis rather than `sync` input.
+            kwargs:         Passed on to `iter_rows`
+        '''
+        columns = self._columns()
+        chunks = list(self.iter_rows(batch_size=batch_size, **kwargs))
+        if not chunks:
+            dataframe = pd.DataFrame(columns=list(columns)).astype(columns)
+        else:
+            dataframe = pd.concat(chunks, ignore_index=True)
+        if not compact:
+            return dataframe
+
+        compacted = self.schema.compact(dataframe)
+        logging.info("compacted %s rows from %s to %s bytes", len(dataframe), memory_usage(dataframe), memory_usage(compacted))
+        return compacted
+
+    def sort_multiselect_values(self,
+                                prop: Dict,
+                                rows: pd.DataFrame = None,
+                                ascending: bool = True,
+                                dry_run: bool = False,
+                                writer: BatchWriter = None) -> SortReport:
+        '''
+            Sorts a multi-select property's values in each row, rewriting only rows that aren't in order yet, in batched transactions
+
+            Arguments
+            ---------
+
+            prop:       The multi-select property, as returned by `get_schema_properties`
+            rows:       The rows to sort. Defaults to every row of the collection. Sorted in place.
+        '''
+        if rows is None:
+            rows = self.asdataframe()
+        updates = {}
+        for label, block_id, values in zip(rows.index, rows['id'], rows[prop['slug']]):
+            values = list(values) if isinstance(values, (list, tuple)) else []
+            ordered = sorted(values, reverse=not ascending)
+            if ordered != values:
+                updates[block_id] = {prop['slug']: ordered}
+                rows.at[label, prop['slug']] = ordered
+
+        plan = self._write(SyncPlan(updates=updates), dry_run=dry_run, writer=writer)
+        report = SortReport(rewritten=len(updates), skipped=len(rows) - len(updates), stats=plan.stats)
+        logging.info("sorted %s: %s", prop['slug'], report)
+        return report
+
+    def _writable_properties(self) -> Dict[str, Dict]:
+        # copied, select option checks add options to them
+        return deepcopy(self.schema.writable)
+
+    def plan_sync(self,
+                  input_df: pd.DataFrame,
+                  current_df: pd.DataFrame,
+                  id_col: str = 'id',
+                  archive: bool = True) -> SyncPlan:
+        '''
+            Computes the minimal set of changes that makes the collection match an input dataframe
+
+            Arguments
+            ---------
+
+            input_df:   A pandas DataFrame holding the desired collection rows. Columns that aren't writable collection properties are ignored.
+            current_df: A pandas DataFrame of the collection's current rows, as returned by `asdataframe`
+            id_col:     The column holding block ids. Rows without a known block id are created.
+
+            Parameters
+            ----------
+            archive:    Archives collection rows missing from the input dataframe. Defaults to True.
+
+            Returns
+            -------
+            A SyncPlan
+        '''
+        properties = self._writable_properties()
+        columns = [x for x in input_df.columns if x in properties]
+        current = {row[id_col]: row for row in current_df.to_dict('records')}
+        plan = SyncPlan()
+
+        input_ids = set()
+        for row in input_df.to_dict('records'):
+            block_id = _to_python(row.get(id_col))
+            values = {x: _to_python(row[x]) for x in columns}
+            if block_id is None or block_id not in current:
+                plan.creates.append({k: v for k, v in values.items() if not _is_empty(v)})
+                continue
+            input_ids.add(block_id)
+            existing = current[block_id]
+            changes = {k: v for k, v in values.items()
+                       if k in existing and not _same_value(v, _to_python(existing[k]))}
+            if changes:
+                plan.updates[block_id] = changes
+
+        if archive:
+            plan.archives = [x for x in current if x not in input_ids]
+        return plan
+
+    def _operations(self, plan: SyncPlan) -> List[List[Dict]]:
+        '''
+            Converts a SyncPlan into groups of Notion operations, one group per row, preceded by any schema option additions
+        '''
+        client = self.collection._client
+        properties = self._writable_properties()
+        schema_updates = {}
+
+        def property_operations(block: CollectionRowBlock, values: Dict) -> List[Dict]:
+            operations = []
+            for slug, value in values.items():
+                prop = properties[slug]
+                if prop['type'] in ('select', 'multi_select') and not _is_empty(value):
+                    updated, prop = self.collection.check_schema_select_options(prop, value)
+                    if updated:
+                        schema_updates[prop['id']] = prop['options']
+                path, value = block._convert_python_to_notion(value, prop, identifier=slug)
+                operations.append(build_operation(id=block.id, path=path, args=value, table='block'))
+            return operations
+
+        rows = []
+        for values in plan.creates:
+            block_id = str(uuid4())
+            create = build_operation(id=block_id, path=[], table='block', args={
+                'id': block_id,
+                'version': 1,
+                'alive': True,
+                'type': 'page',
+                'created_by_id': client.current_user.id,
+                'created_by_table': 'notion_user',
+                'created_time': notion_now(),
+                'parent_id': self.collection.id,
+                'parent_table': 'collection',
+                'space_id': self.collection.get('space_id'),
+            })
+            rows.append([create] + property_operations(self._row_block(block_id), values))
+        for block_id, values in plan.updates.items():
+            rows.append(property_operations(self._row_block(block_id), values))
+        for block_id in plan.archives:
+            rows.append([build_operation(id=block_id, path=[], args={'alive': False}, command='update')])
+
+        schema = [build_operation(id=self.collection.id, path=['schema', prop_id, 'options'], args=options, table='collection')
+                  for prop_id, options in schema_updates.items()]
+        return [schema] + rows if schema else rows
+
+    def upsert(self,
+               input_df: pd.DataFrame,
+               key: str,
+               current_df: pd.DataFrame = None,
+               archive: bool = False,
+               dry_run: bool = False,
+               writer: BatchWriter = None) -> SyncPlan:
+        '''
+            Creates or updates collection rows matched on a natural key instead of block ids
+
+            A hash index of the current rows' keys and content is built first, so only rows with a new key or a changed content hash are diffed and written.
+
+            Arguments
+            ---------
+
+            input_df:   A pandas DataFrame of rows to load
+            key:        The column, present in both the dataframe and the collection, that identifies a row
+            current_df: The collection's current rows. Read with `asdataframe` if not passed.
+
+            Parameters
+            ----------
+            archive:    Archives collection rows whose key is missing from the input dataframe, and extra rows sharing a key. Defaults to False.
+            dry_run:    Only plans the changes, without writing anything
+            writer:     The BatchWriter submitting the changes
+
+            Returns
+            -------
+            The executed SyncPlan
+        '''
+        if current_df is None:
+            current_df = self.asdataframe()
+        properties = self._writable_properties()
+        if key not in properties:
+            raise KeyError(f"{key} is not a writable property of the target collection")
+        columns = [x for x in input_df.columns if x in properties]
+
+        # hash index of existing rows: key -> block id, block id -> content digest
+        keys = current_df[key].map(canonicalize)
+        first = ~keys.duplicated().to_numpy()
+        block_ids = dict(zip(keys[first], current_df['id'][first]))
+        digests = dict(zip(current_df['id'], content_digests(current_df, columns))) if len(current_df) else {}
+
+        input_keys = input_df[key].map(canonicalize)
+        ids = [block_ids.get(x) for x in input_keys]
+        changed = np.array([block_id is None or digests[block_id] != digest
+                            for block_id, digest in zip(ids, content_digests(input_df, columns))], dtype=bool)
+        to_load = input_df.loc[changed, columns].assign(id=[x for x, y in zip(ids, changed) if y])
+        plan = self.plan_sync(to_load, current_df, archive=False)
+        if archive:
+            # rows missing from the input, and any extra rows sharing a key, are archived
+            loaded = set(input_keys)
+            plan.archives = [block_id for value, block_id, kept in zip(keys, current_df['id'], first)
+                             if value not in loaded or not kept]
+        logging.info("%s of %s rows are new or changed", int(changed.sum()), len(input_df))
+        return self._write(plan, dry_run=dry_run, writer=writer)
+
+    def _write(self, plan: SyncPlan, dry_run: bool = False, writer: BatchWriter = None) -> SyncPlan:
+        if dry_run or not plan:
+            return plan
+
+        writer = writer or BatchWriter(self.collection._client)
+        operations = self._operations(plan)
+        if operations and operations[0][0]['table'] == 'collection':
+            # new select options have to exist before rows use them
+            writer.submit(operations.pop(0))
+            SCHEMAS.invalidate(self.collection.id)
+        with self.metadata.span('write', rows=len(operations)):
+            plan.stats = writer.write(operations)
+        return plan
+
+    def sync(self,
+             input_df: pd.DataFrame,
+             id_col: str = 'id',
+             current_df: pd.DataFrame = None,
+             archive: bool = True,
+             dry_run: bool = False,
+             writer: BatchWriter = None) -> SyncPlan:
+        '''
+            Syncs the collection's rows with an input dataframe, writing only the properties that changed
+
+            Arguments
+            ---------
+
+            input_df:   A pandas DataFrame holding the desired collection rows
+            id_col:     The column holding block ids
+            current_df: The collection's current rows. Read with `asdataframe` if not passed.
+
+            Parameters
+            ----------
+            archive:    Archives collection rows missing from the input dataframe. Defaults to True.
+            dry_run:    Only plans the changes, without writing anything
+            writer:     The BatchWriter submitting the changes. Defaults to one with the configured batch size and workers.
+
+            Returns
+            -------
+            The executed SyncPlan, holding the writer's stats unless it was a dry run
+        '''
+        if current_df is None:
+            current_df = self.asdataframe()
+        plan = self.plan_sync(input_df, current_df, id_col=id_col, archive=archive)
+        return self._write(plan, dry_run=dry_run, writer=writer)
 
 @dataclass
 class CollectionViewExtension:
@@ -100,39 +709,52 @@ class CollectionViewExtension:
     """
     view: CollectionView
     metadata: Metadata = default_field(Metadata(), init=False, repr=False)
+    cache: SnapshotCache = default_field(None, repr=False)
+    concurrency: int = default_field(NOTION_CONCURRENCY, repr=False)
 
     def __post_init__(self):
-        # import ipdb; ipdb.set_trace()
-        self.schema = self._get_schema()
-    
-    
-    def _get_schema(self):
-        '''
-            Get's a Collection View's schema by accessing the parent's collection object
-        '''
-        return self.view.parent.collection.get_schema_properties()
-
-    def _sort_multiselect_record_values(self):
-        # iterate over all rows and sort each records property multi-select values
-        rows = self.view.collection.get_rows()
-        for block in rows:
-            field_vals = eval(f'block.{field}')
-            if not ascending:
-                new_vals = sorted(field_vals, reversed=True)
-            else:
-                new_vals = sorted(field_vals)
-            block.set_property(field, new_vals)
-
-    def _sort_multiselect_schema_values(self):
-        pass
-    
+        self.collection = CollectionExtension(self.view.collection, cache=self.cache, concurrency=self.concurrency)
+
+    @property
+    def schema(self) -> CompiledSchema:
+        '''
+            Get's a Collection View's compiled schema from its collection
+        '''
+        return self.collection.schema
+
+    def _sort_multiselect_record_values(self,
+                                        prop: Dict,
+                                        ascending: bool = True,
+                                        dry_run: bool = False,
+                                        writer: BatchWriter = None) -> SortReport:
+        '''
+            Sorts every row's multi-select values, rewriting only rows that aren't in order yet, in batched transactions
+        '''
+        return self.collection.sort_multiselect_values(prop, ascending=ascending, dry_run=dry_run, writer=writer)
+
+    def _sort_multiselect_schema_values(self, prop: Dict, ascending: bool = True) -> Dict:
+        '''
+            Returns the operation ordering a multi-select property's options
+        '''
+        options = sorted(prop.get('options', []), key=lambda x: x['value'], reverse=not ascending)
+        return build_operation(id=self.view.collection.id,
+                               path=['schema', prop['id'], 'options'],
+                               args=options,
+                               command='set',
+                               table='collection')
+
     def sort(self,
              field: str, 
              sort_multiselect_values: bool = True,
-             ascending: bool = True) -> None:
+             sort_multiselect_schema_values: bool = False,
+             ascending: bool = True,
+             dry_run: bool = False,
+             writer: BatchWriter = None) -> SortReport:
         '''
         Sorts a Collection on a given field in alpha-numeric order.
 
+        The view's sort is stored on the view itself, so Notion sorts it server side, in a single transaction.
+
         Arguments
         ---------
 
@@ -142,30 +764,29 @@ class CollectionViewExtension:
         ---------
 
         sort_multiselect_values: If the provided field is a multi-select, sorts of the multi-select values before sorting the collection view by the multi-select field
+        sort_multiselect_schema_values: If the provided field is a multi-select, sorts its options too
         ascending: Sorts in ascending order by default
+        dry_run: Only counts the rows that would be rewritten
         '''
-        schema = self.schema
-
-        # map passed field to schema to get property ids
-        if sort_multiselect_values:
-            self._sort_multiselect_record_values()
-
-        fields = [x for x in schema if field in x['slug']]
-        if len(fields) == 1:
-            ids = fields[0]['id']
-        else:
-            logging.info("more than one field matching")
+        prop = self.schema.property(field)
+        writer = writer or BatchWriter(self.view._client)
+        report = SortReport()
+        if prop['type'] == 'multi_select' and sort_multiselect_values:
+            report = self._sort_multiselect_record_values(prop, ascending=ascending, dry_run=dry_run, writer=writer)
 
         params = [{
             "direction": "ascending" if ascending else "descending",
-            "property": field,
+            "property": prop['id'],
         }]
-        ## this doesn't work....why???
-        self.view.set("sort",params)
-        # result = self.view.build_query(sort=params).execute()
-        import ipdb; ipdb.set_trace()
-        pass
-
+        # the sort lives in the view's query2, next to its filters
+        operations = [build_operation(id=self.view.id, path=['query2', 'sort'], args=params, command='set',
+                                      table='collection_view')]
+        if prop['type'] == 'multi_select' and sort_multiselect_schema_values:
+            operations.append(self._sort_multiselect_schema_values(prop, ascending=ascending))
+        if not dry_run:
+            writer.submit(operations)
+            SCHEMAS.invalidate(self.view.collection.id)
+        return report
 
 
 @dataclass
@@ -174,3 +795,14 @@ class Output:
     An Output object which wraps an existing notion-py Block object and adds additional output functionality.
     """
     notion_block: Any
+    cache: SnapshotCache = default_field(None, repr=False)
+    concurrency: int = default_field(NOTION_CONCURRENCY, repr=False)
+
+    def export(self, path: str, format: str = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+        '''
+            Exports the rows of the wrapped collection view block to a parquet, arrow or csv file, see `thought.export`
+        '''
+        from thought.export import export_collection
+
+        collection = CollectionExtension(self.notion_block.collection, cache=self.cache, concurrency=self.concurrency)
+        return export_collection(collection, path, format=format, chunk_size=chunk_size)
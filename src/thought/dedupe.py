@@ -0,0 +1,487 @@
+"""Deduplication helpers used by CollectionExtension.dedupe"""
+import logging
+import math
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import date, datetime
+from itertools import combinations
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+import pandas as pd
+from recordlinkage import Compare, Index
+from thought.settings import DEDUPE_ENGINES, DEDUPE_INDEX_STRATEGIES, DEDUPE_MAX_MEMORY, DEDUPE_SPILL_FANOUT
+
+logger = logging.getLogger(__name__)
+
+INDEX_STRATEGIES = DEDUPE_INDEX_STRATEGIES
+ENGINES = DEDUPE_ENGINES
+COMPARATOR_METHODS = ['exact', 'string', 'url', 'numeric', 'date']
+
+# a spilled row: the 128-bit digest of its canonical comparison key, its position in the collection and its block id
+SPILL_DTYPE = np.dtype([('high', '<u8'), ('low', '<u8'), ('position', '<i8'), ('id', 'S36')])
+# bytes per row deduping a partition in memory takes: the entries, a sorted copy, the sort order and masks
+SPILL_WORKING_BYTES = 2 * SPILL_DTYPE.itemsize + 16
+# hash keys of the two halves of a spilled key digest, the first is pandas' default so `high` matches `row_digests`
+DIGEST_KEYS = ('0123456789123456', 'thought-dedupe-2')
+
+# query parameters that never change the page a url points to
+TRACKING_PARAMETERS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'ref_src')
+
+
+@dataclass
+class Comparator:
+    """
+    How a single field is compared between two candidate records
+
+    method:     exact: values must be identical
+                string: case and whitespace insensitive string similarity using `algorithm`
+                url: exact match after normalising scheme, host case, trailing slashes and tracking parameters
+                numeric: values within `threshold` of each other match
+                date: dates within `threshold` days of each other match
+    threshold:  Similarity threshold for string comparisons, 0 to 1. Without one the raw similarity contributes to the score.
+                Tolerance for numeric comparisons and window in days for date comparisons.
+    weight:     The weight of this field in the match score
+    """
+    field: str
+    method: str = 'exact'
+    threshold: float = None
+    weight: float = 1.0
+    algorithm: str = 'jarowinkler'
+
+    def __post_init__(self):
+        if self.method not in COMPARATOR_METHODS:
+            raise ValueError(f"{self.method} is not a valid comparison method, pick one of {COMPARATOR_METHODS}")
+
+    @classmethod
+    def from_spec(cls, spec: str) -> 'Comparator':
+        '''
+            Builds a Comparator from a `field[:method[:threshold[:weight]]]` string, e.g. `title:string:0.9` or `url:url::2`
+        '''
+        field, *rest = spec.split(':')
+        method, threshold, weight = (rest + [None] * 3)[:3]
+        return cls(field=field,
+                   method=method or 'exact',
+                   threshold=float(threshold) if threshold else None,
+                   weight=float(weight) if weight else 1.0)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.method == 'exact'
+
+
+def canonicalize(value: Any) -> Any:
+    '''
+        Converts a single cell value into a hashable representation that compares equal exactly when the original values are equal.
+
+        Lists become tuples, dates become ISO strings and notion-py records are reduced to their ids. Missing values are returned as None.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return tuple(canonicalize(x) for x in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(canonicalize(x) for x in value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, canonicalize(v)) for k, v in value.items()))
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, 'start') and hasattr(value, 'to_notion'):
+        # notion-py NotionDate
+        return (canonicalize(value.start), canonicalize(value.end), value.timezone)
+    if hasattr(value, 'id') and hasattr(value, '_client'):
+        # notion-py Record (users, related pages)
+        return value.id
+    return value
+
+
+def _canonical_column(column: pd.Series) -> pd.Series:
+    # typed columns are already hashable, only boxed object columns need a per-cell pass
+    if column.dtype != object:
+        return column
+    return pd.Series([x if type(x) is str else canonicalize(x) for x in column],
+                     index=column.index,
+                     dtype=object)
+
+
+def canonical_frame(dataframe: pd.DataFrame, fields: List[str]) -> pd.DataFrame:
+    '''
+        Returns a copy of the provided fields with every cell passed through `canonicalize`
+    '''
+    return pd.DataFrame({field: _canonical_column(dataframe[field]) for field in fields},
+                        index=dataframe.index)
+
+
+def normalize_url(value: Any) -> Any:
+    '''
+        Normalises a url so trivially different links to the same page compare equal:
+        lower-cases scheme and host, drops `www.`, fragments, trailing slashes and tracking query parameters and sorts the rest
+    '''
+    if not isinstance(value, str) or not value:
+        return value
+    parts = urlsplit(value.strip())
+    host = parts.netloc.lower()
+    host = host[4:] if host.startswith('www.') else host
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith(TRACKING_PARAMETERS))
+    return urlunsplit((parts.scheme.lower() or 'http', host, parts.path.rstrip('/'), urlencode(query), ''))
+
+
+def _normalize_string(value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, tuple):
+        value = ' '.join(str(x) for x in value)
+    return ' '.join(str(value).lower().split())
+
+
+def _to_days(value: Any) -> Any:
+    if hasattr(value, 'start') and hasattr(value, 'to_notion'):
+        value = value.start
+    if isinstance(value, datetime):
+        return value.timestamp() / 86400
+    if isinstance(value, date):
+        return float(value.toordinal() - date(1970, 1, 1).toordinal())
+    return None
+
+
+def normalized_frame(dataframe: pd.DataFrame, comparators: List[Comparator]) -> pd.DataFrame:
+    '''
+        Returns the compared fields of a dataframe prepared for comparison: canonical values for exact comparisons,
+        normalised strings and urls, numbers for numeric comparisons and days since epoch for date comparisons
+    '''
+    columns = {}
+    for comparator in comparators:
+        column = dataframe[comparator.field]
+        if comparator.method == 'date':
+            columns[comparator.field] = pd.Series([_to_days(x) for x in column], index=column.index, dtype=float)
+            continue
+        column = _canonical_column(column)
+        if comparator.method == 'string':
+            column = column.map(_normalize_string)
+        elif comparator.method == 'url':
+            column = column.map(normalize_url)
+        elif comparator.method == 'numeric':
+            column = pd.to_numeric(column, errors='coerce')
+        columns[comparator.field] = column
+    return pd.DataFrame(columns, index=dataframe.index)
+
+
+def _compare_chunk(comparators: List[Comparator], pairs: pd.MultiIndex, dataframe: pd.DataFrame) -> pd.DataFrame:
+    compare_cl = Compare()
+    for comparator in comparators:
+        field = comparator.field
+        if comparator.method == 'string':
+            compare_cl.string(field, field, method=comparator.algorithm, threshold=comparator.threshold, label=field)
+        elif comparator.method in ('numeric', 'date'):
+            compare_cl.numeric(field, field, method='step', offset=comparator.threshold or 0, label=field)
+        else:
+            compare_cl.exact(field, field, label=field)
+    return compare_cl.compute(pairs, dataframe)
+
+
+def compare(candidate_links: pd.MultiIndex,
+            dataframe: pd.DataFrame,
+            comparators: List[Comparator],
+            workers: int = 1,
+            chunk_size: int = 50000) -> pd.DataFrame:
+    '''
+        Computes the comparison features of candidate record pairs
+
+        Candidate pairs are split into blocks of `chunk_size` and, with more than one worker, compared in a process pool.
+        Each worker only receives the records its block refers to.
+
+        Arguments
+        ---------
+
+        candidate_links:    A pandas MultiIndex of candidate record pairs
+        dataframe:          A pandas DataFrame prepared by `normalized_frame`
+        comparators:        A List of Comparator objects, one per field
+
+        Parameters
+        ----------
+        workers:            Number of worker processes. Defaults to 1, comparing in process.
+        chunk_size:         Number of candidate pairs compared per block
+
+        Returns
+        -------
+        A pandas DataFrame of comparison features indexed by candidate pair, one column per field
+    '''
+    chunks = [candidate_links[start:start + chunk_size].remove_unused_levels()
+              for start in range(0, len(candidate_links), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        return pd.concat([_compare_chunk(comparators, chunk, dataframe) for chunk in chunks])
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for chunk in chunks:
+            labels = chunk.get_level_values(0).append(chunk.get_level_values(1)).unique()
+            futures.append(executor.submit(_compare_chunk, comparators, chunk, dataframe.loc[labels]))
+        return pd.concat([future.result() for future in futures])
+
+
+def classify(features: pd.DataFrame, comparators: List[Comparator], threshold: float = 1.0) -> pd.MultiIndex:
+    '''
+        Weighted score classifier. A pair matches when the weighted mean of its comparison features reaches `threshold`.
+
+        With the default threshold of 1 every field has to match.
+    '''
+    weights = pd.Series({comparator.field: comparator.weight for comparator in comparators})
+    scores = features[weights.index].mul(weights, axis=1).sum(axis=1) / weights.sum()
+    # tolerate float rounding on the weighted mean
+    return features.index[scores >= threshold - 1e-9]
+
+
+def exact_duplicates(dataframe: pd.DataFrame,
+                     comparison_fields: List[str],
+                     keep_first: bool = True) -> pd.Index:
+    '''
+        Finds records whose comparison fields all exactly match an earlier (or later) record in a single hashed pass
+
+        Equivalent to comparing every candidate pair with recordlinkage's `exact` comparison and keeping the pairs where all fields match,
+        without materialising candidate pairs or a feature matrix. Records with a missing value in any comparison field never match.
+
+        Arguments
+        ---------
+
+        dataframe:          A pandas DataFrame to search for duplicates
+        comparison_fields:  A List of string field names that must all match
+
+        Parameters
+        ----------
+        keep_first:         Marks every instance but the first of a duplicate record. If false, marks every instance but the last.
+
+        Returns
+        -------
+        A pandas Index of the duplicate records' labels
+    '''
+    canonical = canonical_frame(dataframe, comparison_fields)
+    canonical = canonical[canonical.notna().all(axis=1)]
+    duplicated = canonical.duplicated(keep='first' if keep_first else 'last')
+    logger.info("hash engine found %s duplicates in %s records", int(duplicated.sum()), len(dataframe))
+    return canonical.index[duplicated.to_numpy()]
+
+
+def _map_cells(dataframe: pd.DataFrame, function: Callable) -> pd.DataFrame:
+    # column by column, since DataFrame.map is pandas 2.1+ and applymap is deprecated from then on
+    return dataframe.apply(lambda column: column.map(function))
+
+
+def row_digests(dataframe: pd.DataFrame, fields: List[str]) -> pd.Series:
+    '''
+        Returns a 64-bit digest per row of the provided comparison fields.
+
+        Rows with a missing value in any comparison field are left out, since an exact comparison never matches a missing value.
+    '''
+    canonical = canonical_frame(dataframe, fields)
+    canonical = canonical[canonical.notna().all(axis=1)]
+    return pd.util.hash_pandas_object(_map_cells(canonical, repr), index=False)
+
+
+def content_digests(dataframe: pd.DataFrame, fields: List[str]) -> pd.Series:
+    '''
+        Returns a 64-bit digest per row of the provided fields, treating missing values, empty strings and empty lists alike
+    '''
+    canonical = _map_cells(canonical_frame(dataframe, fields), _content_value)
+    return pd.util.hash_pandas_object(_map_cells(canonical, repr), index=False)
+
+
+def _content_value(value: Any) -> Any:
+    # collapse the representations a value takes between a source and its Notion round trip
+    if hasattr(value, 'item'):
+        value = value.item()
+    value = canonicalize(value)
+    if value in ('', ()):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, tuple) and len(value) == 3 and value[1:] == (None, None) and isinstance(value[0], str):
+        # a NotionDate without end or timezone is just its start date
+        return value[0]
+    return value
+
+
+def _pairs_from_groups(keys: pd.Series) -> pd.MultiIndex:
+    '''
+        Builds candidate pairs between rows sharing a key. Pairs are oriented (later, earlier) like recordlinkage's own indexers.
+    '''
+    duplicated = keys[keys.duplicated(keep=False)]
+    pairs = []
+    for _, labels in duplicated.groupby(duplicated, sort=False).groups.items():
+        pairs.extend((later, earlier) for earlier, later in combinations(labels, 2))
+    return pd.MultiIndex.from_tuples(pairs) if pairs \
+        else pd.MultiIndex.from_arrays([[], []])
+
+
+def build_index(dataframe: pd.DataFrame,
+                strategy: str = 'full',
+                comparison_fields: List[str] = None,
+                on: List[str] = None,
+                window: int = 3) -> pd.MultiIndex:
+    '''
+        Builds the candidate record pairs for a deduplication run
+
+        Arguments
+        ---------
+
+        dataframe:          A pandas DataFrame to index
+        strategy:           One of `INDEX_STRATEGIES`.
+                                full: every pair of records, n·(n-1)/2 pairs
+                                block: pairs of records sharing the exact value of every `on` field
+                                sortedneighbourhood: pairs of records within `window` of each other once sorted on the first `on` field, blocked on any remaining `on` fields
+                                hash: pairs of records sharing a digest of all comparison fields. O(n) grouping for exact matching.
+        comparison_fields:  Fields used by the hash strategy and as the default `on` fields
+        on:                 Fields to block or sort on. Defaults to `comparison_fields`
+        window:             Window size of the sorted neighbourhood strategy. Must be odd.
+
+        Returns
+        -------
+        A pandas MultiIndex of candidate record pairs
+    '''
+    if strategy not in INDEX_STRATEGIES:
+        raise ValueError(f"{strategy} is not a valid index strategy, pick one of {INDEX_STRATEGIES}")
+
+    comparison_fields = comparison_fields or dataframe.columns.to_list()
+    on = list(on) if on else comparison_fields
+
+    if strategy == 'hash':
+        candidate_links = _pairs_from_groups(row_digests(dataframe, comparison_fields))
+    elif strategy == 'full':
+        indexer = Index()
+        indexer.full()
+        candidate_links = indexer.index(dataframe)
+    else:
+        # index on canonical values so list and date cells can be blocked / sorted on
+        keys = canonical_frame(dataframe, on)
+        indexer = Index()
+        if strategy == 'block':
+            indexer.block(on)
+        else:
+            if keys[on[0]].dtype == object:
+                keys[on[0]] = keys[on[0]].map(lambda x: x if x is None or type(x) is str else repr(x))
+            indexer.sortedneighbourhood(on[0], window=window, block_on=on[1:] or None)
+        candidate_links = indexer.index(keys)
+
+    logger.info("%s index produced %s candidate pairs for %s records", strategy, len(candidate_links), len(dataframe))
+    return candidate_links
+
+
+def key_digests(dataframe: pd.DataFrame, fields: List[str]) -> pd.DataFrame:
+    '''
+        Returns a 128-bit digest per row of the provided comparison fields, as `high` and `low` uint64 columns.
+
+        Rows with a missing value in any comparison field are left out, like `row_digests`.
+    '''
+    canonical = canonical_frame(dataframe, fields)
+    canonical = _map_cells(canonical[canonical.notna().all(axis=1)], repr)
+    return pd.DataFrame({name: pd.util.hash_pandas_object(canonical, index=False, hash_key=key)
+                         for name, key in zip(('high', 'low'), DIGEST_KEYS)}, index=canonical.index)
+
+
+def _spill(entries: np.ndarray, level: int, files: List) -> None:
+    # partitions on the next DEDUPE_SPILL_FANOUT bits of the digest, so every level splits a partition further
+    bits = int(math.log2(DEDUPE_SPILL_FANOUT))
+    partition = (entries['high'] >> np.uint64(level * bits)) & np.uint64(DEDUPE_SPILL_FANOUT - 1)
+    order = np.argsort(partition, kind='stable')
+    entries, partition = entries[order], partition[order]
+    bounds = np.searchsorted(partition, np.arange(DEDUPE_SPILL_FANOUT + 1, dtype=np.uint64))
+    for number, file in enumerate(files):
+        if bounds[number] < bounds[number + 1]:
+            entries[bounds[number]:bounds[number + 1]].tofile(file)
+
+
+def _partition_duplicates(path: Path, level: int, keep_first: bool, max_memory: int) -> Iterator[np.ndarray]:
+    '''
+        Yields the (position, id) entries of a partition file's duplicates, splitting partitions over the memory budget
+    '''
+    rows = path.stat().st_size // SPILL_DTYPE.itemsize
+    max_level = 64 // int(math.log2(DEDUPE_SPILL_FANOUT)) - 1
+    if rows * SPILL_WORKING_BYTES > max_memory and level < max_level:
+        paths = [path.with_name(f'{path.stem}-{x}.bin') for x in range(DEDUPE_SPILL_FANOUT)]
+        block = max(1, max_memory // (2 * SPILL_DTYPE.itemsize))
+        with ExitStack() as stack:
+            files = [stack.enter_context(open(x, 'wb')) for x in paths]
+            for offset in range(0, rows, block):
+                _spill(np.fromfile(path, dtype=SPILL_DTYPE, count=block, offset=offset * SPILL_DTYPE.itemsize),
+                       level + 1, files)
+        path.unlink()
+        for sub_path in paths:
+            yield from _partition_duplicates(sub_path, level + 1, keep_first, max_memory)
+        return
+
+    entries = np.fromfile(path, dtype=SPILL_DTYPE)
+    path.unlink()
+    if len(entries) < 2:
+        return
+    entries = entries[np.lexsort((entries['position'], entries['low'], entries['high']))]
+    same = (entries['high'][1:] == entries['high'][:-1]) & (entries['low'][1:] == entries['low'][:-1])
+    # every entry of a key but the first, or the last, in collection order
+    duplicated = np.concatenate([[False], same]) if keep_first else np.concatenate([same, [False]])
+    if duplicated.any():
+        yield entries[['position', 'id']][duplicated]
+
+
+def partitioned_duplicates(chunks: Iterable[pd.DataFrame],
+                           comparison_fields: List[str],
+                           keep_first: bool = True,
+                           max_memory: int = DEDUPE_MAX_MEMORY,
+                           directory: str = None) -> List[str]:
+    '''
+        Finds exact duplicates out of core: the 128-bit digests of each chunk's canonical comparison keys are spilled to disk in
+        hash partitions, and every partition is deduped on its own. Partitions too large for `max_memory` are split again on
+        further digest bits, so only one partition, about `max_memory` bytes, is held in memory at a time.
+
+        Returns the same records as `exact_duplicates` on the concatenated chunks, bar 128-bit digest collisions.
+
+        Arguments
+        ---------
+
+        chunks:             DataFrames of consecutive records in collection order, each with an `id` column of block ids
+        comparison_fields:  A List of string field names that must all match
+
+        Parameters
+        ----------
+        keep_first:         Marks every instance but the first of a duplicate record. If false, marks every instance but the last.
+        max_memory:         Bytes a partition is deduped in, excluding the chunks themselves and the returned ids
+        directory:          Where partitions are spilled. Defaults to the system's temporary directory.
+
+        Returns
+        -------
+        The block ids of the duplicate records, in collection order
+    '''
+    buffer_rows = max(1, max_memory // (4 * SPILL_DTYPE.itemsize))
+    with tempfile.TemporaryDirectory(prefix='thought-dedupe-', dir=directory) as spill:
+        paths = [Path(spill) / f'{x}.bin' for x in range(DEDUPE_SPILL_FANOUT)]
+        position, buffered, pending = 0, [], 0
+        with ExitStack() as stack:
+            files = [stack.enter_context(open(x, 'wb')) for x in paths]
+            for chunk in chunks:
+                digests = key_digests(chunk, comparison_fields)
+                positions = chunk.index.get_indexer(digests.index)
+                ids = chunk['id'].to_numpy()[positions].astype('S')
+                if ids.dtype.itemsize > SPILL_DTYPE['id'].itemsize:
+                    raise ValueError(f"block ids longer than {SPILL_DTYPE['id'].itemsize} bytes can't be spilled")
+                entries = np.empty(len(digests), dtype=SPILL_DTYPE)
+                entries['high'], entries['low'] = digests['high'].to_numpy(), digests['low'].to_numpy()
+                entries['position'], entries['id'] = positions + position, ids
+                buffered.append(entries)
+                position, pending = position + len(chunk), pending + len(entries)
+                if pending >= buffer_rows:
+                    _spill(np.concatenate(buffered), 0, files)
+                    buffered, pending = [], 0
+            if buffered:
+                _spill(np.concatenate(buffered), 0, files)
+
+        found = [x for path in paths for x in _partition_duplicates(path, 0, keep_first, max_memory)]
+    if not found:
+        return []
+    duplicates = np.concatenate(found)
+    duplicates = duplicates[np.argsort(duplicates['position'], kind='stable')]
+    logger.info("partitioned hash engine found %s duplicates in %s records", len(duplicates), position)
+    return [x.decode() for x in duplicates['id']]
@@ -1,6 +1,9 @@
 class ServiceNotRegisteredException(BaseException):
     pass
 
+class ServiceActionNotDefinedException(BaseException):
+    pass
+
 class CredentialsNotAuthorizedException(BaseException):
     pass
 
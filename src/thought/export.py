@@ -0,0 +1,275 @@
+"""Chunked export of collections to Parquet, Arrow IPC and CSV files, and import of those files into collections"""
+import logging
+from dataclasses import dataclass
+from datetime import time
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+import pandas as pd
+from thought.core import CollectionExtension, SyncPlan
+from thought.dedupe import canonicalize
+from thought.schema import DATETIME_PROPERTY_TYPES, CompiledSchema, _timestamp
+from thought.settings import EXPORT_CHUNK_SIZE, EXPORT_FORMAT, EXPORT_FORMATS, LOAD_STYLES
+from thought.utils import default_field
+from thought.writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+# separator of multi-select values in CSV files, the same as Notion's own CSV exports
+CSV_LIST_SEPARATOR = ', '
+
+
+def _pyarrow():
+    # pyarrow is optional, only the parquet and arrow formats need it
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as error:
+        raise ImportError("the parquet and arrow formats need pyarrow: pip install pyarrow") from error
+    return pyarrow
+
+
+def file_format(path: str, format: str = None) -> str:
+    '''
+        Returns the export format of a path, from its suffix unless one is passed
+    '''
+    if format is None:
+        suffix = Path(path).suffix.lstrip('.').lower()
+        format = {'feather': 'arrow', 'ipc': 'arrow'}.get(suffix, suffix)
+        format = format if format in EXPORT_FORMATS else EXPORT_FORMAT
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"{format} is not an export format, pick one of {EXPORT_FORMATS}")
+    return format
+
+
+def arrow_schema(schema: CompiledSchema):
+    '''
+        The Arrow schema of exported rows: dictionary encoded selects, string lists for multi-selects, UTC timestamps for dates
+        and strings for property types without a typed mapping
+    '''
+    pa = _pyarrow()
+    types = {
+        'select': pa.dictionary(pa.int32(), pa.string()),
+        'multi_select': pa.list_(pa.string()),
+        'number': pa.float64(),
+        'checkbox': pa.bool_(),
+    }
+    fields = [pa.field(x['slug'], pa.timestamp('ns', tz='UTC') if x['type'] in DATETIME_PROPERTY_TYPES
+                       else types.get(x['type'], pa.string()))
+              for x in schema.read]
+    return pa.schema(fields + [pa.field('id', pa.string())])
+
+
+def export_frame(schema: CompiledSchema, dataframe: pd.DataFrame) -> pd.DataFrame:
+    '''
+        Converts decoded rows to the typed columns of `arrow_schema`
+    '''
+    exported = pd.DataFrame(index=dataframe.index)
+    for prop in schema.read:
+        series = dataframe[prop['slug']]
+        if prop['type'] in DATETIME_PROPERTY_TYPES:
+            exported[prop['slug']] = pd.Series([_timestamp(x) for x in series], index=series.index,
+                                               dtype='datetime64[ns, UTC]')
+        elif prop['type'] == 'multi_select':
+            exported[prop['slug']] = series.map(lambda x: list(x) if x else [])
+        elif prop['type'] == 'number':
+            exported[prop['slug']] = series.astype('float64')
+        elif prop['type'] == 'checkbox':
+            exported[prop['slug']] = series.astype('bool')
+        else:
+            exported[prop['slug']] = series.map(lambda x: x if x is None or isinstance(x, str) else str(x))
+    exported['id'] = dataframe['id']
+    return exported
+
+
+def _python(value: Any, prop_type: str) -> Any:
+    # the python values `sync` expects back from an exported cell
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if prop_type == 'multi_select':
+        if isinstance(value, str):
+            return [x for x in value.split(CSV_LIST_SEPARATOR) if x]
+        return list(value) if isinstance(value, (list, tuple)) else []
+    if not isinstance(value, (list, tuple)) and pd.isna(value):
+        return None
+    if prop_type in DATETIME_PROPERTY_TYPES:
+        value = pd.Timestamp(value)
+        value = value.tz_convert('UTC') if value.tzinfo else value
+        value = value.to_pydatetime().replace(tzinfo=None)
+        # exported dates are midnight timestamps of their day
+        return value.date() if value.time() == time(0) else value
+    if prop_type == 'number':
+        value = float(value)
+        return int(value) if value.is_integer() else value
+    if prop_type == 'checkbox':
+        return value if isinstance(value, bool) else str(value).lower() in ('true', 'yes', '1')
+    return value.item() if hasattr(value, 'item') else value
+
+
+def import_frame(schema: CompiledSchema, dataframe: pd.DataFrame) -> pd.DataFrame:
+    '''
+        Converts a chunk of an exported file back to python property values, keeping only the collection's writable properties
+    '''
+    columns = {}
+    for slug in dataframe.columns:
+        if slug in schema.writable:
+            prop_type = schema.writable[slug]['type']
+            columns[slug] = [_python(x, prop_type) for x in dataframe[slug]]
+    return pd.DataFrame(columns, index=dataframe.index)
+
+
+def export_collection(collection: CollectionExtension,
+                      path: str,
+                      format: str = None,
+                      chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    '''
+        Streams a collection's rows to a file, one `iter_rows` chunk at a time, so memory use is bounded by the chunk size
+        rather than the collection size (when reading through the snapshot cache, which pages rows from disk)
+
+        Arguments
+        ---------
+
+        collection: The collection to export
+        path:       The file written
+        format:     One of parquet, arrow (Arrow IPC file) or csv. Defaults to the path's suffix, or parquet.
+        chunk_size: Rows held in memory, and written per row group or record batch
+
+        Returns
+        -------
+        The number of rows written
+    '''
+    format = file_format(path, format)
+    schema = collection.schema
+    rows = 0
+    if format == 'csv':
+        for number, chunk in enumerate(collection.iter_rows(batch_size=chunk_size)):
+            chunk = export_frame(schema, chunk)
+            for prop in schema.read:
+                if prop['type'] == 'multi_select':
+                    chunk[prop['slug']] = chunk[prop['slug']].map(CSV_LIST_SEPARATOR.join)
+            chunk.to_csv(path, mode='w' if number == 0 else 'a', header=number == 0, index=False)
+            rows += len(chunk)
+        if rows == 0:
+            pd.DataFrame(columns=list(schema.columns)).to_csv(path, index=False)
+        return rows
+
+    pa = _pyarrow()
+    table_schema = arrow_schema(schema)
+    if format == 'parquet':
+        writer = pa.parquet.ParquetWriter(path, table_schema)
+    else:
+        writer = pa.ipc.new_file(path, table_schema)
+    with writer:
+        for chunk in collection.iter_rows(batch_size=chunk_size):
+            table = pa.Table.from_pandas(export_frame(schema, chunk), schema=table_schema, preserve_index=False)
+            writer.write_table(table)
+            rows += len(chunk)
+    logger.info("exported %s rows to %s", rows, path)
+    return rows
+
+
+def read_arrow(path: str):
+    '''
+        Memory maps an exported Arrow IPC file, returning a pyarrow Table whose columns are read from the page cache on use
+        rather than copied into memory
+    '''
+    pa = _pyarrow()
+    return pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+
+
+def iter_file(path: str, format: str = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    '''
+        Yields an exported file's rows as DataFrame chunks of at most `chunk_size` rows
+    '''
+    format = file_format(path, format)
+    if format == 'csv':
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False, na_values=[''])
+        return
+
+    pa = _pyarrow()
+    if format == 'parquet':
+        for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+
+    reader = pa.ipc.open_file(pa.memory_map(str(path), 'r'))
+    for number in range(reader.num_record_batches):
+        batch = reader.get_batch(number)
+        for offset in range(0, batch.num_rows, chunk_size):
+            yield batch.slice(offset, chunk_size).to_pandas()
+
+
+@dataclass
+class ImportReport:
+    """
+    The rows an import read and the changes it made
+    """
+    rows: int = 0
+    chunks: int = 0
+    plan: SyncPlan = default_field(SyncPlan())
+
+    def __str__(self):
+        return f"read {self.rows} rows in {self.chunks} chunks: {self.plan}"
+
+
+def import_collection(collection: CollectionExtension,
+                      path: str,
+                      format: str = None,
+                      style: str = 'append',
+                      key: str = None,
+                      chunk_size: int = EXPORT_CHUNK_SIZE,
+                      dry_run: bool = False,
+                      writer: BatchWriter = None) -> ImportReport:
+    '''
+        Loads an exported file into a collection chunk by chunk
+
+        Arguments
+        ---------
+
+        collection: The collection rows are loaded into
+        path:       An exported file
+        format:     One of parquet, arrow or csv. Defaults to the path's suffix, or parquet.
+        style:      append creates every row. upsert creates rows with a new `key` and updates rows whose content changed.
+                    replace upserts and archives rows whose `key` is missing from the file.
+        key:        The column rows are matched on, for upsert and replace
+        chunk_size: Rows read and written at once
+        dry_run:    Only plan the changes
+        writer:     The BatchWriter submitting the changes
+
+        Returns
+        -------
+        An ImportReport, its plan holding every chunk's changes
+    '''
+    if style not in LOAD_STYLES:
+        raise ValueError(f"{style} is not a valid load style, pick one of {LOAD_STYLES}")
+    if style != 'append' and not key:
+        raise ValueError(f"{style} imports need a key to match rows on")
+
+    writer = writer or BatchWriter(collection.collection._client)
+    current_df = None if style == 'append' else collection.asdataframe()
+    report = ImportReport()
+    loaded = set()
+    for chunk in iter_file(path, format, chunk_size):
+        chunk = import_frame(collection.schema, chunk)
+        if style == 'append':
+            plan = collection.sync(chunk, current_df=pd.DataFrame(columns=['id']), archive=False,
+                                   dry_run=dry_run, writer=writer)
+        else:
+            loaded.update(chunk[key].map(canonicalize))
+            plan = collection.upsert(chunk, key=key, current_df=current_df, dry_run=dry_run, writer=writer)
+        report.rows += len(chunk)
+        report.chunks += 1
+        report.plan.creates.extend(plan.creates)
+        report.plan.updates.update(plan.updates)
+
+    if style == 'replace':
+        # archived once every chunk is loaded, a key missing from one chunk may be in the next
+        report.plan.archives = [block_id for value, block_id in zip(current_df[key].map(canonicalize), current_df['id'])
+                                if value not in loaded]
+        collection._write(SyncPlan(archives=report.plan.archives), dry_run=dry_run, writer=writer)
+    if not dry_run:
+        report.plan.stats = writer.stats
+    logger.info("imported %s", report)
+    return report
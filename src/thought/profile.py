@@ -0,0 +1,172 @@
+"""Timing and resource spans of the extract, fetch, decode, index, compare, classify and write stages of a run"""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
+
+try:
+    import resource
+except ImportError:  # unix only
+    resource = None
+
+# stages spans are recorded for, in the order they're reported
+STAGES = ['extract', 'fetch', 'decode', 'normalize', 'index', 'compare', 'classify', 'write']
+
+
+def peak_rss() -> int:
+    '''
+        Returns the peak resident set size of the process so far in bytes, or 0 where it can't be read
+    '''
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def transport_requests() -> int:
+    # only runs that sent requests have imported the transport
+    transport = sys.modules.get('thought.transport')
+    return transport.TRANSPORT.metrics.requests if transport is not None else 0
+
+
+@dataclass
+class Span:
+    """
+    The totals of every span of a stage
+    """
+    name: str
+    calls: int = 0
+    seconds: float = 0.0
+    rows: int = 0
+    requests: int = 0  # HTTP requests sent through the shared transport while a span was open
+    peak_rss: int = 0  # process peak resident set size in bytes when the last span closed
+
+    def add(self, seconds: float, rows: int = 0, requests: int = 0, peak: int = 0) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.rows += rows
+        self.requests += requests
+        self.peak_rss = max(self.peak_rss, peak)
+
+
+class SpanRecord:
+    """
+    An open span, its row count set by the code it measures
+    """
+    __slots__ = ('rows',)
+
+    def __init__(self, rows: int = 0):
+        self.rows = rows
+
+
+def format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+
+@dataclass
+class Profiler:
+    """
+    Collects spans of a run's stages: wall time, rows, requests and peak RSS per stage, optionally a cProfile of the whole
+    run and a trace of every span.
+
+    Disabled, a span only costs a check of `enabled`. Spans of concurrent threads are recorded under their thread in the
+    trace and summed in the totals, so a stage's seconds can exceed the run's wall time.
+    """
+    enabled: bool = False
+
+    def __post_init__(self):
+        self.spans: Dict[str, Span] = {}
+        self.events: List[Dict] = []
+        self._lock = threading.Lock()
+        self._profile = None
+        self._origin = time.perf_counter()
+
+    def enable(self, cprofile: bool = False) -> None:
+        '''
+            Starts recording spans, and profiling every function call when `cprofile` is set
+        '''
+        self.enabled = True
+        self._origin = time.perf_counter()
+        if cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self._profile is not None:
+            self._profile.disable()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans.clear()
+            self.events.clear()
+        self._profile = None
+
+    @contextmanager
+    def span(self, name: str, rows: int = 0) -> Iterator[SpanRecord]:
+        '''
+            Records the wall time, requests and peak RSS of the block it wraps under a stage, e.g.
+
+                with PROFILER.span('decode') as span:
+                    dataframe = decode(records)
+                    span.rows = len(dataframe)
+        '''
+        record = SpanRecord(rows)
+        if not self.enabled:
+            yield record
+            return
+        requests, start = transport_requests(), time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            requests, peak = transport_requests() - requests, peak_rss()
+            with self._lock:
+                self.spans.setdefault(name, Span(name)).add(seconds, record.rows, requests, peak)
+                self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (start - self._origin) * 1e6, 'dur': seconds * 1e6,
+                                    'args': {'rows': record.rows, 'requests': requests, 'peak_rss': peak}})
+
+    def table(self) -> str:
+        '''
+            Formats the stage totals as a text table, known stages first
+        '''
+        names = [x for x in STAGES if x in self.spans] + [x for x in self.spans if x not in STAGES]
+        header = ('stage', 'calls', 'seconds', 'rows', 'rows/sec', 'requests', 'peak rss')
+        rows = [header]
+        for span in (self.spans[x] for x in names):
+            rows.append((span.name, str(span.calls), f'{span.seconds:.3f}', str(span.rows),
+                         f'{span.rows / span.seconds:.0f}' if span.seconds and span.rows else '-',
+                         str(span.requests), format_bytes(span.peak_rss)))
+        widths = [max(len(row[x]) for row in rows) for x in range(len(header))]
+        return '\n'.join('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+    def dump_stats(self, path: str) -> None:
+        '''
+            Writes the cProfile of the run as a pstats file, readable with `python -m pstats` or snakeviz
+        '''
+        if self._profile is None:
+            raise ValueError("the profiler wasn't enabled with cprofile")
+        self._profile.dump_stats(path)
+
+    def dump_trace(self, path: str) -> None:
+        '''
+            Writes every span as a Chrome trace event file, viewable in chrome://tracing or Perfetto
+        '''
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w') as trace:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace)
+
+
+# shared by every stage of the process, enabled by `thought --profile`
+PROFILER = Profiler()
@@ -0,0 +1,228 @@
+"""Concurrent runner of service to collection sync jobs"""
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List
+
+import pytoml as toml
+import pandas as pd
+from notion.client import NotionClient
+from notion.utils import extract_id
+from thought.cache import CollectionIndex, SnapshotCache
+from thought.core import CollectionExtension, SyncPlan
+from thought.exceptions import (
+    CollectionMustAlreadyExistException,
+    CredentialsNotAuthorizedException,
+    LoadDestinationNotUniqueException,
+    ServiceActionNotDefinedException,
+    ServiceNotRegisteredException,
+)
+from thought.service import Registry
+from thought.settings import NOTION_SERVICES_DIRECTORY, SYNC_WORKERS
+from thought.utils import default_field
+
+logger = logging.getLogger(__name__)
+
+# errors that fail a single job, the thought exceptions aren't Exception subclasses
+JOB_ERRORS = (Exception,
+              CollectionMustAlreadyExistException,
+              CredentialsNotAuthorizedException,
+              LoadDestinationNotUniqueException,
+              ServiceActionNotDefinedException,
+              ServiceNotRegisteredException)
+
+
+@dataclass
+class SyncJob:
+    """
+    A service action whose output is loaded into the `{service}_{action}` collection of a target page
+    """
+    service: str
+    action: str
+    target: str = NOTION_SERVICES_DIRECTORY
+    style: str = 'upsert'
+    key: str = None
+    arguments: Dict[str, Any] = default_field({})  # keyword arguments of the service action
+
+    @property
+    def name(self) -> str:
+        return f'{self.service}_{self.action}'
+
+
+@dataclass
+class SyncResult:
+    """
+    The outcome and timings of a SyncJob
+    """
+    job: SyncJob
+    plan: SyncPlan = None
+    extract_seconds: float = 0.0
+    load_seconds: float = 0.0
+    timings: Dict[str, float] = default_field({})  # the service's own step timings
+    error: BaseException = None
+
+    @property
+    def seconds(self) -> float:
+        return self.extract_seconds + self.load_seconds
+
+
+def read_manifest(path: str) -> List[SyncJob]:
+    '''
+        Reads sync jobs from a TOML manifest of `[[sync]]` tables, e.g.
+
+            [[sync]]
+            service = "instapaper"
+            action = "bookmarks"
+            style = "upsert"
+            [sync.arguments]
+            folder = ["unread", "archive"]
+    '''
+    manifest = toml.loads(Path(path).read_text())
+    return [SyncJob(**x) for x in manifest.get('sync', [])]
+
+
+def timing_table(results: List[SyncResult]) -> str:
+    '''
+        Formats the per job timings and changes of a sync run as a text table
+    '''
+    header = ('job', 'extract', 'load', 'total', 'created', 'updated', 'archived', 'status')
+    rows = [header]
+    for result in results:
+        plan = result.plan or SyncPlan()
+        rows.append((result.job.name,
+                     f'{result.extract_seconds:.2f}s',
+                     f'{result.load_seconds:.2f}s',
+                     f'{result.seconds:.2f}s',
+                     str(len(plan.creates)),
+                     str(len(plan.updates)),
+                     str(len(plan.archives)),
+                     'ok' if result.error is None else f'failed: {result.error}'))
+    widths = [max(len(row[x]) for row in rows) for x in range(len(header) - 1)]
+    return '\n'.join('  '.join([value.ljust(width) for value, width in zip(row, widths)] + [row[-1]])
+                     for row in rows)
+
+
+@dataclass
+class SyncRunner:
+    """
+    Runs sync jobs concurrently on a thread pool, sharing one Notion client and one read of each target page's children.
+
+    Extraction from services runs fully in parallel, only loads into the same collection are serialised.
+    Target collections are looked up in a local CollectionIndex and checked with a single fetch, the target page's children
+    are only read when the index misses.
+    """
+    client: NotionClient
+    registry: Registry = None
+    cache: SnapshotCache = None
+    index: CollectionIndex = None
+    workers: int = SYNC_WORKERS
+    dry_run: bool = False
+    create_missing: bool = False
+
+    def __post_init__(self):
+        self.registry = self.registry or Registry()
+        self.index = self.index or CollectionIndex()
+        self._pages = {}  # target page: {collection name: [collection view blocks]}
+        self._pages_lock = Lock()
+        self._create_lock = Lock()
+        self._collection_locks = defaultdict(Lock)
+
+    def _children(self, target: str) -> Dict[str, List]:
+        with self._pages_lock:
+            if target not in self._pages:
+                children = defaultdict(list)
+                for block in self.client.get_block(target).children:
+                    children[getattr(block, 'title', None)].append(block)
+                self._pages[target] = children
+                self.index.rebuild(extract_id(target), {name: [x.id for x in blocks]
+                                                        for name, blocks in children.items() if name})
+            return self._pages[target]
+
+    def _indexed(self, page_id: str, name: str) -> List:
+        '''
+            Returns the indexed collection blocks of a name, or None if the index has no entry or is out of date
+        '''
+        block_ids = self.index.get(page_id, name)
+        if not block_ids:
+            return None
+        blocks = [self.client.get_block(x) for x in block_ids]
+        for block in blocks:
+            if block is None or not block.alive or block.get('parent_id') != page_id \
+                    or getattr(block, 'title', None) != name:
+                logger.info("collection index of %s is out of date", name)
+                return None
+        return blocks
+
+    def collection(self, job: SyncJob, data: pd.DataFrame = None) -> CollectionExtension:
+        '''
+            Finds the job's `{service}_{action}` collection under the target page, creating it from `data` when missing
+            and `create_missing` is set
+        '''
+        page_id = extract_id(job.target)
+        collection = self._indexed(page_id, job.name)
+        if collection is None:
+            collection = self._children(job.target).get(job.name, [])
+
+        if not collection:
+            if not self.create_missing or data is None:
+                raise CollectionMustAlreadyExistException(f"{job.name} must already exist")
+            with self._create_lock:
+                # another job may have created it meanwhile
+                collection = self._indexed(page_id, job.name)
+                if collection is None:
+                    created = CollectionExtension.create(self.client.get_block(job.target), job.name, data,
+                                                         cache=self.cache)
+                    self.index.add(page_id, job.name, created.collection.get('parent_id'))
+                    return created
+
+        if len(collection) > 1:
+            raise LoadDestinationNotUniqueException(f"Target collection must be unique: remove existing collection {job.name} or pick a new function name")
+
+        return CollectionExtension(collection[0].collection, cache=self.cache)
+
+    def discover(self, target: str = NOTION_SERVICES_DIRECTORY) -> List[SyncJob]:
+        '''
+            Builds a job for every registered service action that has a `{service}_{action}` collection on the target page
+        '''
+        children = self._children(target)
+        jobs = []
+        for service in self.registry.available:
+            for action in self.registry.register(service)._actions:
+                job = SyncJob(service, action, target=target)
+                if job.name in children:
+                    jobs.append(job)
+        return jobs
+
+    def _run(self, job: SyncJob) -> SyncResult:
+        result = SyncResult(job)
+        try:
+            start = time.perf_counter()
+            service = self.registry.register(job.service)()
+            with service.metadata.span('extract') as span:
+                data = service.call(job.action, **job.arguments)
+                span.rows = len(data) if data is not None else 0
+            result.extract_seconds = time.perf_counter() - start
+            result.timings = service.metadata.timings
+
+            start = time.perf_counter()
+            collection = self.collection(job, data)
+            with self._pages_lock:
+                lock = self._collection_locks[collection.collection.id]
+            with lock:
+                result.plan = service.load(data, collection, style=job.style, key=job.key, dry_run=self.dry_run)
+            result.load_seconds = time.perf_counter() - start
+        except JOB_ERRORS as error:
+            logger.exception("%s failed", job.name)
+            result.error = error
+        return result
+
+    def run(self, jobs: List[SyncJob]) -> List[SyncResult]:
+        '''
+            Runs the jobs, returning a SyncResult per job in the same order. A failed job doesn't stop the others.
+        '''
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self._run, jobs))
@@ -0,0 +1,261 @@
+"""Compiled collection schemas: property lookups and per-property decoders built once per schema version"""
+from dataclasses import dataclass
+from datetime import date, datetime
+from threading import RLock
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from notion.collection import Collection, CollectionRowBlock, NotionDate
+from notion.markdown import notion_to_markdown
+from thought.utils import default_field
+
+# pandas dtypes of notion property types, anything else is kept as python objects
+PROPERTY_DTYPES = {
+    'number': 'float64',
+    'checkbox': 'bool',
+}
+
+# notion property types computed by notion that can't be written to
+READ_ONLY_PROPERTY_TYPES = ['formula', 'rollup', 'created_time', 'last_edited_time', 'created_by', 'last_edited_by']
+
+# property types that aren't read into dataframes
+UNREAD_PROPERTY_TYPES = ['formula', 'rollup']
+
+# pandas dtypes of notion property types in compact dataframes, see CompiledSchema.compact
+COMPACT_DTYPES = {
+    'title': 'string',
+    'text': 'string',
+    'url': 'string',
+    'email': 'string',
+    'phone_number': 'string',
+    'checkbox': 'boolean',
+}
+
+# notion property types stored as datetime64[ns, UTC] in compact dataframes
+DATETIME_PROPERTY_TYPES = ['date', 'created_time', 'last_edited_time']
+
+# multi-selects with more distinct values than this are dictionary encoded instead of stored as bitsets
+MULTI_SELECT_BITS = 64
+
+
+def _decode_text(value: Any) -> str:
+    return notion_to_markdown(value) if value else ""
+
+
+def _decode_number(value: Any) -> Any:
+    if value is None:
+        return None
+    value = value[0][0]
+    return float(value) if "." in value else int(value)
+
+
+def _decode_select(value: Any) -> Any:
+    return value[0][0] if value else None
+
+
+def _decode_multi_select(value: Any) -> List[str]:
+    return [x.strip() for x in value[0][0].split(",")] if value else []
+
+
+def _decode_string(value: Any) -> str:
+    return value[0][0] if value else ""
+
+
+def _decode_checkbox(value: Any) -> bool:
+    return value[0][0] == "Yes" if value else False
+
+
+def _timestamp(value: Any) -> pd.Timestamp:
+    # a NotionDate is reduced to its start, naive datetimes are in the date's own timezone or UTC
+    timezone = getattr(value, 'timezone', None)
+    value = getattr(value, 'start', value)
+    if not isinstance(value, (date, datetime)):
+        return pd.NaT
+    value = pd.Timestamp(value)
+    if value.tzinfo is None:
+        value = value.tz_localize(timezone or 'UTC')
+    return value.tz_convert('UTC')
+
+
+def _compact_number(series: pd.Series) -> pd.Series:
+    series = series.astype('Float64')
+    values = series.dropna()
+    return series.astype('Int64') if (values == values.round()).all() else series
+
+
+def _categories(options: List[Dict], series: pd.Series) -> List[str]:
+    # the schema's option order, followed by values that aren't options (anymore)
+    categories = [x['value'] for x in options or []]
+    known = set(categories)
+    for value in series.dropna():
+        if value not in known:
+            known.add(value)
+            categories.append(value)
+    return categories
+
+
+def encode_multi_select(series: pd.Series, options: List[Dict] = None) -> Tuple[pd.Series, List[str]]:
+    '''
+        Encodes a Series of multi-select value lists as uint64 bitsets over the values in schema option order.
+        Falls back to a categorical of the comma joined values when there are more than MULTI_SELECT_BITS distinct values.
+
+        Returns
+        -------
+        The encoded Series and the values its bits stand for
+    '''
+    values = _categories(options, series.explode())
+    if len(values) > MULTI_SELECT_BITS:
+        return series.map(lambda x: ', '.join(x) if x else None).astype('category'), values
+    bits = {value: np.uint64(1) << np.uint64(position) for position, value in enumerate(values)}
+    encoded = [np.bitwise_or.reduce([bits[x] for x in items], initial=np.uint64(0)) if items else np.uint64(0)
+               for items in series]
+    return pd.Series(encoded, index=series.index, dtype='uint64', name=series.name), values
+
+
+def decode_multi_select(series: pd.Series, values: List[str]) -> pd.Series:
+    '''
+        Turns a Series encoded by `encode_multi_select` back into lists of values, in schema option order
+    '''
+    if series.dtype == 'category':
+        return series.astype(object).map(lambda x: x.split(', ') if isinstance(x, str) else [])
+    return series.map(lambda x: [value for position, value in enumerate(values) if int(x) >> position & 1])
+
+
+def memory_usage(dataframe: pd.DataFrame) -> int:
+    '''
+        Returns the bytes a DataFrame takes, including the python objects it holds
+    '''
+    return int(dataframe.memory_usage(deep=True).sum())
+
+
+# decoders of raw property values, matching notion-py's CollectionRowBlock._convert_notion_to_python.
+# types missing here need the client (users, relations, files) or the whole record and go through notion-py itself
+DECODERS = {
+    'title': _decode_text,
+    'text': _decode_text,
+    'number': _decode_number,
+    'select': _decode_select,
+    'multi_select': _decode_multi_select,
+    'email': _decode_string,
+    'phone_number': _decode_string,
+    'url': _decode_string,
+    'date': NotionDate.from_notion,
+    'checkbox': _decode_checkbox,
+}
+
+
+@dataclass
+class CompiledSchema:
+    """
+    A collection schema with O(1) property lookups by slug, name or id and a decoder per property,
+    so rows are decoded straight from their raw records
+    """
+    properties: List[Dict]
+
+    def __post_init__(self):
+        self.by_slug = {x['slug']: x for x in self.properties}
+        self.by_name = {x['name']: x for x in self.properties}
+        self.by_id = {x['id']: x for x in self.properties}
+        self.read = [x for x in self.properties if x['type'] not in UNREAD_PROPERTY_TYPES]
+        self.writable = {x['slug']: x for x in self.properties if x['type'] not in READ_ONLY_PROPERTY_TYPES}
+        self.columns = {x['slug']: PROPERTY_DTYPES.get(x['type'], 'object') for x in self.read}
+        self.columns['id'] = 'object'
+        self.decoders: List[Tuple[str, str, Callable]] = [(x['slug'], x['id'], DECODERS.get(x['type'])) for x in self.read]
+        # records only need to be in notion-py's record store when a property is decoded through notion-py
+        self.needs_store = any(decoder is None for _, _, decoder in self.decoders)
+
+    def property(self, field: str) -> Dict:
+        '''
+            Looks a property up by slug, name or id
+        '''
+        prop = self.by_slug.get(field) or self.by_name.get(field) or self.by_id.get(field)
+        if prop is None:
+            raise KeyError(f"{field} is not a property of the collection")
+        return prop
+
+    @staticmethod
+    def _fallback(prop: Dict, collection: Collection) -> Callable:
+        def decode(value: Any, record: Dict) -> Any:
+            block = CollectionRowBlock(collection._client, record['id'])
+            block.__dict__['collection'] = collection
+            return block._convert_notion_to_python(value, prop)
+        return decode
+
+    def frame(self, records: List[Dict], collection: Collection) -> pd.DataFrame:
+        '''
+            Decodes raw block records of `collection` into a typed DataFrame, one column per readable property plus `id`
+        '''
+        data = {}
+        for slug, prop_id, decoder in self.decoders:
+            values = [x.get('properties', {}).get(prop_id) for x in records]
+            if decoder is None:
+                decoder = self._fallback(self.by_id[prop_id], collection)
+                data[slug] = [decoder(value, record) for value, record in zip(values, records)]
+            else:
+                data[slug] = [decoder(value) for value in values]
+        data['id'] = [x['id'] for x in records]
+        return pd.DataFrame(data, columns=list(self.columns)).astype(self.columns)
+
+    def compact(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        '''
+            Converts a DataFrame of decoded rows to compact, vectorisable dtypes: categoricals for selects, bitsets for multi-selects
+            (see `encode_multi_select`), datetime64[ns, UTC] for dates, nullable integers, floats and booleans and strings for text.
+            The values each multi-select bitset stands for are kept in `attrs['multi_select']`.
+        '''
+        compacted = dataframe.copy()
+        multi_select = {}
+        for prop in self.read:
+            slug = prop['slug']
+            if slug not in compacted:
+                continue
+            if prop['type'] == 'select':
+                series = compacted[slug]
+                compacted[slug] = pd.Categorical(series, categories=_categories(prop.get('options'), series))
+            elif prop['type'] == 'multi_select':
+                compacted[slug], multi_select[slug] = encode_multi_select(compacted[slug], prop.get('options'))
+            elif prop['type'] == 'number':
+                compacted[slug] = _compact_number(compacted[slug])
+            elif prop['type'] in DATETIME_PROPERTY_TYPES:
+                compacted[slug] = pd.Series([_timestamp(x) for x in compacted[slug]], index=compacted.index,
+                                            dtype='datetime64[ns, UTC]')
+            elif prop['type'] in COMPACT_DTYPES:
+                compacted[slug] = compacted[slug].astype(COMPACT_DTYPES[prop['type']])
+        if 'id' in compacted:
+            compacted['id'] = compacted['id'].astype('string')
+        compacted.attrs['multi_select'] = multi_select
+        return compacted
+
+
+@dataclass
+class SchemaCache:
+    """
+    Compiled schemas keyed by collection id and the collection record's version
+    """
+    schemas: Dict[Tuple[str, int], CompiledSchema] = default_field({})
+
+    def __post_init__(self):
+        self._lock = RLock()
+
+    def get(self, collection: Collection) -> CompiledSchema:
+        key = (collection.id, collection.get('version'))
+        with self._lock:
+            compiled = self.schemas.get(key)
+        if compiled is None:
+            compiled = CompiledSchema(collection.get_schema_properties())
+            with self._lock:
+                self.invalidate(collection.id)
+                self.schemas[key] = compiled
+        return compiled
+
+    def invalidate(self, collection_id: str) -> None:
+        '''
+            Drops a collection's compiled schemas, for schema changes made locally that haven't bumped its version yet
+        '''
+        with self._lock:
+            for key in [x for x in self.schemas if x[0] == collection_id]:
+                del self.schemas[key]
+
+
+# shared by every collection wrapper in the process
+SCHEMAS = SchemaCache()
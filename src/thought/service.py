@@ -1,74 +1,162 @@
+import inspect
+import json
+import logging
+import os
 from abc import ABC
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from importlib import import_module
 from pathlib import Path
-from typing import Any, Dict, List
+from threading import Lock
+from typing import Any, ClassVar, Dict, List
 from urllib.parse import urljoin
 
 import pandas as pd
 import pytoml as toml
+from requests import Response
 from requests_oauthlib import OAuth1Session
-from thought.core import Metadata, CollectionExtension
-from thought.exceptions import ServiceNotRegisteredException
-from thought.settings import SERVICES_REGISTERED, NOTION_SERVICES_DIRECTORY
+from thought.core import CollectionExtension, Metadata, SyncPlan
+from thought.exceptions import ServiceActionNotDefinedException, ServiceNotRegisteredException
+from thought.settings import (
+    CREDENTIALS_PATH,
+    LOAD_STYLES,
+    NOTION_SERVICES_DIRECTORY,
+    SERVICES_ENTRY_POINT_GROUP,
+    SERVICES_REGISTERED,
+)
+from thought.transport import TRANSPORT
 from thought.utils import default_field
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class GenericService:
     _type: str = default_field('generic', init=False)
+    _load_key: str = default_field(None, init=False, repr=False)
     metadata: Metadata = default_field(Metadata(), init=False, repr=False)
 
-    RESERVED_WORDS: List[str] = default_field([
+    RESERVED_WORDS: ClassVar[List[str]] = [
         'call',
         'load',
         'client',
         'data',
         'authorize',
-        'metadata'
-    ], init=False, repr=False)
+        'metadata',
+        'accepted_arguments'
+    ]
+    _actions: ClassVar[Dict[str, str]] = {}  # action name: method name, built once per class
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # public, non constant, non reserved methods are the service's actions
+        cls._actions = {name: name for name in dir(cls)
+                        if not (name.startswith('_') or name.endswith('_'))
+                        and name != name.upper()
+                        and name not in cls.RESERVED_WORDS
+                        and callable(getattr(cls, name))}
 
     @staticmethod
     def _sanitize_input(input_):
         return input_.replace('-', '_')
 
-    def __getitem__(self, key) -> Any:
-        public = [x for x in self.__dir__() 
-                  if not (x.startswith('_') 
-                  or x.endswith('_'))
-        ]
-
-        # filter all caps variables
-        temp = [x for x in public 
-                if x != x.upper()
-        ]
-
-        # filter reserved words
-        temp = [x for x in temp 
-                if x not in self.RESERVED_WORDS
-        ]
-
-        action_map = {k: self.__getattribute__(self._sanitize_input(k))
-                                               for k in temp}
+    @classmethod
+    def accepted_arguments(cls, action: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the `arguments` the action's method accepts, all of them if it takes **kwargs or is not an action
+        """
+        name = cls._actions.get(cls._sanitize_input(action))
+        if name is None:
+            return dict(arguments)
+        parameters = inspect.signature(getattr(cls, name)).parameters.values()
+        if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters):
+            return dict(arguments)
+        accepted = {parameter.name for parameter in parameters
+                    if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)}
+        return {key: value for key, value in arguments.items() if key in accepted}
 
-        return action_map.get(self._sanitize_input(key))
+    def __getitem__(self, key) -> Any:
+        name = self._actions.get(self._sanitize_input(key))
+        return getattr(self, name) if name else None
 
     def call(self, action: str, **kwargs):
         """
         Calls service method
         """
-        try:
-            return self[action](**kwargs)
-        except Exception as e:
-            import ipdb
-            ipdb.set_trace()
+        method = self[action]
+        if method is None:
+            raise ServiceActionNotDefinedException(f"{action} is not an action of {type(self).__name__}")
+        return method(**kwargs)
 
-    def load(self, data: pd.DataFrame, target: CollectionExtension, style="append"):
+    def load(self,
+             data: pd.DataFrame,
+             target: CollectionExtension,
+             style: str = "append",
+             key: str = None,
+             dry_run: bool = False) -> SyncPlan:
         """
         Loads provided pandas dataframe to notion collection
+
+        style:  append creates every row. upsert creates rows with a new `key` and updates rows whose content changed.
+                replace upserts and archives rows whose `key` is missing from the data.
+        key:    The natural key rows are matched on. Defaults to the service's own key.
         """
-        for row in data.iterrows():          
-            import ipdb; ipdb.set_trace()
+        if style not in LOAD_STYLES:
+            raise ValueError(f"{style} is not a valid load style, pick one of {LOAD_STYLES}")
+        if not isinstance(target, CollectionExtension):
+            target = CollectionExtension(target)
+
+        if data.empty and style != 'replace':
+            # nothing new since the last incremental fetch, skip reading the target
+            plan = SyncPlan()
+        elif style == 'append':
+            plan = target.sync(data.drop(columns='id', errors='ignore'),
+                               current_df=pd.DataFrame(columns=['id']),
+                               archive=False,
+                               dry_run=dry_run)
+        else:
+            key = key or self._load_key
+            if not key:
+                raise ValueError(f"{style} loads need a key to match rows on")
+            plan = target.upsert(data, key=key, archive=style == 'replace', dry_run=dry_run)
+
+        if not dry_run:
+            self._checkpoint()
+        return plan
+
+    def _checkpoint(self) -> None:
+        """
+        Persists whatever incremental state the service keeps once its data has been loaded.
+
+        To be implemented by sub-classes
+        """
+        pass
+
+
+@dataclass
+class CredentialStore:
+    """
+    Access tokens of authorized services keyed by service and user, persisted as JSON readable only by its owner
+    """
+    path: Path = default_field(Path(CREDENTIALS_PATH))
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+
+    def _read(self) -> Dict[str, Dict[str, Dict]]:
+        return json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def get(self, service: str, user: str) -> Dict:
+        return self._read().get(service, {}).get(str(user))
+
+    def set(self, service: str, user: str, token: Dict) -> None:
+        credentials = self._read()
+        credentials.setdefault(service, {})[str(user)] = token
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(json.dumps(credentials))
+        # tighten files created before the store did
+        os.chmod(self.path, 0o600)
 
 
 @dataclass
@@ -76,48 +164,115 @@ class APIService(GenericService):
 
     _type: str = default_field('api', init=False)
     _auth_type: str = default_field('oauth', init=False, repr=False)
+    _user: str = default_field(None, init=False, repr=False)
+    _credentials: CredentialStore = default_field(None, init=False, repr=False)
+    _reauthorizing: Lock = field(default_factory=Lock, init=False, repr=False)
     client: OAuth1Session = default_field(None, init=False, repr=False)
     data: pd.DataFrame = default_field(None, init=False, repr=False)
 
-    def authorize(self) -> None:
+    def authorize(self, refresh: bool = False) -> None:
         """
         Authorizes APIService object for access. If successful the `client` property should contain an authorized requests session.
 
+        The token is cached in the credential store and reused by later runs, until `refresh` or a 401 response fetches a new one.
+        """
+        self._credentials = self._credentials or CredentialStore()
+        service = type(self).__name__
+        token = None if refresh else self._credentials.get(service, self._user)
+        if token is None:
+            logger.info("fetching a new %s access token", service)
+            token = self._fetch_token()
+            self._credentials.set(service, self._user, token)
+        # every service's requests share the connection pools, rate limits and retries of the transport
+        self.client = TRANSPORT.mount(self._session(token))
+
+    def _fetch_token(self) -> Dict:
+        """
+        Fetches a new access token from the service
+
         To be implemented by sub-classes
         """
         pass
 
+    def _session(self, token: Dict) -> OAuth1Session:
+        """
+        Builds an authorized requests session from an access token
+
+        To be implemented by sub-classes
+        """
+        pass
+
+    def _post(self, url: str, **kwargs) -> Response:
+        """
+        POSTs with the authorized client, re-authorizing once if the cached token has been revoked or has expired
+        """
+        client = self.client
+        response = client.post(url, **kwargs)
+        if response.status_code == 401:
+            with self._reauthorizing:
+                # concurrent requests share a single refresh
+                if self.client is client:
+                    self.authorize(refresh=True)
+            response = self.client.post(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+def _entry_points() -> Dict[str, Any]:
+    '''
+        Returns the installed service entry points by service name
+    '''
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # python < 3.8 only has the built in services
+        return {}
+    found = entry_points()
+    found = found.select(group=SERVICES_ENTRY_POINT_GROUP) if hasattr(found, 'select') \
+        else found.get(SERVICES_ENTRY_POINT_GROUP, [])
+    return {x.name: x for x in found}
+
 
 @dataclass
 class Registry:
     """
     Service registry which holds all properly registered services
+
+    Services are discovered from the `thought.services` entry point group, so third party packages can provide their own,
+    falling back to the built in services of `SERVICES_REGISTERED`. Nothing is imported until a service is registered.
     """
     services: Dict[str, Any] = default_field({}, init=False)  # a dictionary of service names: service objects
 
     def __getitem__(self, key):
         return self.services.get(key)
 
+    @property
+    def available(self) -> List[str]:
+        if not hasattr(self, '_entry_points'):
+            self._entry_points = _entry_points()
+        return sorted(set(SERVICES_REGISTERED) | set(self._entry_points))
+
     def register(self, service_name: str, return_service_obj: bool = True):
         """
         Registers a defined service object from a provided service name string
         """
-        if service_name not in SERVICES_REGISTERED.keys():
+        if service_name not in self.available:
             raise ServiceNotRegisteredException(
                 f"{service_name} is not a properly configured service")
 
-        # watch out! risky code ahead!
-        to_import = f'thought.services.{service_name}'
-        try:
-            sn = import_module(to_import)
-            output = eval(f'sn.{SERVICES_REGISTERED[service_name]}')
-        except ModuleNotFoundError:
-            raise ServiceNotRegisteredException(
-                f"{service_name} is not a properly configured service")
+        if service_name not in self.services:
+            try:
+                if service_name in self._entry_points:
+                    output = self._entry_points[service_name].load()
+                else:
+                    output = getattr(import_module(f'thought.services.{service_name}'),
+                                     SERVICES_REGISTERED[service_name])
+            except (ImportError, AttributeError):
+                raise ServiceNotRegisteredException(
+                    f"{service_name} is not a properly configured service")
 
-        # register the requested service
-        self.services[service_name] = output
+            # register the requested service
+            self.services[service_name] = output
 
         # return service object by default
         if return_service_obj:
-            return output
+            return self.services[service_name]
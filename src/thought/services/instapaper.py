@@ -1,27 +1,93 @@
-from typing import Dict
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Dict, List, Tuple, Union
 from dataclasses import dataclass
+from pathlib import Path
 from urllib.parse import urljoin
 
 import requests as req
 import pandas as pd
 from requests_oauthlib import OAuth1Session
+from thought.exceptions import CredentialsNotAuthorizedException
 from thought.service import APIService
 from thought.settings import (
+    INSTAPAPER_ALL_FOLDERS,
     INSTAPAPER_BASE_URL,
     INSTAPAPER_BOOKMARKS_DIRECTORY,
     INSTAPAPER_CONSUMER_ID,
     INSTAPAPER_CONSUMER_SECRET,
+    INSTAPAPER_FOLDERS,
+    INSTAPAPER_LOAD_KEY,
+    INSTAPAPER_PAGE_SIZE,
     INSTAPAPER_PASS,
-    INSTAPAPER_USER
+    INSTAPAPER_STATE_PATH,
+    INSTAPAPER_USER,
+    INSTAPAPER_WORKERS,
 )
 from thought.utils import default_field
 
+logger = logging.getLogger(__name__)
+
 
 # CONSTANTS SPECIFIC TO THIS SERVICE
 AUTH_MODE = 'client_auth'
 ENDPOINT_ALL_BOOKMARKS = 'bookmarks/list'
+ENDPOINT_ALL_FOLDERS = 'folders/list'
 ENDPOINT_AUTH = 'oauth/access_token'
 
+# held while a bookmark state file is read, merged and replaced
+_SAVING = Lock()
+
+
+@dataclass
+class BookmarkState:
+    """
+    The `bookmark_id: hash` pairs already synced from each folder, persisted as JSON.
+
+    Sent as the `have` argument of `bookmarks/list` so Instapaper only returns bookmarks that are new or changed since.
+    Concurrent sync jobs each hold their own state, so a save only writes the folders it changed, merged into the file.
+    """
+    path: Path = default_field(Path(INSTAPAPER_STATE_PATH))
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        self.folders = self._read()
+        self._changed = set()
+
+    def _read(self) -> Dict[str, Dict[str, str]]:
+        return json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def __getitem__(self, folder: str) -> Dict[str, str]:
+        return dict(self.folders.get(folder, {}))
+
+    def __setitem__(self, folder: str, have: Dict[str, str]) -> None:
+        self.folders[folder] = have
+        self._changed.add(folder)
+
+    def save(self) -> None:
+        '''
+            Writes the changed folders over the file's current state, replacing the file atomically so a crash mid-write
+            leaves the previous state
+        '''
+        with _SAVING:
+            folders = self._read()
+            folders.update({x: self.folders[x] for x in self._changed})
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name, suffix='.tmp')
+            try:
+                with os.fdopen(descriptor, 'w') as f:
+                    f.write(json.dumps(folders))
+                os.replace(temporary, self.path)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+            self.folders, self._changed = folders, set()
+
 
 @dataclass
 class InstapaperAPI(APIService):
@@ -30,8 +96,13 @@ class InstapaperAPI(APIService):
     """
     _base_url: str = default_field(INSTAPAPER_BASE_URL, init=False, repr=False)
     _api_version: float = default_field(1, init=False, repr=False)
+    _load_key: str = default_field(INSTAPAPER_LOAD_KEY, init=False, repr=False)
+    _state: BookmarkState = default_field(None, init=False, repr=False)
+    _user: str = default_field(INSTAPAPER_USER, init=False, repr=False)
 
     def __post_init__(self):
+        self._state = BookmarkState()
+        self._pending = {}
         self.authorize()
 
     def _concate_url_from_parts(self, suffix: str):
@@ -45,30 +116,97 @@ class InstapaperAPI(APIService):
             'x_auth_mode': AUTH_MODE
         }
 
-    def bookmarks(self, folder: str) -> pd.DataFrame:
-        suffix = ENDPOINT_ALL_BOOKMARKS
-        url = self._concate_url_from_parts(suffix)
-        response = self.client.get(url, params={'folder_id': folder})
+    @staticmethod
+    def _parse_bookmarks(response: Any) -> Tuple[List[Dict], List[str]]:
+        '''
+            Splits a bookmarks/list response into its bookmarks and the ids of bookmarks deleted since the `have` state
+        '''
+        if isinstance(response, dict):
+            deleted = response.get('delete_ids') or []
+            return response.get('bookmarks', []), [str(x) for x in deleted]
 
         # filter out account info & metadata
-        metadata_keys = {'type'}
-        account_keys = {
-            'username',
-            'user_id',
-            'type',
-            'subscription_is_active'
-        }
+        holder, deleted = [], []
+        for line in response:
+            if line.get('type') == 'bookmark':
+                holder.append(line)
+            elif line.get('delete_ids'):
+                deleted.extend(str(x) for x in str(line['delete_ids']).split(','))
+        return holder, deleted
+
+    def _folders(self) -> List[str]:
+        '''
+            Lists the ids of every folder: the built in unread, starred and archive folders and the user's own
+        '''
+        response = self._post(self._concate_url_from_parts(ENDPOINT_ALL_FOLDERS))
+        return INSTAPAPER_FOLDERS + [str(x['folder_id']) for x in response.json() if x.get('type') == 'folder']
+
+    def _folder_bookmarks(self, folder: str, incremental: bool, limit: int) -> pd.DataFrame:
+        start = time.perf_counter()
+        url = self._concate_url_from_parts(ENDPOINT_ALL_BOOKMARKS)
+        have = self._state[folder] if incremental else {}
         holder = []
-        for line in response.json():
-            line_keys = set(line.keys())
-            if line_keys == metadata_keys or line_keys == account_keys:
-                continue
-            holder.append(line)
-        return pd.DataFrame(holder)
-    
-    def authorize(self) -> None:
+        # bookmarks/list has no offset, so page by adding every bookmark received so far to `have`
+        while True:
+            params = {'folder_id': folder, 'limit': limit}
+            if have:
+                params['have'] = ','.join(f'{bookmark_id}:{hash_}' for bookmark_id, hash_ in have.items())
+            response = self._post(url, data=params)
+            bookmarks, deleted = self._parse_bookmarks(response.json())
+            for bookmark_id in deleted:
+                have.pop(bookmark_id, None)
+            for bookmark in bookmarks:
+                have[str(bookmark['bookmark_id'])] = bookmark.get('hash', '')
+            holder.extend(bookmarks)
+            if len(bookmarks) < limit:
+                break
+
+        self._pending[folder] = have
+        self.metadata.timings[f'bookmarks/{folder}'] = time.perf_counter() - start
+        logger.info("%s new or changed bookmarks in %s", len(holder), folder)
+        return pd.DataFrame(holder).assign(folder=folder)
+
+    def bookmarks(self,
+                  folder: Union[str, List[str]] = INSTAPAPER_BOOKMARKS_DIRECTORY,
+                  incremental: bool = True,
+                  limit: int = INSTAPAPER_PAGE_SIZE) -> pd.DataFrame:
         '''
-            Authorizes with instapaper oauth1 api
+            Lists the bookmarks of one or many folders, fetching folders concurrently
+
+            Arguments
+            ---------
+
+            folder:         An Instapaper folder id, one of unread, starred or archive, a List of them, or all for every folder
+
+            Parameters
+            ----------
+            incremental:    Only returns bookmarks that are new or changed since the last successful load. Defaults to True.
+            limit:          Bookmarks requested per page, at most 500
+
+            Returns
+            -------
+            A pandas DataFrame of bookmarks with the `folder` each was listed from
+        '''
+        if folder == INSTAPAPER_ALL_FOLDERS:
+            folder = self._folders()
+        folders = [folder] if isinstance(folder, str) else list(folder)
+        with ThreadPoolExecutor(max_workers=INSTAPAPER_WORKERS) as executor:
+            frames = list(executor.map(lambda x: self._folder_bookmarks(x, incremental, limit), folders))
+        bookmarks = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if 'bookmark_id' in bookmarks:
+            # starred bookmarks are listed in their own folder too
+            bookmarks = bookmarks.drop_duplicates(subset='bookmark_id', ignore_index=True)
+        return bookmarks
+
+    def _checkpoint(self) -> None:
+        for folder, have in self._pending.items():
+            self._state[folder] = have
+        self._state.save()
+        self._pending = {}
+
+    def _fetch_token(self) -> Dict:
+        '''
+            Exchanges the account's username and password for an access token with instapaper's xAuth flow
 
             Since this is just my personal account this is a simple oauth implmentation
         '''
@@ -82,4 +220,11 @@ class InstapaperAPI(APIService):
         if not session.authorized:
             raise CredentialsNotAuthorizedException("Not properly authorized, try again")
 
-        self.client = session
+        return {'oauth_token': credentials['oauth_token'],
+                'oauth_token_secret': credentials['oauth_token_secret']}
+
+    def _session(self, token: Dict) -> OAuth1Session:
+        return OAuth1Session(INSTAPAPER_CONSUMER_ID,
+                             client_secret=INSTAPAPER_CONSUMER_SECRET,
+                             resource_owner_key=token['oauth_token'],
+                             resource_owner_secret=token['oauth_token_secret'])
@@ -1,7 +1,32 @@
 import os
-from thought.utils import load_env
+from pathlib import Path
+
+# settings read from the environment are resolved on first access, loading the local .env file then,
+# so importing this module stays cheap and free of side effects
+ENVIRONMENT_SETTINGS = {
+    'CACHE_DIRECTORY': lambda: os.getenv("THOUGHT_CACHE_DIRECTORY", str(Path.home() / '.thought' / 'cache')),
+    'CREDENTIALS_PATH': lambda: os.getenv("THOUGHT_CREDENTIALS_PATH", str(Path.home() / '.thought' / 'credentials.json')),
+    'NOTION_ACCESS_TOKEN': lambda: os.getenv("NOTION_ACCESS_TOKEN"),
+    'INSTAPAPER_STATE_PATH': lambda: str(Path(__getattr__('CACHE_DIRECTORY')) / 'instapaper_bookmarks.json'),
+    'INSTAPAPER_CONSUMER_ID': lambda: os.getenv("INSTAPAPER_CONSUMER_ID"),
+    'INSTAPAPER_CONSUMER_SECRET': lambda: os.getenv("INSTAPAPER_CONSUMER_SECRET"),
+    'INSTAPAPER_USER': lambda: os.getenv("INSTAPAPER_USER"),
+    'INSTAPAPER_PASS': lambda: os.getenv("INSTAPAPER_PASS"),
+}
+_env_loaded = False
+
+
+def __getattr__(name):
+    global _env_loaded
+    if name not in ENVIRONMENT_SETTINGS:
+        raise AttributeError(f"module {__name__} has no attribute {name}")
+    if not _env_loaded:
+        from thought.utils import load_env
+        load_env()
+        _env_loaded = True
+    value = globals()[name] = ENVIRONMENT_SETTINGS[name]()
+    return value
 
-load_env()
 
 # loggings settings
 LOGGING_FORMAT = "%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s"  # noqa: E501
@@ -10,20 +35,64 @@ LOGGING_FILE = 'log.txt'
 LOGGING_PATH = '.'
 
 # general settings
-NOTION_ACCESS_TOKEN = os.getenv("NOTION_ACCESS_TOKEN")
 NOTION_SERVICES_DIRECTORY = "https://www.notion.so/Services-008f866a7d564af6ad9e49cd8368788b"
+NOTION_BATCH_SIZE = 100
+NOTION_CONCURRENCY = 1  # record chunks fetched at once, above 1 reads go through AsyncNotionAPI
+
+# dedupe settings
+DEDUPE_ENGINES = ['auto', 'hash', 'recordlinkage']
+DEDUPE_INDEX_STRATEGIES = ['full', 'block', 'sortedneighbourhood', 'hash']
+DEDUPE_ENGINE = 'auto'
+DEDUPE_INDEX_STRATEGY = 'hash'
+DEDUPE_WINDOW = 3
+DEDUPE_MATCH_THRESHOLD = 1.0
+DEDUPE_WORKERS = os.cpu_count() or 1
+DEDUPE_CHUNK_SIZE = 50000
+DEDUPE_MAX_MEMORY = 256 * 1024 ** 2  # bytes an out-of-core dedupe dedupes a partition in, see dedupe.partitioned_duplicates
+DEDUPE_SPILL_FANOUT = 16  # partitions spilled keys, and partitions over the memory budget, are split into
+
+# write-back settings
+WRITE_BATCH_SIZE = 100  # operations per transaction
+WRITE_WORKERS = 4
+
+# load styles of service data into a collection
+LOAD_STYLES = ['append', 'upsert', 'replace']
+SYNC_WORKERS = 4  # sync jobs run at once
+
+# watch settings
+WATCH_INTERVAL = 30.0  # seconds between polls for edited rows
+WATCH_MAX_INTERVAL = 300.0  # polling slows down to this while nothing is edited
+WATCH_MAX_BATCH = 500  # edited rows processed per poll, the rest wait for the next one
+
+# http transport settings, shared by the Notion client and API services
+TRANSPORT_POOL_CONNECTIONS = 4  # hosts with pooled connections
+TRANSPORT_POOL_MAXSIZE = 16  # connections kept open per host, at least the most concurrent requests to one host
+TRANSPORT_MAX_RETRIES = 5
+TRANSPORT_BACKOFF = 1.0  # seconds, doubled on every retry
+TRANSPORT_RATE_LIMITS = {  # host: (requests per second, burst)
+    'www.notion.so': (3.0, 10),
+    'www.instapaper.com': (5.0, 10),
+}
+TRANSPORT_DEFAULT_RATE_LIMIT = (10.0, 20)
+TRANSPORT_UNSAFE_ENDPOINTS = ('submitTransaction',)  # non-idempotent requests, not retried once they may have landed
 
+# export and import settings
+EXPORT_FORMATS = ['parquet', 'arrow', 'csv']
+EXPORT_FORMAT = 'parquet'
+EXPORT_CHUNK_SIZE = 1000  # rows held in memory at once
 
-# data source providers / register external services here
+# data source providers / built in services, other packages register theirs under the entry point group
 SERVICES_REGISTERED = {
     'instapaper': 'InstapaperAPI'
 }
+SERVICES_ENTRY_POINT_GROUP = 'thought.services'
 SERVICES_CONFIGURATION_PATH = ['services']
 
 # instapaper settings
 INSTAPAPER_BASE_URL = 'https://www.instapaper.com/api'
 INSTAPAPER_BOOKMARKS_DIRECTORY = 'archive'
-INSTAPAPER_CONSUMER_ID = os.getenv("INSTAPAPER_CONSUMER_ID") 
-INSTAPAPER_CONSUMER_SECRET = os.getenv("INSTAPAPER_CONSUMER_SECRET") 
-INSTAPAPER_USER = os.getenv("INSTAPAPER_USER") 
-INSTAPAPER_PASS = os.getenv("INSTAPAPER_PASS")
+INSTAPAPER_LOAD_KEY = 'bookmark_id'
+INSTAPAPER_PAGE_SIZE = 500  # the most bookmarks/list returns per request
+INSTAPAPER_FOLDERS = ['unread', 'starred', 'archive']  # built in folders, user folders are listed with folders/list
+INSTAPAPER_ALL_FOLDERS = 'all'  # folder argument standing for every folder
+INSTAPAPER_WORKERS = 4
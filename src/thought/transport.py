@@ -0,0 +1,207 @@
+"""Shared HTTP transport: pooled connections, per host token bucket rate limits, retries and request metrics"""
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from requests import ConnectionError, ConnectTimeout, PreparedRequest, Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from thought.settings import (
+    TRANSPORT_BACKOFF,
+    TRANSPORT_DEFAULT_RATE_LIMIT,
+    TRANSPORT_MAX_RETRIES,
+    TRANSPORT_POOL_CONNECTIONS,
+    TRANSPORT_POOL_MAXSIZE,
+    TRANSPORT_RATE_LIMITS,
+    TRANSPORT_UNSAFE_ENDPOINTS,
+)
+from thought.utils import default_field
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def retry_delay(response: Response, attempt: int, backoff: float) -> float:
+    '''
+        Seconds to wait before retrying a failed request, the response's `Retry-After` header or an exponential backoff
+    '''
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return backoff * 2 ** attempt
+
+
+def unsent(error: ConnectionError) -> bool:
+    '''
+        Whether a connection error happened before the request was sent, so the server can't have acted on it
+    '''
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, ConnectTimeout) or isinstance(reason, NewConnectionError)
+
+
+@dataclass
+class TokenBucket:
+    """
+    A thread safe token bucket allowing `rate` requests per second on average, in bursts of up to `capacity`
+    """
+    rate: float
+    capacity: float
+
+    def __post_init__(self):
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self) -> float:
+        '''
+            Takes a token, sleeping until one is available. Returns the seconds waited.
+        '''
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # tokens are reserved ahead, so waiting callers are served in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+@dataclass
+class TransportMetrics:
+    """
+    Counters and latencies of the requests sent through a Transport
+    """
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0  # requests that still failed after every retry allowed
+    throttled_seconds: float = 0.0
+    latencies: Dict[str, List[float]] = default_field({})  # host: seconds per request
+
+    def __post_init__(self):
+        self.latencies = defaultdict(list, self.latencies)
+        self._lock = Lock()
+
+    def record(self, host: str, seconds: float, throttled: float = 0.0) -> None:
+        with self._lock:
+            self.requests += 1
+            self.throttled_seconds += throttled
+            self.latencies[host].append(seconds)
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def percentile(self, percent: float, host: str = None) -> float:
+        '''
+            Returns a latency percentile in seconds, of one host or of every request
+        '''
+        # numpy is only imported once metrics are reported, keeping it off the startup path of every command
+        import numpy as np
+
+        latencies = self.latencies.get(host, []) if host else [x for values in self.latencies.values() for x in values]
+        return float(np.percentile(latencies, percent)) if latencies else 0.0
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.retries} retries, {self.failures} failures, "
+                f"latency p50 {self.percentile(50) * 1000:.0f}ms p90 {self.percentile(90) * 1000:.0f}ms "
+                f"p99 {self.percentile(99) * 1000:.0f}ms, {self.throttled_seconds:.1f}s throttled")
+
+
+class TransportAdapter(HTTPAdapter):
+    """
+    A pooled requests adapter that sends through its Transport's rate limits and retry policy
+    """
+
+    def __init__(self, transport: 'Transport'):
+        self.transport = transport
+        super().__init__(pool_connections=transport.pool_connections, pool_maxsize=transport.pool_maxsize,
+                         max_retries=0)
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        '''
+            Sends a request, retrying it under the transport's policy. The returned response's `retries` holds how many
+            times it was retried.
+        '''
+        transport = self.transport
+        host = urlsplit(request.url).hostname
+        bucket = transport.bucket(host)
+        idempotent = transport.idempotent(request)
+        for attempt in range(transport.max_retries + 1):
+            throttled = bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = super().send(request, **kwargs)
+            except ConnectionError as error:
+                transport.metrics.record(host, time.perf_counter() - start, throttled)
+                # a non-idempotent request may have been acted on unless it never left
+                if attempt == transport.max_retries or not (idempotent or unsent(error)):
+                    transport.metrics.count('failures')
+                    raise
+                delay = retry_delay(None, attempt, transport.backoff)
+            else:
+                transport.metrics.record(host, time.perf_counter() - start, throttled)
+                response.retries = attempt
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response
+                # rate limited requests were refused unprocessed, server errors may have been processed
+                if attempt == transport.max_retries or not (idempotent or response.status_code == 429):
+                    transport.metrics.count('failures')
+                    return response
+                delay = retry_delay(response, attempt, transport.backoff)
+                response.close()
+            logger.warning("request to %s failed, retrying in %.1fs", host, delay)
+            transport.metrics.count('retries')
+            time.sleep(delay)
+
+
+@dataclass
+class Transport:
+    """
+    HTTP settings shared by every session mounted on it: connection pool sizes, a token bucket per host, the retry policy
+    for rate limited (429), server error and dropped requests, and the metrics of every request sent.
+
+    Requests to `unsafe_endpoints`, like Notion's submitTransaction, aren't idempotent, so they're only retried when
+    rate limited or when the connection failed before they were sent.
+    """
+    rate_limits: Dict[str, Tuple[float, int]] = default_field(TRANSPORT_RATE_LIMITS)
+    default_rate_limit: Tuple[float, int] = TRANSPORT_DEFAULT_RATE_LIMIT
+    max_retries: int = TRANSPORT_MAX_RETRIES
+    backoff: float = TRANSPORT_BACKOFF
+    pool_connections: int = TRANSPORT_POOL_CONNECTIONS
+    pool_maxsize: int = TRANSPORT_POOL_MAXSIZE
+    unsafe_endpoints: Tuple[str, ...] = TRANSPORT_UNSAFE_ENDPOINTS
+    metrics: TransportMetrics = field(default_factory=TransportMetrics, init=False)
+
+    def __post_init__(self):
+        self._buckets = {}
+        self._lock = Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(*self.rate_limits.get(host, self.default_rate_limit))
+            return self._buckets[host]
+
+    def idempotent(self, request: PreparedRequest) -> bool:
+        return not urlsplit(request.url).path.rstrip('/').endswith(self.unsafe_endpoints)
+
+    def mount(self, session: Session) -> Session:
+        '''
+            Sends a requests session's requests through this transport, replacing its adapters and their retries
+        '''
+        adapter = TransportAdapter(self)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+# shared by every client and service in the process, its metrics are reported at the end of each command
+TRANSPORT = Transport()
@@ -28,4 +28,4 @@ def default_field(obj, **kwargs):
     """
     returns field object that can handle default factory functions properly
     """
-    return field(default_factory=lambda: copy.copy(obj), **kwargs)
+    return field(default_factory=lambda: copy.deepcopy(obj), **kwargs)
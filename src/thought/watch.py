@@ -0,0 +1,162 @@
+"""Long running watch of a collection that dedupes and sorts rows as they are edited"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List
+
+from thought.cache import DuplicateIndex
+from thought.core import CollectionExtension, SyncPlan
+from thought.settings import WATCH_INTERVAL, WATCH_MAX_BATCH, WATCH_MAX_INTERVAL
+from thought.utils import default_field
+from thought.writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WatchReport:
+    """
+    What a single poll of a watch did
+    """
+    edited: int = 0  # rows edited since the previous poll
+    processed: int = 0
+    pending: int = 0  # edited rows left for later polls
+    sorted: int = 0
+    archived: List[str] = default_field([])
+    seconds: float = 0.0
+
+    def __str__(self):
+        return (f"{self.edited} edited, {self.processed} processed, {self.pending} pending, {self.sorted} sorted, "
+                f"{len(self.archived)} archived in {self.seconds:.2f}s")
+
+
+@dataclass
+class Watcher:
+    """
+    Polls a collection for rows edited since the snapshot cache's persisted watermark, and dedupes and sorts only those rows.
+
+    Exact duplicates are found through the collection's persistent DuplicateIndex, brought up to date when the watch
+    starts, so each poll hashes and looks up only the rows edited. A row matching an indexed row is archived, the indexed
+    row is kept. At most `max_batch` edited rows are processed per poll. A backlog is drained without waiting, an idle
+    collection is polled less and less often, up to `max_interval`.
+    """
+    collection: CollectionExtension
+    fields: List[str] = None  # dedupe fields, defaults to every writable property
+    sort_fields: List[str] = default_field([])  # multi-select properties whose values are kept sorted
+    dedupe: bool = True
+    interval: float = WATCH_INTERVAL
+    max_interval: float = WATCH_MAX_INTERVAL
+    max_batch: int = WATCH_MAX_BATCH
+    dry_run: bool = False
+
+    def __post_init__(self):
+        if self.collection.cache is None:
+            raise ValueError("watching a collection needs its snapshot cache")
+        self.index = DuplicateIndex(path=self.cache.path)
+        self.pending = OrderedDict()  # block id: raw record of edited rows not processed yet
+        self.writer = BatchWriter(self.collection.collection._client)
+        schema = self.collection.schema
+        self.fields = self.fields or [x for x in schema.writable if x in schema.columns]
+
+    @property
+    def cache(self):
+        return self.collection.cache
+
+    def _archive(self, block_ids: List[str]) -> None:
+        if not block_ids or self.dry_run:
+            return
+        self.collection._write(SyncPlan(archives=block_ids), writer=self.writer)
+        self.cache.remove(self.collection.collection.id, block_ids)
+
+    def _sort(self, records: List[Dict]) -> int:
+        dataframe = self.collection._records_frame(records)
+        sorted_rows = 0
+        for field in self.sort_fields:
+            prop = self.collection.schema.property(field)
+            sorted_rows += self.collection.sort_multiselect_values(prop, rows=dataframe, dry_run=self.dry_run,
+                                                                   writer=self.writer).rewritten
+        return sorted_rows
+
+    def process(self, records: List[Dict]) -> WatchReport:
+        '''
+            Sorts and dedupes a batch of edited rows' raw records against the duplicate index, returning what changed
+        '''
+        report = WatchReport(processed=len(records))
+        if self.sort_fields:
+            report.sorted = self._sort(records)
+
+        if self.dedupe and records:
+            block_ids = [x['id'] for x in records]
+            self.collection._index_keys(self.index, self.fields, records)
+            batch = set(block_ids)
+            for group in self.index.groups(self.collection.collection.id, self.fields, block_ids).values():
+                # the row indexed before this batch is kept, or the batch's first row in collection order
+                kept = next((x for x in group if x not in batch), group[0])
+                report.archived.extend(x for x in group if x in batch and x != kept)
+            self._archive(report.archived)
+        return report
+
+    def start(self) -> WatchReport:
+        '''
+            Brings the snapshot and the duplicate index up to date, deduping the whole collection once and sorting every row
+        '''
+        start = time.perf_counter()
+        collection_id = self.collection.collection.id
+        report = WatchReport()
+        if self.dedupe:
+            # only rows edited since the index was last used are hashed
+            duplicates, _ = self.collection.indexed_duplicates(self.fields, index=self.index)
+            report.processed = len(self.cache.block_ids(collection_id))
+            report.archived = duplicates
+            self._archive(duplicates)
+        else:
+            self.cache.update(self.collection.collection, concurrency=self.collection.concurrency)
+            report.processed = len(self.cache.block_ids(collection_id))
+        if self.sort_fields:
+            for records in self.cache.records(collection_id, self.max_batch):
+                report.sorted += self._sort(records)
+        report.seconds = time.perf_counter() - start
+        logger.info("watching %s rows: %s", report.processed, report)
+        return report
+
+    def poll(self) -> WatchReport:
+        '''
+            Fetches rows edited since the last poll and processes up to `max_batch` of the edited rows waiting
+        '''
+        start = time.perf_counter()
+        collection_id = self.collection.collection.id
+        edited = self.cache.update(self.collection.collection, concurrency=self.collection.concurrency)
+        # rows deleted or archived outside the watch leave the snapshot, and so the index
+        self.index.prune(collection_id, self.fields)
+        for record in edited:
+            self.pending.pop(record['id'], None)
+            self.pending[record['id']] = record
+
+        batch = [self.pending.popitem(last=False)[1] for _ in range(min(self.max_batch, len(self.pending)))]
+        report = self.process(batch) if batch else WatchReport()
+        report.edited = len(edited)
+        report.pending = len(self.pending)
+        report.seconds = time.perf_counter() - start
+        if batch:
+            logger.info("watch: %s", report)
+        return report
+
+    def run(self, iterations: int = None) -> None:
+        '''
+            Polls until interrupted, or for a number of polls
+        '''
+        self.start()
+        delay = self.interval
+        polls = 0
+        while iterations is None or polls < iterations:
+            report = self.poll()
+            polls += 1
+            if report.pending:
+                delay = 0.0
+            elif report.processed:
+                delay = self.interval
+            else:
+                delay = min(max(delay, self.interval) * 2, self.max_interval)
+            if iterations is None or polls < iterations:
+                time.sleep(delay)
@@ -0,0 +1,103 @@
+"""Batched, concurrent write-back of operations to Notion"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List
+
+from notion.client import NotionClient
+from notion.operations import operation_update_last_edited
+from thought.settings import WRITE_BATCH_SIZE, WRITE_WORKERS
+from thought.utils import default_field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WriteStats:
+    """
+    Counters of a write-back run
+    """
+    rows: int = 0
+    operations: int = 0
+    transactions: int = 0
+    retries: int = 0  # transactions resent by the transport after a rate limit or unsent connection
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.rows} rows in {self.transactions} transactions, {self.seconds:.2f}s "
+                f"({self.rows_per_second:.1f} rows/sec), {self.retries} retries")
+
+
+@dataclass
+class BatchWriter:
+    """
+    Submits per-row groups of Notion operations as batched transactions through a bounded thread pool.
+
+    A row's operations always land in the same transaction. Retries are left to the client's transport, which only
+    resends a transaction Notion can't have applied: one rate limited (429) or whose connection failed before it was sent.
+    """
+    client: NotionClient
+    batch_size: int = WRITE_BATCH_SIZE
+    workers: int = WRITE_WORKERS
+    stats: WriteStats = default_field(WriteStats(), init=False)
+
+    def __post_init__(self):
+        self._lock = Lock()
+
+    def _batches(self, rows: List[List[Dict]]) -> List[List[Dict]]:
+        '''
+            Packs row operation groups into transactions of roughly `batch_size` operations
+        '''
+        batches, batch = [], []
+        for operations in rows:
+            if batch and len(batch) + len(operations) > self.batch_size:
+                batches.append(batch)
+                batch = []
+            batch.extend(operations)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def submit(self, operations: List[Dict]) -> None:
+        '''
+            Submits operations as a single transaction
+        '''
+        block_ids = {x['id'] for x in operations if x['table'] == 'block'}
+        operations = operations + [operation_update_last_edited(self.client.current_user.id, x) for x in block_ids]
+        response = self.client.post('submitTransaction', {'operations': operations})
+
+        # keep notion-py's local record store in step with what was written
+        self.client._store.run_local_operations(operations)
+        with self._lock:
+            self.stats.transactions += 1
+            self.stats.operations += len(operations)
+            self.stats.retries += getattr(response, 'retries', 0)
+
+    def write(self, rows: List[List[Dict]]) -> WriteStats:
+        '''
+            Writes groups of operations, one group per row
+
+            Arguments
+            ---------
+
+            rows:   A List of Lists of Notion operations, each inner List holding every operation for one row
+
+            Returns
+            -------
+            The WriteStats of this writer
+        '''
+        start = time.perf_counter()
+        rows = [x for x in rows if x]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # consume the results so the first failed transaction is raised
+            list(executor.map(self.submit, self._batches(rows)))
+        self.stats.rows += len(rows)
+        self.stats.seconds += time.perf_counter() - start
+        logger.info("wrote %s", self.stats)
+        return self.stats
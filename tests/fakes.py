@@ -0,0 +1,454 @@
+"""In-process stand-ins for the Notion record API and Instapaper, used by the test suite and the benchmarks."""
+
+
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from copy import deepcopy
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from notion.client import NotionClient
+from requests import HTTPError
+from notion.collection import NotionDate
+from thought.service import GenericService
+from thought.transport import Transport, TransportAdapter
+from thought.utils import default_field
+
+SCHEMA = {
+    'titl': {'name': 'Title', 'type': 'title'},
+    'tags': {'name': 'Tags', 'type': 'multi_select', 'options': [
+        {'id': str(uuid.uuid4()), 'value': f'tag{x}', 'color': 'default'} for x in range(10)
+    ]},
+    'urll': {'name': 'URL', 'type': 'url'},
+    'star': {'name': 'Stars', 'type': 'number'},
+    'publ': {'name': 'Published', 'type': 'date'},
+    'done': {'name': 'Done', 'type': 'checkbox'},
+}
+
+BOOKMARK_SCHEMA = dict(SCHEMA, bkid={'name': 'Bookmark ID', 'type': 'number'})
+
+
+def encode_property(prop_type, value):
+    '''
+        Encodes a python value the way Notion stores it in a block's `properties`
+    '''
+    if value is None:
+        return None
+    if prop_type in ('title', 'text'):
+        return [[value]]
+    if prop_type == 'multi_select':
+        return [[','.join(value)]] if value else None
+    if prop_type == 'url':
+        return [[value, [['a', value]]]]
+    if prop_type == 'number':
+        return [[str(value)]]
+    if prop_type == 'date':
+        return NotionDate(value).to_notion()
+    if prop_type == 'checkbox':
+        return [['Yes' if value else 'No']]
+    return [[str(value)]]
+
+
+def synthetic_row(number, seed=0):
+    '''
+        Builds the python property values of a synthetic bookmark row
+    '''
+    rng = random.Random(number + seed)
+    return {
+        'title': f'Bookmark {number}',
+        'tags': sorted(rng.sample([f'tag{x}' for x in range(10)], rng.randint(0, 3)), reverse=rng.random() < 0.5),
+        'url': f'https://example.com/articles/{number}',
+        'stars': rng.randint(0, 5),
+        'published': date(2020, 1, 1) + timedelta(days=number % 365),
+        'done': rng.random() < 0.5,
+    }
+
+
+def _synthetic_duplicates(number, duplicate_rate, seed):
+    # decided per row without state, so a duplicate's source row is known to be an original without building the collection
+    return (number > 0) & ((number * 2654435761 + seed) % 10007 < duplicate_rate * 10007)
+
+
+def synthetic_chunks(rows, size, duplicate_rate=0.1, seed=0):
+    '''
+        Yields DataFrames of `size` synthetic bookmark rows with block ids, without building the whole collection. About
+        `duplicate_rate` of rows are exact copies of a random earlier original row, marked in their `duplicate` column.
+    '''
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, size):
+        number = np.arange(start, min(rows, start + size))
+        duplicate = _synthetic_duplicates(number, duplicate_rate, seed)
+        source = np.where(duplicate, (rng.random(len(number)) * number).astype(int), number)
+        while True:
+            copies = duplicate & _synthetic_duplicates(source, duplicate_rate, seed)
+            if not copies.any():
+                break
+            source[copies] -= 1
+        yield pd.DataFrame({'title': [f'Bookmark {x}' for x in source],
+                            'url': [f'https://example.com/articles/{x}' for x in source],
+                            'id': [f'{x:08x}-0000-4000-8000-000000000000' for x in number],
+                            'duplicate': duplicate}, index=number)
+
+
+class FakeResponse:
+    """A requests.Response stand-in"""
+
+    def __init__(self, payload, status_code=200, headers=None):
+        self._payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(f"{self.status_code} error", response=self)
+
+
+class FakeNotionBackend:
+    """
+    Holds the records of a single workspace with one collection and answers Notion's v3 API endpoints from them
+    """
+
+    def __init__(self, rows=0, duplicate_rate=0.0, seed=0, schema=SCHEMA, name='Bookmarks', query_records=True,
+                 latency=0.0):
+        self.latency = latency  # seconds each request takes to answer, outside the lock like concurrent requests to Notion
+        self.query_records = query_records  # whether queryCollection returns row records, or only their ids like large queries
+        self.lock = threading.RLock()
+        self.requests = Counter()
+        self.failures = Counter()  # endpoint: number of upcoming requests to rate limit
+        self.transactions = []
+        self.clock = 1600000000000
+        self.user_id = str(uuid.uuid4())
+        self.space_id = str(uuid.uuid4())
+        self.page_id = str(uuid.uuid4())
+        self.collection_id = str(uuid.uuid4())
+        self.view_id = str(uuid.uuid4())
+        self.services_page_id = str(uuid.uuid4())  # a page holding the collection, like the Services page
+        self.records = {
+            'notion_user': {self.user_id: {'id': self.user_id, 'email': 'user@example.com'}},
+            'space': {self.space_id: {'id': self.space_id, 'name': 'Workspace'}},
+            'block': {self.page_id: {'id': self.page_id, 'type': 'collection_view_page', 'alive': True,
+                                     'collection_id': self.collection_id, 'view_ids': [self.view_id],
+                                     'parent_id': self.services_page_id, 'parent_table': 'block'},
+                      self.services_page_id: {'id': self.services_page_id, 'type': 'page', 'alive': True,
+                                              'content': [self.page_id], 'properties': {'title': [['Services']]},
+                                              'parent_id': self.space_id, 'parent_table': 'space'}},
+            'collection': {self.collection_id: {'id': self.collection_id, 'name': [[name]],
+                                                'schema': deepcopy(schema), 'parent_id': self.page_id,
+                                                'parent_table': 'block', 'alive': True}},
+            'collection_view': {self.view_id: {'id': self.view_id, 'type': 'table', 'alive': True,
+                                               'parent_id': self.page_id, 'parent_table': 'block',
+                                               'query2': {}, 'format': {}}},
+            'user_root': {},
+        }
+        rng = random.Random(seed)
+        slugs = {prop['name'].lower().replace(' ', '_') for prop in schema.values()}
+        for number in range(rows):
+            source = rng.randrange(number) if number and rng.random() < duplicate_rate else number
+            # schemas without some of the synthetic properties just leave them out
+            self.add_row(**{slug: value for slug, value in synthetic_row(source, seed).items() if slug in slugs})
+
+    @property
+    def url(self):
+        return f"https://www.notion.so/{self.page_id.replace('-', '')}?v={self.view_id.replace('-', '')}"
+
+    @property
+    def services_url(self):
+        return f"https://www.notion.so/{self.services_page_id.replace('-', '')}"
+
+    def tick(self):
+        self.clock += 1000
+        return self.clock
+
+    def add_row(self, **values):
+        '''
+            Adds a row to the collection from python property values keyed by property slug, returning its block id
+        '''
+        block_id = str(uuid.uuid4())
+        schema = self.records['collection'][self.collection_id]['schema']
+        slugs = {prop['name'].lower().replace(' ', '_'): (prop_id, prop['type']) for prop_id, prop in schema.items()}
+        properties = {}
+        for slug, value in values.items():
+            prop_id, prop_type = slugs[slug]
+            encoded = encode_property(prop_type, value)
+            if encoded is not None:
+                properties[prop_id] = encoded
+        now = self.tick()
+        self.records['block'][block_id] = {
+            'id': block_id, 'type': 'page', 'alive': True, 'version': 1, 'properties': properties,
+            'parent_id': self.collection_id, 'parent_table': 'collection',
+            'created_time': now, 'last_edited_time': now,
+        }
+        return block_id
+
+    def add_page(self, title):
+        '''
+            Adds a plain child page to the services page, returning its block id
+        '''
+        block_id = str(uuid.uuid4())
+        self.records['block'][block_id] = {'id': block_id, 'type': 'page', 'alive': True, 'version': 1,
+                                           'properties': {'title': [[title]]},
+                                           'parent_id': self.services_page_id, 'parent_table': 'block'}
+        self.records['block'][self.services_page_id]['content'].append(block_id)
+        return block_id
+
+    @property
+    def row_ids(self):
+        return [block_id for block_id, block in self.records['block'].items()
+                if block.get('parent_table') == 'collection' and block.get('alive')]
+
+    def _recordmap(self, **ids):
+        self.requests['records'] += sum(len([x for x in table_ids if x in self.records[table]])
+                                        for table, table_ids in ids.items())
+        return {table: {x: {'role': 'editor', 'value': deepcopy(self.records[table][x])}
+                        for x in table_ids if x in self.records[table]}
+                for table, table_ids in ids.items()}
+
+    def _apply(self, operation):
+        table, record_id, path, command, args = (operation[x] for x in ('table', 'id', 'path', 'command', 'args'))
+        record = self.records[table].setdefault(record_id, {})
+        path = list(path)
+        if not path and command == 'set':
+            record.clear()
+            record.update(deepcopy(args))
+            return
+        ref = record
+        while len(path) > 1 or (path and command != 'set'):
+            ref = ref.setdefault(path.pop(0), [] if 'list' in command else {})
+        if command == 'update':
+            ref.update(deepcopy(args))
+        elif command == 'set':
+            ref[path[0]] = deepcopy(args)
+        elif command == 'listAfter':
+            ref.append(args['id'])
+        elif command == 'listRemove' and args['id'] in ref:
+            ref.remove(args['id'])
+        if table == 'block':
+            record['last_edited_time'] = self.clock
+        record['version'] = record.get('version', 0) + 1
+
+    def _matches(self, block_id, query_filter):
+        '''
+            Evaluates the `date_is_on_or_after` filters on timestamp properties that the snapshot cache uses
+        '''
+        block = self.records['block'][block_id]
+        schema = self.records['collection'][self.collection_id]['schema']
+        for item in (query_filter or {}).get('filters', []):
+            prop_type = schema[item['property']]['type']
+            since = date.fromisoformat(item['filter']['value']['value']['start_date'])
+            if datetime.fromtimestamp(block[prop_type] / 1000, tz=timezone.utc).date() < since:
+                return False
+        return True
+
+    def handle(self, endpoint, data):
+        '''
+            Answers a POST to a Notion v3 API endpoint
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            return self._handle(endpoint, data)
+
+    def _handle(self, endpoint, data):
+        self.requests[endpoint] += 1
+        if endpoint == 'loadUserContent':
+            return {'recordMap': self._recordmap(notion_user=[self.user_id], space=[self.space_id])}
+        if endpoint == 'getPublicSpaceData':
+            return {'results': [self.records['space'][self.space_id]]}
+        if endpoint == 'loadPageChunk':
+            page = self.records['block'].get(data['pageId'], {})
+            blocks = [data['pageId']] + page.get('content', [])
+            return {'recordMap': self._recordmap(block=blocks,
+                                                 collection=[page.get('collection_id')],
+                                                 collection_view=page.get('view_ids', []))}
+        if endpoint == 'syncRecordValues':
+            ids = {}
+            for request in data['requests']:
+                ids.setdefault(request['pointer']['table'], []).append(request['pointer']['id'])
+            return {'recordMap': self._recordmap(**ids)}
+        if endpoint == 'queryCollection':
+            limit = data['loader']['reducers']['collection_group_results']['limit']
+            row_ids = [x for x in self.row_ids if self._matches(x, data['loader'].get('filter'))]
+            returned = row_ids[:limit] if limit >= 0 else row_ids
+            self.requests['queryCollection.rows'] += len(returned)
+            return {'result': {'type': 'table', 'total': len(row_ids),
+                               'reducerResults': {'collection_group_results': {'type': 'results',
+                                                                               'blockIds': returned}}},
+                    'recordMap': self._recordmap(block=returned if self.query_records else [])}
+        if endpoint == 'submitTransaction':
+            self.transactions.append(data['operations'])
+            self.tick()
+            for operation in data['operations']:
+                self._apply(operation)
+            return {}
+        raise NotImplementedError(endpoint)
+
+
+class FakeNotionClient(NotionClient):
+    """
+    A notion-py NotionClient whose requests are answered by a FakeNotionBackend instead of notion.so
+    """
+
+    def __init__(self, backend, **kwargs):
+        self.backend = backend
+        super().__init__(token_v2='fake', **kwargs)
+
+    def post(self, endpoint, data):
+        if self.backend.failures[endpoint]:
+            self.backend.failures[endpoint] -= 1
+            FakeResponse({}, status_code=429, headers={'Retry-After': '0'}).raise_for_status()
+        return FakeResponse(self.backend.handle(endpoint, data))
+
+
+class HTTPNotionClient(NotionClient):
+    """
+    A notion-py NotionClient that sends its requests over HTTP to a FakeHTTPServer instead of notion.so
+    """
+
+    def __init__(self, url, transport=None, **kwargs):
+        self.url = url
+        self.transport = transport or Transport(default_rate_limit=(10000.0, 10000))
+        super().__init__(token_v2='fake', **kwargs)
+
+    def post(self, endpoint, data):
+        if not isinstance(self.session.get_adapter(self.url), TransportAdapter):
+            self.transport.mount(self.session)
+        response = self.session.post(self.url + endpoint, json=data)
+        response.raise_for_status()
+        return response
+
+
+def bookmarks(numbers):
+    '''
+        Builds a service's dataframe of bookmarks, matching BOOKMARK_SCHEMA
+    '''
+    return pd.DataFrame([{'bookmark_id': x, 'title': f'Bookmark {x}', 'url': f'https://example.com/{x}', 'stars': x % 5}
+                         for x in numbers])
+
+
+@dataclass
+class BookmarkService(GenericService):
+    """A service with a single `saved_items` action returning bookmarks"""
+    _load_key: str = default_field('bookmark_id', init=False, repr=False)
+
+    def saved_items(self, folder='archive'):
+        return bookmarks(range(3)).assign(folder=folder)
+
+
+class FakeInstapaperSession:
+    """
+    Answers Instapaper's folders/list and bookmarks/list from in-memory folders, honouring `have` and `limit`, after an
+    optional latency. Stands in for the authorized session of InstapaperAPI.
+    """
+
+    def __init__(self, folders, latency=0.0):
+        self.folders = folders  # folder id: {bookmark_id: hash}
+        self.latency = latency
+        self.requests = Counter()
+        self.transferred = 0
+        self.lock = threading.Lock()
+        self.adapters = {}
+
+    def mount(self, prefix, adapter):
+        self.adapters[prefix] = adapter
+
+    @property
+    def bookmarks(self):
+        return self.folders['archive']
+
+    def post(self, url, data=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.requests[url.rsplit('/', 2)[-2]] += 1
+        if url.endswith('folders/list'):
+            return FakeResponse([{'type': 'folder', 'folder_id': int(x), 'title': f'Folder {x}'}
+                                 for x in self.folders if x.isdigit()])
+        bookmarks = self.folders[data['folder_id']]
+        have = dict(x.split(':') for x in data['have'].split(',')) if data.get('have') else {}
+        changed = [{'type': 'bookmark', 'bookmark_id': int(x), 'hash': y, 'title': f'Bookmark {x}'}
+                   for x, y in bookmarks.items() if have.get(x) != y][:data['limit']]
+        deleted = [x for x in have if x not in bookmarks]
+        with self.lock:
+            self.transferred += len(changed)
+        return FakeResponse([{'type': 'user', 'user_id': 1, 'username': 'user'},
+                             {'type': 'meta', 'delete_ids': ','.join(deleted)}] + changed)
+
+
+class FakeHTTPServer:
+    """
+    A local HTTP server answering every POST with JSON, after an optional latency. Scripted failures are answered first.
+
+    Used as a context manager, its `url` is the base URL to send requests to.
+    """
+
+    def __init__(self, latency=0.0, respond=None):
+        self.latency = latency
+        self.respond = respond or (lambda path, body: {'path': path})  # path, request json: response json
+        self.failures = deque()  # (status, headers) answered before any success, a None status drops the connection
+        self.requests = Counter()
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, headers, payload = server.answer(self.path, json.loads(body) if body else None)
+                if status is None:
+                    # drop the connection without answering, after the request was received
+                    self.close_connection = True
+                    return
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in dict(headers, **{'Content-Type': 'application/json',
+                                                    'Content-Length': str(len(data))}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}/'
+
+    def answer(self, path, body):
+        with self._lock:
+            self.requests[path] += 1
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            failure = self.failures.popleft() if self.failures else None
+        try:
+            time.sleep(self.latency)
+            if failure:
+                return failure[0], failure[1], {}
+            return 200, {}, self.respond(path, body)
+        finally:
+            with self._lock:
+                self.concurrent -= 1
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
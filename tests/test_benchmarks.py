@@ -0,0 +1,32 @@
+"""Tests for the benchmark suite in `benchmarks/suite.py`."""
+
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.suite import BENCHMARKS, parser, run, table
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    """Tests for running and comparing benchmarks on the fake backends."""
+
+    def test_every_benchmark_runs(self):
+        """Test every benchmark runs on a small synthetic collection."""
+        args = parser().parse_args(['--rows', '30', '--repeat', '1', '--schema', 'wide'])
+        results = run(args)
+        assert list(results['results']) == list(BENCHMARKS)
+        assert all(x['min'] > 0 and len(x['times']) == 1 for x in results['results'].values())
+        assert results['parameters']['rows'] == 30
+
+    def test_compare(self):
+        """Test saved results compare against a later run."""
+        args = parser().parse_args(['--rows', '20', '--repeat', '2', '--only', 'asdataframe', 'dedupe_hash'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'results.json'
+            path.write_text(json.dumps(run(args, args.only)))
+            baseline = json.loads(path.read_text())
+        lines = table(run(args, ['asdataframe']), baseline).splitlines()
+        assert lines[0].split() == ['benchmark', 'min', 'median', 'baseline', 'change']
+        assert lines[1].split()[0] == 'asdataframe' and lines[1].endswith('x')
@@ -0,0 +1,215 @@
+"""Tests for `thought.cache`."""
+
+
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from tests.fakes import SCHEMA, FakeNotionBackend, FakeNotionClient, synthetic_row
+from thought.cache import DuplicateIndex, SnapshotCache
+from thought.core import CollectionExtension
+from thought.dedupe import key_digests
+
+DAY = 24 * 60 * 60 * 1000
+
+
+class TestSnapshotCache(unittest.TestCase):
+    """Tests for reading collections through the snapshot cache."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'snapshots.sqlite'
+        schema = dict(SCHEMA, edit={'name': 'Edited', 'type': 'last_edited_time'})
+        self.backend = FakeNotionBackend(rows=30, schema=schema)
+        self.client = FakeNotionClient(self.backend)
+        self.collection = self.client.get_collection_view(self.backend.url).collection
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.directory.cleanup()
+
+    def read(self, **kwargs):
+        cache = SnapshotCache(path=self.path, **kwargs)
+        return CollectionExtension(self.collection, cache=cache).asdataframe(), cache
+
+    def test_incremental_refresh(self):
+        """Test later reads only fetch rows edited since the snapshot's last day."""
+        first, cache = self.read()
+        assert cache.stats.misses == 30 and cache.stats.hits == 0
+
+        # edit a row a couple of days later
+        self.backend.clock += 2 * DAY
+        self.client.get_block(self.backend.row_ids[3]).set_property('title', 'Edited title')
+        second, cache = self.read()
+        assert cache.stats.misses == 1 and cache.stats.hits == 29
+        assert second['id'].to_list() == first['id'].to_list()
+        assert second.loc[3, 'title'] == 'Edited title'
+
+        # rows edited before the last snapshot's day are no longer transferred
+        self.backend.clock += 2 * DAY
+        self.client.get_block(self.backend.row_ids[5]).set_property('title', 'Edited again')
+        self.backend.requests.clear()
+        third, cache = self.read()
+        assert cache.stats.misses == 1
+        assert self.backend.requests['queryCollection.rows'] == 2
+        assert third.loc[5, 'title'] == 'Edited again'
+
+    def test_edit_at_watermark(self):
+        """Test a row edited within the same timestamp as the snapshot's newest row is fetched, unchanged ones aren't."""
+        self.read()
+        watermark = self.backend.clock
+        # edit times are rounded to the minute, so step back for the edit to land on the newest row's timestamp
+        self.backend.clock -= 1000
+        self.client.get_block(self.backend.row_ids[3]).set_property('title', 'Edited title')
+        assert self.backend.records['block'][self.backend.row_ids[3]]['last_edited_time'] == watermark
+        dataframe, cache = self.read()
+        assert cache.stats.misses == 1
+        assert dataframe.loc[3, 'title'] == 'Edited title'
+
+        dataframe, cache = self.read()
+        assert cache.stats.misses == 0 and cache.stats.hits == 30
+
+    def test_added_and_removed_rows(self):
+        """Test new rows are appended and removed rows force a full refresh."""
+        self.read()
+        self.backend.clock += 2 * DAY
+        self.backend.add_row(title='New row')
+        dataframe, cache = self.read()
+        assert cache.stats.misses == 1
+        assert dataframe['title'].to_list()[-1] == 'New row'
+
+        self.client.get_block(self.backend.row_ids[0]).remove()
+        dataframe, cache = self.read()
+        assert cache.stats.misses == 30
+        assert dataframe['id'].to_list() == self.backend.row_ids
+
+    def test_full_refresh_in_chunks(self):
+        """Test a full refresh writes the snapshot a chunk at a time, keeping collection order."""
+        cache = SnapshotCache(path=self.path)
+        with mock.patch.object(cache, '_store', wraps=cache._store) as store:
+            records = cache._full_refresh(self.collection, batch_size=7)
+        assert [len(x[0][1]) for x in store.call_args_list] == [7, 7, 7, 7, 2]
+        assert [x['id'] for x in records] == cache.block_ids(self.collection.id) == self.backend.row_ids
+        assert cache.stats.misses == 30
+
+    def test_refresh(self):
+        """Test a forced refresh fetches every row."""
+        self.read()
+        dataframe, cache = self.read(refresh=True)
+        assert cache.stats.misses == 30 and len(dataframe) == 30
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    """Tests for incremental dedupe through the persistent duplicate key index."""
+
+    fields = ['title', 'url', 'tags']
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = tempfile.TemporaryDirectory()
+        schema = dict(SCHEMA, edit={'name': 'Edited', 'type': 'last_edited_time'})
+        self.backend = FakeNotionBackend(rows=60, duplicate_rate=0.3, seed=5, schema=schema)
+        self.client = FakeNotionClient(self.backend)
+        self.cache = SnapshotCache(path=Path(self.directory.name) / 'snapshots.sqlite')
+        self.extension = CollectionExtension(self.client.get_collection_view(self.backend.url).collection, cache=self.cache)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.directory.cleanup()
+
+    def expected(self, keep_first=True):
+        dataframe = self.extension.asdataframe()
+        kept = self.extension.dedupe(dataframe, comparison_fields=self.fields, keep_first=keep_first)
+        return set(dataframe['id']) - set(kept['id'])
+
+    def test_matches_hash_engine(self):
+        """Test the index finds the rows a full hash dedupe drops, keeping the first or the last of each group."""
+        for keep_first in (True, False):
+            duplicates, stats = self.extension.indexed_duplicates(self.fields, keep_first=keep_first)
+            assert duplicates and set(duplicates) == self.expected(keep_first)
+        digests = key_digests(self.extension.asdataframe(), self.fields)
+        assert (stats.size, stats.hashed) == (60, 0)
+        assert stats.keys == len(digests.drop_duplicates())
+        assert stats.duplicate_keys == len(digests[digests.duplicated()].drop_duplicates())
+
+    def test_full_digest_compared(self):
+        """Test rows whose digests only share one 64-bit half aren't duplicates."""
+        def colliding(dataframe, fields):
+            digests = key_digests(dataframe, fields)
+            return digests.assign(high=digests['high'] * 0)
+
+        with mock.patch('thought.core.key_digests', side_effect=colliding):
+            duplicates, stats = self.extension.indexed_duplicates(self.fields)
+        assert set(duplicates) == self.expected()
+        assert stats.keys == len(key_digests(self.extension.asdataframe(), self.fields).drop_duplicates())
+
+    def test_64_bit_index_dropped(self):
+        """Test an index of 64-bit digests from an earlier version is dropped and rebuilt."""
+        with sqlite3.connect(str(self.cache.path)) as connection:
+            connection.execute('DROP TABLE dedupe_keys')
+            connection.execute('CREATE TABLE dedupe_keys (collection_id TEXT NOT NULL, fields TEXT NOT NULL, '
+                               'block_id TEXT NOT NULL, last_edited_time INTEGER NOT NULL, digest INTEGER, '
+                               'PRIMARY KEY (collection_id, fields, block_id))')
+        connection.close()
+        duplicates, stats = self.extension.indexed_duplicates(self.fields)
+        assert stats.hashed == 60 and set(duplicates) == self.expected()
+
+    def test_only_hashes_changed_rows(self):
+        """Test later runs only hash new and edited rows, and pick up the duplicates they make."""
+        first, stats = self.extension.indexed_duplicates(self.fields)
+        assert stats.hashed == 60
+
+        self.backend.clock += 2 * DAY
+        kept = self.extension.asdataframe().iloc[0]
+        for number in range(3):
+            self.backend.add_row(**synthetic_row(1000 + number, seed=5))
+        duplicate = self.backend.add_row(title=kept['title'], url=kept['url'], tags=kept['tags'])
+        self.client.get_block(self.backend.row_ids[1]).set_property('title', 'Edited title')
+        duplicates, stats = self.extension.indexed_duplicates(self.fields)
+        assert stats.hashed == 5 and stats.size == 64
+        assert duplicate in duplicates and set(duplicates) == self.expected()
+
+    def test_edit_at_indexed_time(self):
+        """Test a row edited again within the `last_edited_time` it was indexed at is hashed again."""
+        self.extension.indexed_duplicates(self.fields)
+        self.backend.clock += 2 * DAY
+        kept = self.extension.asdataframe().iloc[0]
+        row = self.client.get_block(self.backend.row_ids[1])
+        row.set_property('url', kept['url'])
+        row.set_property('tags', kept['tags'])
+        duplicates, stats = self.extension.indexed_duplicates(self.fields)
+        assert stats.hashed == 1 and row.id not in duplicates
+        edited = self.backend.records['block'][row.id]['last_edited_time']
+
+        # edit times are rounded to the minute, so step back for the edit to land on the indexed timestamp
+        self.backend.clock -= 1000
+        row.set_property('title', kept['title'])
+        assert self.backend.records['block'][row.id]['last_edited_time'] == edited
+        duplicates, stats = self.extension.indexed_duplicates(self.fields)
+        assert stats.hashed == 1
+        assert row.id in duplicates and set(duplicates) == self.expected()
+
+    def test_removed_rows_and_rebuild(self):
+        """Test rows archived since the last run leave the index, and a rebuild hashes every row again."""
+        duplicates, _ = self.extension.indexed_duplicates(self.fields)
+        self.backend.clock += 2 * DAY
+        for block_id in duplicates:
+            self.client.get_block(block_id).remove()
+        remaining, stats = self.extension.indexed_duplicates(self.fields)
+        assert remaining == [] and stats.removed == len(duplicates) and stats.duplicate_keys == 0
+
+        _, stats = self.extension.indexed_duplicates(self.fields, rebuild=True)
+        assert stats.hashed == stats.size == 60 - len(duplicates)
+
+    def test_indexes_are_per_fields(self):
+        """Test each set of comparison fields has its own entries."""
+        self.extension.indexed_duplicates(self.fields)
+        index = DuplicateIndex(path=self.cache.path)
+        collection_id = self.extension.collection.id
+        assert index.stats(collection_id, ['url']).size == 0
+        _, stats = self.extension.indexed_duplicates(['url'])
+        assert stats.hashed == 60
+        assert index.stats(collection_id, self.fields).size == 60
@@ -0,0 +1,77 @@
+"""Tests for `thought.cli`."""
+
+
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from click.testing import CliRunner
+from tests.fakes import BookmarkService
+from thought.cli import Config, cli
+
+# `thought --help` must stay cheap, wrappers invoke it hundreds of times a day
+IMPORT_BUDGET_SECONDS = 0.25
+HEAVY_MODULES = ['pandas', 'numpy', 'recordlinkage', 'notion', 'requests', 'dotenv', 'thought.core']
+
+
+def import_times(code):
+    '''
+        Runs python code under `-X importtime` and returns the cumulative import seconds of every module imported
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=directory, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times, result.stdout
+
+
+class TestStartup(unittest.TestCase):
+    """Tests for lazy CLI imports."""
+
+    def test_help_import_budget(self):
+        """Test `thought --help` imports nothing heavy and stays within its import budget."""
+        times, output = import_times("import sys; sys.argv = ['thought', '--help']\n"
+                                     "from thought.cli import cli\n"
+                                     "try:\n    cli()\nexcept SystemExit:\n    pass")
+        assert 'Thought - A Notion CLI' in output
+        for module in HEAVY_MODULES:
+            assert module not in times, module
+        assert times['thought.cli'] < IMPORT_BUDGET_SECONDS, times['thought.cli']
+
+
+class TestSync(unittest.TestCase):
+    """Tests for `thought sync` argument handling."""
+
+    def invoke(self, *args):
+        with mock.patch.object(Config, 'client', new_callable=mock.PropertyMock), \
+                mock.patch('thought.service.Registry.register', return_value=BookmarkService):
+            return CliRunner().invoke(cli, ['sync', *args])
+
+    def test_service_flags_rejected_with_all_and_manifest(self):
+        """Test service specific flags are refused for multi job syncs instead of being ignored."""
+        for args in (['--all', '--full'], ['--all', '--folder', 'starred'], ['--all', '--all-folders']):
+            result = self.invoke(*args)
+            assert result.exit_code == 2, result.output
+            assert 'not to --all or --manifest' in result.output
+
+    def test_unsupported_flags_rejected(self):
+        """Test flags the action's signature does not take are refused."""
+        result = self.invoke('bookmarks', 'saved_items', '--full')
+        assert result.exit_code == 2, result.output
+        assert 'does not support --full' in result.output
+
+    def test_only_accepted_arguments_passed(self):
+        """Test a single job only gets the arguments its action accepts."""
+        with mock.patch('thought.runner.SyncRunner.run', return_value=[]) as run:
+            result = self.invoke('bookmarks', 'saved_items', '--folder', 'starred')
+        assert result.exit_code == 0, result.output
+        [job] = run.call_args[0][0]
+        assert job.arguments == {'folder': ['starred']}
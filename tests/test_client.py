@@ -0,0 +1,51 @@
+"""Tests for `thought.client`."""
+
+
+import time
+import unittest
+
+import pandas as pd
+from tests.fakes import FakeHTTPServer, FakeNotionBackend, HTTPNotionClient
+from thought.client import AsyncNotionAPI
+from thought.core import CollectionExtension
+
+
+class TestAsyncNotionAPI(unittest.TestCase):
+    """Tests for concurrent record fetches against a fake Notion HTTP server."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.backend = FakeNotionBackend(rows=80, query_records=False)
+        self.server = FakeHTTPServer(latency=0.05,
+                                     respond=lambda path, body: self.backend.handle(path.lstrip('/'), body)).__enter__()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.server.__exit__()
+
+    def read(self, concurrency):
+        client = HTTPNotionClient(self.server.url)
+        collection = client.get_collection_view(self.backend.url).collection
+        start = time.perf_counter()
+        dataframe = CollectionExtension(collection, concurrency=concurrency).asdataframe(batch_size=10)
+        dataframe['published'] = dataframe['published'].map(lambda x: x.to_notion())
+        return dataframe, time.perf_counter() - start
+
+    def test_get_records(self):
+        """Test records are fetched a chunk per request and stored in the client's record store."""
+        client = HTTPNotionClient(self.server.url)
+        ids = self.backend.row_ids[:25]
+        records = AsyncNotionAPI(client, concurrency=3, chunk_size=10).fetch('block', ids)
+        assert sorted(records) == sorted(ids)
+        assert self.server.requests['/syncRecordValues'] == 3
+        assert client.get_block(ids[0]).get('id') == ids[0]
+        assert self.server.requests['/syncRecordValues'] == 3
+
+    def test_bounded_concurrency(self):
+        """Test concurrent reads return the same rows as sequential ones, with at most `concurrency` requests in flight."""
+        sequential, sequential_seconds = self.read(concurrency=1)
+        self.server.max_concurrent = 0
+        concurrent, concurrent_seconds = self.read(concurrency=4)
+        pd.testing.assert_frame_equal(concurrent, sequential)
+        assert 1 < self.server.max_concurrent <= 4
+        assert concurrent_seconds < sequential_seconds / 2
@@ -0,0 +1,44 @@
+"""Tests for `thought.core` collection loading."""
+
+
+import unittest
+
+from tests.fakes import FakeNotionBackend, FakeNotionClient
+from thought.core import CollectionExtension
+
+
+class TestCollectionLoading(unittest.TestCase):
+    """Tests for CollectionExtension.iter_rows and asdataframe."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.backend = FakeNotionBackend(rows=25)
+        self.client = FakeNotionClient(self.backend)
+        view = self.client.get_collection_view(self.backend.url)
+        self.extension = CollectionExtension(view.collection)
+
+    def test_iter_rows_chunks(self):
+        """Test rows are yielded in typed chunks of at most batch_size rows."""
+        chunks = list(self.extension.iter_rows(batch_size=10))
+        assert [len(x) for x in chunks] == [10, 10, 5]
+        for chunk in chunks:
+            assert chunk.columns.to_list() == ['title', 'tags', 'url', 'stars', 'published', 'done', 'id']
+            assert chunk['stars'].dtype == 'float64'
+            assert chunk['done'].dtype == 'bool'
+
+    def test_asdataframe(self):
+        """Test asdataframe concatenates every row, beyond notion-py's default query limit."""
+        backend = FakeNotionBackend(rows=150)
+        view = FakeNotionClient(backend).get_collection_view(backend.url)
+        dataframe = CollectionExtension(view.collection).asdataframe(batch_size=40)
+        assert len(dataframe) == 150
+        assert dataframe['id'].to_list() == backend.row_ids
+        assert dataframe.index.to_list() == list(range(150))
+
+    def test_asdataframe_empty(self):
+        """Test an empty collection still has its columns."""
+        backend = FakeNotionBackend(rows=0)
+        view = FakeNotionClient(backend).get_collection_view(backend.url)
+        dataframe = CollectionExtension(view.collection).asdataframe()
+        assert dataframe.empty
+        assert 'title' in dataframe.columns
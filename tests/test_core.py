@@ -6,8 +6,8 @@
 import unittest
 from click.testing import CliRunner
 
-from thought import thought
 from thought import cli
+from thought.core import Metadata, SyncPlan
 
 
 class TestThought(unittest.TestCase):
@@ -19,15 +19,24 @@ class TestThought(unittest.TestCase):
     def tearDown(self):
         """Tear down test fixtures, if any."""
 
-    def test_000_something(self):
-        """Test something."""
+    def test_sync_plan(self):
+        """Test an empty plan is falsy and a plan summarises its changes."""
+        assert not SyncPlan()
+        plan = SyncPlan(creates=[{'title': 'New'}], archives=['block'])
+        assert plan and str(plan).splitlines()[0] == "1 rows to create, 0 rows to update, 1 rows to archive"
+
+    def test_metadata(self):
+        """Test each Metadata has its own timings."""
+        first, second = Metadata(), Metadata()
+        first.timings['step'] = 1.0
+        assert second.timings == {}
 
     def test_command_line_interface(self):
         """Test the CLI."""
         runner = CliRunner()
-        result = runner.invoke(cli.main)
-        assert result.exit_code == 0
-        assert 'thought.cli.main' in result.output
-        help_result = runner.invoke(cli.main, ['--help'])
+        help_result = runner.invoke(cli.cli, ['--help'])
         assert help_result.exit_code == 0
-        assert '--help  Show this message and exit.' in help_result.output
+        assert 'Thought - A Notion CLI' in help_result.output
+        assert '--help' in help_result.output and 'Show this message and exit.' in help_result.output
+        for command in ('dedupe', 'sort', 'sync', 'export', 'import', 'watch'):
+            assert command in help_result.output
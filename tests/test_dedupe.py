@@ -0,0 +1,217 @@
+"""Tests for `thought.dedupe` and CollectionExtension.dedupe."""
+
+
+import json
+import subprocess
+import sys
+import unittest
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+from notion.collection import NotionDate
+from tests.fakes import FakeNotionBackend, FakeNotionClient, synthetic_chunks
+from thought.core import CollectionExtension
+from thought.dedupe import (
+    INDEX_STRATEGIES,
+    Comparator,
+    build_index,
+    exact_duplicates,
+    normalize_url,
+    partitioned_duplicates,
+)
+
+# dedupes a million synthetic rows out of core in a fresh interpreter, reporting how much its peak RSS grew
+MILLION_ROWS = '''
+import json, resource, sys
+import numpy as np
+from tests.fakes import synthetic_chunks
+from thought.dedupe import partitioned_duplicates
+
+max_memory = int(sys.argv[1])
+chunks = list(synthetic_chunks(1000, 1000, seed=1))  # warm up
+partitioned_duplicates(chunks, ['title', 'url'], max_memory=max_memory)
+del chunks
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+expected = []
+
+def chunks():
+    for chunk in synthetic_chunks(1000000, 20000, seed=1):
+        expected.append(chunk.index[chunk['duplicate']].to_numpy())
+        yield chunk
+
+duplicates = partitioned_duplicates(chunks(), ['title', 'url'], max_memory=max_memory)
+growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024
+matches = np.array_equal(np.concatenate(expected), [int(x[:8], 16) for x in duplicates])
+print(json.dumps({'growth': growth, 'duplicates': len(duplicates), 'matches': matches}))
+'''
+
+
+class TestDedupeIndexing(unittest.TestCase):
+    """Tests for the dedupe index strategies."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.dataframe = pd.DataFrame({
+            'title': ['a', 'b', 'a', 'a', None, None],
+            'tags': [['x'], [], ['x'], ['y'], ['x'], ['x']],
+            'id': ['0', '1', '2', '3', '4', '5'],
+        })
+        self.extension = CollectionExtension(collection=None)
+
+    def test_hash_index_only_pairs_exact_matches(self):
+        """Test the hash strategy only produces pairs of identical records."""
+        pairs = build_index(self.dataframe, strategy='hash', comparison_fields=['title', 'tags'])
+        assert list(pairs) == [(2, 0)]
+
+    def test_strategies_agree(self):
+        """Test every strategy finds the same duplicates as the full index."""
+        for strategy in INDEX_STRATEGIES:
+            for keep_first in (True, False):
+                result = self.extension.dedupe(self.dataframe,
+                                               index_strategy=strategy,
+                                               keep_first=keep_first,
+                                               engine='recordlinkage')
+                expected = self.extension.dedupe(self.dataframe,
+                                                 index_strategy='full',
+                                                 keep_first=keep_first,
+                                                 engine='recordlinkage')
+                assert result['id'].to_list() == expected['id'].to_list(), strategy
+
+    def test_invalid_strategy(self):
+        """Test an unknown strategy is rejected."""
+        with self.assertRaises(ValueError):
+            build_index(self.dataframe, strategy='nope')
+
+
+class TestDedupeEngines(unittest.TestCase):
+    """Tests for the hashed exact-duplicate engine."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.dataframe = pd.DataFrame({
+            'title': ['a', 'a', 'a', 'b', 'a', None, None, 'a'],
+            'tags': [['x', 'y'], ['x', 'y'], ['y', 'x'], [], ['x', 'y'], [], [], ['x', 'y']],
+            'published': [NotionDate(date(2020, 1, 1)), NotionDate(date(2020, 1, 1)),
+                          NotionDate(date(2020, 1, 1)), None, NotionDate(date(2020, 1, 2)),
+                          None, None, NotionDate(date(2020, 1, 1))],
+            'stars': [1, 1, 1, 2, 1, 3, 3, 1.0],
+            'id': [str(x) for x in range(8)],
+        })
+        self.extension = CollectionExtension(collection=None)
+
+    def test_engines_identical(self):
+        """Test the hash and recordlinkage engines remove the same records."""
+        for fields in (None, ['title'], ['tags', 'stars'], ['published']):
+            for keep_first in (True, False):
+                hashed = self.extension.dedupe(self.dataframe,
+                                               comparison_fields=fields,
+                                               keep_first=keep_first,
+                                               engine='hash')
+                linked = self.extension.dedupe(self.dataframe,
+                                               comparison_fields=fields,
+                                               keep_first=keep_first,
+                                               index_strategy='full',
+                                               engine='recordlinkage')
+                pd.testing.assert_frame_equal(hashed, linked)
+
+    def test_exact_duplicates(self):
+        """Test unhashable cells are canonicalised and missing values never match."""
+        assert exact_duplicates(self.dataframe, ['title', 'tags', 'published']).to_list() == [1, 7]
+        assert exact_duplicates(self.dataframe, ['title', 'tags', 'published'], keep_first=False).to_list() == [0, 1]
+
+
+class TestDedupeComparators(unittest.TestCase):
+    """Tests for fuzzy comparators and the weighted score classifier."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.dataframe = pd.DataFrame({
+            'title': ['Hello World', 'hello  world ', 'Goodbye', 'Helo World'],
+            'url': ['https://x.com/a/', 'https://www.X.com/a?utm_source=feed', 'https://y.com', 'https://x.com/b'],
+            'stars': [1, 1.2, 5, 1],
+            'published': [date(2020, 1, 1), date(2020, 1, 2), date(2021, 1, 1), date(2020, 1, 1)],
+            'id': ['0', '1', '2', '3'],
+        })
+        self.extension = CollectionExtension(collection=None)
+        self.comparators = [Comparator.from_spec(x) for x in
+                            ('title:string:0.9', 'url:url', 'stars:numeric:0.5', 'published:date:2')]
+
+    def test_from_spec(self):
+        """Test comparator specs are parsed."""
+        assert Comparator.from_spec('url:url::2') == Comparator('url', 'url', None, 2.0)
+        assert Comparator.from_spec('title') == Comparator('title')
+        with self.assertRaises(ValueError):
+            Comparator.from_spec('title:soundex')
+
+    def test_normalize_url(self):
+        """Test tracking parameters, host case and trailing slashes are ignored."""
+        assert normalize_url('HTTPS://www.Example.com/a/?utm_source=x&b=2&a=1#top') == 'https://example.com/a?a=1&b=2'
+
+    def test_near_duplicates(self):
+        """Test near duplicate records match and others do not."""
+        result = self.extension.dedupe(self.dataframe, comparators=self.comparators, index_strategy='full')
+        assert result['id'].to_list() == ['0', '2', '3']
+
+    def test_weighted_threshold(self):
+        """Test a partial match passes a lower threshold."""
+        comparators = [Comparator('title', 'string', 0.9, weight=3), Comparator('url', 'url')]
+        strict = self.extension.dedupe(self.dataframe, comparators=comparators, index_strategy='full')
+        loose = self.extension.dedupe(self.dataframe, comparators=comparators, index_strategy='full', match_threshold=0.75)
+        assert strict['id'].to_list() == ['0', '2', '3']
+        assert loose['id'].to_list() == ['0', '2']
+
+    def test_hash_engine_rejects_fuzzy(self):
+        """Test the hash engine refuses fuzzy comparators and thresholds instead of matching exactly."""
+        with self.assertRaises(ValueError):
+            self.extension.dedupe(self.dataframe, comparators=self.comparators, engine='hash')
+        with self.assertRaises(ValueError):
+            self.extension.dedupe(self.dataframe, comparison_fields=['url'], engine='hash', match_threshold=0.5)
+        exact = self.extension.dedupe(self.dataframe, comparators=[Comparator('url')], engine='hash')
+        assert len(exact) == len(self.dataframe.drop_duplicates('url'))
+
+    def test_parallel_comparison(self):
+        """Test chunked, multi-process comparison matches in process comparison."""
+        serial = self.extension.dedupe(self.dataframe, comparators=self.comparators, index_strategy='full', workers=1)
+        parallel = self.extension.dedupe(self.dataframe, comparators=self.comparators, index_strategy='full',
+                                         workers=2, chunk_size=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+
+
+class TestPartitionedDedupe(unittest.TestCase):
+    """Tests for the out-of-core, hash partitioned dedupe."""
+
+    fields = ['title', 'url']
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.dataframe = pd.concat(synthetic_chunks(3000, 3000, duplicate_rate=0.3, seed=4))
+        self.dataframe.loc[self.dataframe.index[::50], 'url'] = None
+
+    def test_matches_hash_engine(self):
+        """Test every partitioning finds the duplicates the hash engine does, keeping the first or the last."""
+        for keep_first in (True, False):
+            expected = self.dataframe.loc[exact_duplicates(self.dataframe, self.fields, keep_first=keep_first), 'id']
+            # a tiny budget splits partitions over several levels
+            for max_memory in (1024 ** 3, 2000):
+                chunks = (self.dataframe.iloc[x:x + 250] for x in range(0, len(self.dataframe), 250))
+                duplicates = partitioned_duplicates(chunks, self.fields, keep_first=keep_first, max_memory=max_memory)
+                assert duplicates == expected.to_list(), (keep_first, max_memory)
+
+    def test_collection(self):
+        """Test a collection's out-of-core duplicates are the rows its in-memory dedupe drops."""
+        backend = FakeNotionBackend(rows=60, duplicate_rate=0.3, seed=6)
+        extension = CollectionExtension(FakeNotionClient(backend).get_collection_view(backend.url).collection)
+        dataframe = extension.asdataframe()
+        kept = extension.dedupe(dataframe, comparison_fields=['title', 'url', 'tags'], engine='hash')
+        duplicates = extension.partitioned_duplicates(['title', 'url', 'tags'], max_memory=4096, batch_size=16)
+        assert duplicates and duplicates == [x for x in dataframe['id'] if x not in set(kept['id'])]
+
+    def test_million_rows_within_max_memory(self):
+        """Test deduping a million rows grows peak RSS by at most max_memory, plus the chunk being read and the ids returned."""
+        max_memory = 32 * 1024 ** 2
+        result = subprocess.run([sys.executable, '-c', MILLION_ROWS, str(max_memory)], cwd=Path(__file__).parents[1],
+                                capture_output=True, text=True, check=True)
+        result = json.loads(result.stdout.splitlines()[-1])
+        assert result['matches'] and result['duplicates'] > 90000
+        assert result['growth'] < max_memory + 32 * 1024 ** 2, result['growth']
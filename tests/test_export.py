@@ -0,0 +1,80 @@
+"""Tests for `thought.export`."""
+
+
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+from tests.fakes import FakeNotionBackend, FakeNotionClient
+from thought.core import CollectionExtension
+from thought.export import export_collection, import_collection, iter_file, read_arrow
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+def extension(backend):
+    return CollectionExtension(FakeNotionClient(backend).get_collection_view(backend.url).collection)
+
+
+def contents(dataframe):
+    dataframe = dataframe.drop(columns='id').copy()
+    dataframe['published'] = dataframe['published'].map(lambda x: x.start if x else None)
+    return dataframe.sort_values('url').reset_index(drop=True)
+
+
+class TestExportImport(unittest.TestCase):
+    """Tests for chunked export and import round trips."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = extension(FakeNotionBackend(rows=25, seed=1))
+        self.target_backend = FakeNotionBackend(rows=0)
+        self.target = extension(self.target_backend)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.directory.cleanup()
+
+    def round_trip(self, format):
+        path = Path(self.directory.name) / f'bookmarks.{format}'
+        assert export_collection(self.source, path, chunk_size=10) == 25
+        assert [len(x) for x in iter_file(path, chunk_size=10)] == [10, 10, 5]
+
+        report = import_collection(self.target, path, chunk_size=10)
+        assert (report.rows, report.chunks, len(report.plan.creates)) == (25, 3, 25)
+        pd.testing.assert_frame_equal(contents(self.target.asdataframe()), contents(self.source.asdataframe()))
+        return path
+
+    def test_csv_round_trip(self):
+        """Test a collection exported to CSV imports into an empty collection unchanged."""
+        self.round_trip('csv')
+
+    @unittest.skipUnless(HAS_PYARROW, "needs pyarrow")
+    def test_parquet_round_trip(self):
+        """Test a collection exported to Parquet imports into an empty collection unchanged."""
+        self.round_trip('parquet')
+
+    @unittest.skipUnless(HAS_PYARROW, "needs pyarrow")
+    def test_arrow_memory_map(self):
+        """Test exported Arrow files are typed and readable through a memory map."""
+        table = read_arrow(self.round_trip('arrow'))
+        assert table.num_rows == 25
+        assert str(table.schema.field('published').type) == 'timestamp[ns, tz=UTC]'
+        assert str(table.schema.field('tags').type) == 'list<item: string>'
+
+    def test_upsert_and_replace(self):
+        """Test re-importing a file changes nothing, and replace archives rows missing from the file."""
+        path = Path(self.directory.name) / 'bookmarks.csv'
+        export_collection(self.source, path)
+        import_collection(self.target, path)
+
+        report = import_collection(self.target, path, style='upsert', key='url', chunk_size=7)
+        assert not report.plan.creates and not report.plan.updates
+
+        extra = self.target_backend.add_row(title='Not in the file', url='https://example.com/extra')
+        report = import_collection(self.target, path, style='replace', key='url', chunk_size=7)
+        assert report.plan.archives == [extra]
+        assert extra not in self.target_backend.row_ids
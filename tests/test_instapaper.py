@@ -0,0 +1,139 @@
+"""Tests for `thought.services.instapaper`."""
+
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from tests.fakes import FakeInstapaperSession, FakeResponse
+from thought.service import CredentialStore
+from thought.services.instapaper import BookmarkState, InstapaperAPI
+
+
+class TestIncrementalBookmarks(unittest.TestCase):
+    """Tests for incremental bookmark listing."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.session = FakeInstapaperSession({'unread': {'100': 'h100'},
+                                              'starred': {'100': 'h100'},
+                                              'archive': {str(x): f'h{x}' for x in range(12)},
+                                              '7': {'200': 'h200', '201': 'h201'}})
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.directory.cleanup()
+
+    def service(self):
+        with mock.patch.object(InstapaperAPI, 'authorize'):
+            service = InstapaperAPI()
+        service.client = self.session
+        service._state = BookmarkState(Path(self.directory.name) / 'state.json')
+        return service
+
+    def test_pages_through_folder(self):
+        """Test a folder larger than `limit` is fetched page by page."""
+        bookmarks = self.service().bookmarks('archive', limit=5)
+        assert sorted(bookmarks['bookmark_id']) == list(range(12))
+        assert self.session.requests['bookmarks'] == 3
+
+    def test_unchanged_account_transfers_nothing(self):
+        """Test a re-run after a checkpoint only returns new and changed bookmarks."""
+        service = self.service()
+        service.bookmarks('archive')
+        service._checkpoint()
+
+        self.session.bookmarks['3'] = 'changed'
+        self.session.bookmarks['12'] = 'h12'
+        del self.session.bookmarks['0']
+        self.session.transferred = 0
+        service = self.service()
+        bookmarks = service.bookmarks('archive')
+        assert sorted(bookmarks['bookmark_id']) == [3, 12]
+        service._checkpoint()
+
+        self.session.transferred = 0
+        service = self.service()
+        assert service.bookmarks('archive').empty
+        assert self.session.transferred == 0
+        assert '0' not in service._state['archive']
+
+    def test_state_only_saved_on_checkpoint(self):
+        """Test bookmarks fetched but never loaded are fetched again."""
+        self.service().bookmarks('archive')
+        assert len(self.service().bookmarks('archive')) == 12
+        assert len(self.service().bookmarks('archive', incremental=False)) == 12
+
+    def test_concurrent_states_merge(self):
+        """Test states saved by concurrent jobs keep each other's folders, and a failed save keeps the file intact."""
+        path = Path(self.directory.name) / 'state.json'
+        first, second = BookmarkState(path), BookmarkState(path)
+        first['archive'] = {'1': 'h1'}
+        second['unread'] = {'2': 'h2'}
+        first.save()
+        second.save()
+        assert BookmarkState(path).folders == {'archive': {'1': 'h1'}, 'unread': {'2': 'h2'}}
+
+        first['archive'] = {}
+        with mock.patch('os.replace', side_effect=OSError), self.assertRaises(OSError):
+            first.save()
+        assert BookmarkState(path).folders == {'archive': {'1': 'h1'}, 'unread': {'2': 'h2'}}
+        assert [x.name for x in path.parent.iterdir()] == ['state.json']
+
+    def test_all_folders(self):
+        """Test every folder is fetched and merged with the folder each bookmark came from."""
+        service = self.service()
+        folders = service._folders()
+        assert folders == ['unread', 'starred', 'archive', '7']
+
+        bookmarks = service.bookmarks(folders, limit=5)
+        assert len(bookmarks) == 15
+        assert bookmarks.groupby('folder').size().to_dict() == {'7': 2, 'archive': 12, 'unread': 1}
+        assert set(service.metadata.timings) == {f'bookmarks/{x}' for x in folders}
+
+
+class TestCredentials(unittest.TestCase):
+    """Tests for cached OAuth credentials."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = CredentialStore(Path(self.directory.name) / 'credentials.json')
+        self.fetch = mock.patch.object(InstapaperAPI, '_fetch_token',
+                                       return_value={'oauth_token': 'token', 'oauth_token_secret': 'secret'})
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.directory.cleanup()
+
+    def service(self):
+        with mock.patch.object(InstapaperAPI, 'authorize'):
+            service = InstapaperAPI()
+        service._credentials = self.store
+        service._state = BookmarkState(Path(self.directory.name) / 'state.json')
+        return service
+
+    def test_token_reused(self):
+        """Test only the first authorization fetches a token, which is stored owner-only."""
+        with self.fetch as fetch:
+            self.service().authorize()
+            service = self.service()
+            service.authorize()
+        assert fetch.call_count == 1
+        assert service.client.auth.client.resource_owner_key == 'token'
+        assert self.store.path.stat().st_mode & 0o777 == 0o600
+
+    def test_refresh_on_unauthorized(self):
+        """Test a 401 fetches a new token and retries the request."""
+        session = FakeInstapaperSession({'archive': {'1': 'h1'}})
+        revoked = mock.Mock()
+        revoked.post.return_value = FakeResponse({}, status_code=401)
+        with self.fetch as fetch, mock.patch.object(InstapaperAPI, '_session', return_value=session):
+            service = self.service()
+            service.client = revoked
+            bookmarks = service.bookmarks('archive')
+        assert fetch.call_count == 1
+        assert bookmarks['bookmark_id'].to_list() == [1]
+        assert self.store.get('InstapaperAPI', service._user) == fetch.return_value
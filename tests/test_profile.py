@@ -0,0 +1,82 @@
+"""Tests for `thought.profile`."""
+
+
+import json
+import pstats
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests.fakes import FakeNotionBackend, FakeNotionClient
+from thought.core import CollectionExtension, SyncPlan
+from thought.profile import PROFILER, Profiler
+from thought.transport import TRANSPORT
+
+
+class TestProfiler(unittest.TestCase):
+    """Tests for stage spans, summaries and profile dumps."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = FakeNotionBackend(rows=30, duplicate_rate=0.2, seed=3)
+        client = FakeNotionClient(self.backend)
+        self.extension = CollectionExtension(client.get_collection_view(self.backend.url).collection)
+        PROFILER.reset()
+        PROFILER.enable()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        PROFILER.disable()
+        PROFILER.reset()
+        self.directory.cleanup()
+
+    def test_disabled_records_nothing(self):
+        """Test spans of a disabled profiler aren't recorded."""
+        profiler = Profiler()
+        with profiler.span('fetch') as span:
+            span.rows = 10
+        assert profiler.spans == {} and profiler.events == []
+
+    def test_dedupe_stages(self):
+        """Test a read and a recordlinkage dedupe record their fetch, decode, index, compare, classify and write spans."""
+        dataframe = self.extension.asdataframe()
+        deduped = self.extension.dedupe(dataframe, comparison_fields=['title', 'url'], engine='recordlinkage')
+        self.extension.sync(deduped, current_df=dataframe)
+
+        spans = self.extension.metadata.spans
+        assert list(spans) == ['fetch', 'decode', 'normalize', 'index', 'compare', 'classify', 'write']
+        assert spans['fetch'].rows == spans['decode'].rows == 30
+        assert spans['compare'].rows == spans['classify'].rows > 0
+        assert spans['write'].rows == 30 - len(deduped)
+        assert all(x.calls and x.peak_rss for x in spans.values())
+
+        table = PROFILER.table().splitlines()
+        assert table[0].split()[:3] == ['stage', 'calls', 'seconds']
+        assert [x.split()[0] for x in table[1:]] == list(spans)
+
+    def test_requests(self):
+        """Test requests sent through the shared transport are counted against the open span."""
+        with PROFILER.span('fetch'):
+            TRANSPORT.metrics.record('www.notion.so', 0.01)
+            TRANSPORT.metrics.record('www.notion.so', 0.01)
+        assert PROFILER.spans['fetch'].requests == 2
+
+    def test_trace(self):
+        """Test the JSON trace holds a complete event per span."""
+        self.extension.asdataframe(batch_size=10)
+        path = Path(self.directory.name) / 'trace.json'
+        PROFILER.dump_trace(path)
+        events = json.loads(path.read_text())['traceEvents']
+        decodes = [x for x in events if x['name'] == 'decode']
+        assert len(decodes) == 3 and all(x['ph'] == 'X' and x['dur'] >= 0 for x in decodes)
+        assert sum(x['args']['rows'] for x in decodes) == 30
+
+    def test_stats(self):
+        """Test the cProfile of a run is dumped as pstats."""
+        PROFILER.enable(cprofile=True)
+        self.extension._write(SyncPlan(archives=self.backend.row_ids[:2]))
+        PROFILER.disable()
+        path = Path(self.directory.name) / 'run.pstats'
+        PROFILER.dump_stats(str(path))
+        assert any(name == 'write' for _, _, name in pstats.Stats(str(path)).stats)
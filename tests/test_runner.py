@@ -0,0 +1,114 @@
+"""Tests for `thought.runner`."""
+
+
+import tempfile
+import unittest
+from importlib.metadata import EntryPoint
+from pathlib import Path
+from unittest import mock
+
+from tests.fakes import BOOKMARK_SCHEMA, FakeNotionBackend, FakeNotionClient
+from thought.cache import CollectionIndex
+from thought.exceptions import CollectionMustAlreadyExistException
+from thought.runner import SyncJob, SyncRunner, read_manifest, timing_table
+
+
+class RunnerTestCase(unittest.TestCase):
+    """A SyncRunner against a fake backend whose services page holds a bookmarks_saved_items collection"""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.backend = FakeNotionBackend(schema=BOOKMARK_SCHEMA, name='bookmarks_saved_items')
+        entry_point = EntryPoint(name='bookmarks', value='tests.fakes:BookmarkService', group='thought.services')
+        discovery = mock.patch('thought.service._entry_points', return_value={'bookmarks': entry_point})
+        discovery.start()
+        self.addCleanup(discovery.stop)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.index = CollectionIndex(Path(self.directory.name) / 'cache.sqlite')
+        self.runner = self.new_runner()
+
+    def new_runner(self, **kwargs):
+        return SyncRunner(FakeNotionClient(self.backend), index=self.index, **kwargs)
+
+    def job(self, action='saved_items', **kwargs):
+        return SyncJob('bookmarks', action, target=self.backend.services_url, **kwargs)
+
+
+class TestSyncRunner(RunnerTestCase):
+    """Tests for running many sync jobs at once."""
+
+    def test_run(self):
+        """Test jobs share one read of the target page, failures are isolated and loads land."""
+        jobs = [self.job(), self.job(action='missing'), self.job(arguments={'folder': 'unread'})]
+        results = self.runner.run(jobs)
+
+        assert self.backend.requests['loadPageChunk'] == 1
+        assert results[1].error is not None and results[1].plan is None
+        # loads into the same collection are serialised, so whichever job loads second finds the rows already there
+        assert sorted(len(results[x].plan.creates) for x in (0, 2)) == [0, 3]
+        assert len(self.runner.collection(self.job()).asdataframe()) == 3
+        table = timing_table(results)
+        assert table.splitlines()[0].split() == ['job', 'extract', 'load', 'total', 'created', 'updated', 'archived',
+                                                 'status']
+        assert 'failed' in table.splitlines()[2]
+
+    def test_discover(self):
+        """Test --all finds every service action with a collection on the target page."""
+        assert self.runner.discover(self.backend.services_url) == [self.job()]
+
+    def test_manifest(self):
+        """Test jobs are read from a TOML manifest."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'sync.toml'
+            path.write_text('[[sync]]\nservice = "bookmarks"\naction = "saved_items"\nstyle = "replace"\n'
+                            '[sync.arguments]\nfolder = ["unread"]\n')
+            assert read_manifest(path) == [SyncJob('bookmarks', 'saved_items', style='replace',
+                                                   arguments={'folder': ['unread']})]
+
+
+class TestCollectionIndex(RunnerTestCase):
+    """Tests for finding target collections through the local index."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        super().setUp()
+        for number in range(200):
+            self.backend.add_page(f'Page {number}')
+
+    def test_constant_lookup(self):
+        """Test a warm index finds the collection without reading the target page's children."""
+        self.runner.collection(self.job())
+        assert self.index.get(self.backend.services_page_id, 'bookmarks_saved_items') == [self.backend.page_id]
+
+        self.backend.requests.clear()
+        collection = self.new_runner().collection(self.job())
+        assert collection.collection.id == self.backend.collection_id
+        # a handful of records, not the 200 children of the services page
+        assert self.backend.requests['records'] < 10, self.backend.requests
+
+    def test_stale_index(self):
+        """Test a renamed collection is caught on use and the index rebuilt."""
+        self.runner.collection(self.job())
+        self.backend.records['collection'][self.backend.collection_id]['name'] = [['bookmarks_archive']]
+        with self.assertRaises(CollectionMustAlreadyExistException):
+            self.new_runner().collection(self.job())
+        assert self.index.get(self.backend.services_page_id, 'bookmarks_saved_items') == []
+        assert self.index.get(self.backend.services_page_id, 'bookmarks_archive') == [self.backend.page_id]
+
+    def test_create_missing(self):
+        """Test a missing collection is created, registered and loaded into."""
+        job = self.job(arguments={'folder': 'unread'})
+        job.action = 'saved_items'
+        self.backend.records['collection'][self.backend.collection_id]['name'] = [['something_else']]
+        result, = self.new_runner().run([job])
+        assert isinstance(result.error, CollectionMustAlreadyExistException)
+
+        result, = self.new_runner(create_missing=True).run([job])
+        assert result.error is None and len(result.plan.creates) == 3
+        block_id, = self.index.get(self.backend.services_page_id, 'bookmarks_saved_items')
+        assert block_id in self.backend.records['block'][self.backend.services_page_id]['content']
+
+        loaded = self.new_runner().collection(job).asdataframe()
+        assert sorted(loaded['bookmark_id']) == [0, 1, 2]
+        assert set(loaded['folder']) == {'unread'}
@@ -0,0 +1,97 @@
+"""Tests for `thought.schema`."""
+
+
+import unittest
+
+import pandas as pd
+from tests.fakes import FakeNotionBackend, FakeNotionClient
+from thought.core import CollectionExtension
+from thought.schema import SCHEMAS, CompiledSchema, decode_multi_select, encode_multi_select, memory_usage
+
+
+class TestCompiledSchema(unittest.TestCase):
+    """Tests for CompiledSchema decoding and SchemaCache reuse."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.backend = FakeNotionBackend(rows=30, seed=3)
+        self.client = FakeNotionClient(self.backend)
+        self.collection = self.client.get_collection_view(self.backend.url).collection
+        SCHEMAS.invalidate(self.collection.id)
+
+    def test_frame_matches_notion_py(self):
+        """Test compiled decoders produce the same rows as notion-py's get_all_properties."""
+        blocks = self.collection.get_rows(limit=-1)
+        expected = pd.DataFrame([dict(x.get_all_properties(), id=x.id) for x in blocks])
+        frame = SCHEMAS.get(self.collection).frame([x.get() for x in blocks], self.collection)
+        frame['published'] = frame['published'].map(lambda x: x.to_notion())
+        expected['published'] = expected['published'].map(lambda x: x.to_notion())
+        for column in expected.columns:
+            assert frame[column].to_list() == expected[column].to_list(), column
+
+    def test_fallback_decoder(self):
+        """Test property types without a compiled decoder are decoded through notion-py."""
+        properties = self.collection.get_schema_properties()
+        properties[0] = dict(properties[0], type='person')
+        compiled = CompiledSchema(properties)
+        assert compiled.needs_store
+        block = self.collection.get_rows(limit=1)[0]
+        frame = compiled.frame([block.get()], self.collection)
+        assert frame[properties[0]['slug']].to_list() == [[]]
+
+    def test_property_lookup(self):
+        """Test properties are found by slug, name or id."""
+        compiled = SCHEMAS.get(self.collection)
+        assert compiled.property('stars') is compiled.property('Stars') is compiled.property('star')
+        with self.assertRaises(KeyError):
+            compiled.property('missing')
+
+    def test_cache_reuse_and_invalidation(self):
+        """Test the compiled schema is shared until a schema change invalidates it."""
+        extension = CollectionExtension(self.collection)
+        compiled = extension.schema
+        assert CollectionExtension(self.collection).schema is compiled
+
+        self.collection.set('schema', dict(self.collection.get('schema'),
+                                           note={'name': 'Note', 'type': 'text'}))
+        assert extension.schema is compiled
+        SCHEMAS.invalidate(self.collection.id)
+        assert 'note' in extension.schema.columns
+
+
+class TestCompactFrame(unittest.TestCase):
+    """Tests for CompiledSchema.compact and the multi-select bitset encoding."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        backend = FakeNotionBackend(rows=200, duplicate_rate=0.2, seed=5)
+        self.collection = FakeNotionClient(backend).get_collection_view(backend.url).collection
+        self.extension = CollectionExtension(self.collection)
+        self.dataframe = self.extension.asdataframe()
+        self.compacted = self.extension.asdataframe(compact=True)
+
+    def test_dtypes(self):
+        """Test each property type gets its compact dtype."""
+        dtypes = self.compacted.dtypes.astype(str).to_dict()
+        assert dtypes == {'title': 'string', 'tags': 'uint64', 'url': 'string', 'stars': 'Int64',
+                          'published': 'datetime64[ns, UTC]', 'done': 'boolean', 'id': 'string'}
+        assert self.compacted['published'][0] == pd.Timestamp(self.dataframe['published'][0].start, tz='UTC')
+
+    def test_multi_select_round_trip(self):
+        """Test multi-select bitsets decode to the original values in schema option order."""
+        values = self.compacted.attrs['multi_select']['tags']
+        assert values == [f'tag{x}' for x in range(10)]
+        decoded = decode_multi_select(self.compacted['tags'], values)
+        expected = self.dataframe['tags'].map(lambda x: sorted(x, key=values.index))
+        assert decoded.to_list() == expected.to_list()
+
+    def test_multi_select_dictionary_fallback(self):
+        """Test multi-selects with too many values for a bitset are dictionary encoded."""
+        series = pd.Series([[f'v{x}', f'v{x + 1}'] for x in range(100)] + [[]])
+        encoded, values = encode_multi_select(series)
+        assert encoded.dtype == 'category' and len(values) == 101
+        assert decode_multi_select(encoded, values).to_list() == series.to_list()
+
+    def test_memory_usage(self):
+        """Test compact frames take less memory than the decoded ones."""
+        assert memory_usage(self.compacted) < memory_usage(self.dataframe)
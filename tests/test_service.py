@@ -0,0 +1,96 @@
+"""Tests for `thought.service`."""
+
+
+import unittest
+from importlib.metadata import EntryPoint
+from unittest import mock
+
+from tests.fakes import BOOKMARK_SCHEMA, BookmarkService, FakeNotionBackend, FakeNotionClient, bookmarks
+from thought.core import CollectionExtension
+from thought.exceptions import ServiceNotRegisteredException
+from thought.service import Registry
+from thought.services.instapaper import InstapaperAPI
+
+
+class TestServiceLoad(unittest.TestCase):
+    """Tests for GenericService.load."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.backend = FakeNotionBackend(schema=BOOKMARK_SCHEMA)
+        self.service = BookmarkService()
+
+    def target(self):
+        client = FakeNotionClient(self.backend)
+        return CollectionExtension(client.get_collection_view(self.backend.url).collection)
+
+    def test_resync_writes_nothing(self):
+        """Test loading the same rows twice only writes them once."""
+        plan = self.service.load(bookmarks(range(5)), self.target(), style='upsert')
+        assert len(plan.creates) == 5
+        transactions = len(self.backend.transactions)
+
+        plan = self.service.load(bookmarks(range(5)), self.target(), style='upsert')
+        assert not plan
+        assert len(self.backend.transactions) == transactions
+
+    def test_upsert(self):
+        """Test only new and changed rows are written, matched on the service's key."""
+        self.service.load(bookmarks(range(5)), self.target(), style='upsert')
+        changed = bookmarks(range(6))
+        changed.loc[2, 'title'] = 'Changed title'
+        plan = self.service.load(changed, self.target(), style='upsert')
+        assert plan.creates == [{'bookmark_id': 5, 'title': 'Bookmark 5', 'url': 'https://example.com/5', 'stars': 0}]
+        assert list(plan.updates.values()) == [{'title': 'Changed title'}]
+        assert not plan.archives
+
+        loaded = self.target().asdataframe()
+        assert sorted(loaded['bookmark_id']) == list(range(6))
+        assert loaded.set_index('bookmark_id').loc[2, 'title'] == 'Changed title'
+
+    def test_append_and_replace(self):
+        """Test append always creates rows and replace archives rows missing from the data."""
+        self.service.load(bookmarks(range(3)), self.target(), style='append')
+        plan = self.service.load(bookmarks(range(3)), self.target(), style='append')
+        assert len(plan.creates) == 3
+        assert len(self.target().asdataframe()) == 6
+
+        plan = self.service.load(bookmarks([1, 2]), self.target(), style='replace')
+        assert len(plan.archives) == 4
+        assert sorted(self.target().asdataframe()['bookmark_id']) == [1, 2]
+
+    def test_invalid_style(self):
+        """Test an unknown load style is rejected."""
+        with self.assertRaises(ValueError):
+            self.service.load(bookmarks(range(1)), self.target(), style='merge')
+
+
+class TestRegistry(unittest.TestCase):
+    """Tests for service discovery and action dispatch."""
+
+    def test_actions(self):
+        """Test each service class maps its own public methods to actions once."""
+        assert BookmarkService._actions == {'saved_items': 'saved_items'}
+        assert InstapaperAPI._actions == {'bookmarks': 'bookmarks'}
+        service = BookmarkService()
+        assert service['saved-items']().shape == (3, 5)
+        assert service['load'] is None and service['metadata'] is None
+
+    def test_entry_point_discovery(self):
+        """Test services registered by other packages are found and loaded lazily."""
+        entry_point = EntryPoint(name='bookmarks', value='tests.fakes:BookmarkService', group='thought.services')
+        with mock.patch('thought.service._entry_points', return_value={'bookmarks': entry_point}):
+            registry = Registry()
+            assert registry.available == ['bookmarks', 'instapaper']
+            assert not registry.services
+            assert registry.register('bookmarks') is BookmarkService
+            assert registry.register('instapaper') is InstapaperAPI
+        with self.assertRaises(ServiceNotRegisteredException):
+            registry.register('pocket')
+
+    def test_accepted_arguments(self):
+        """Test actions are only passed the arguments their signature takes."""
+        arguments = {'folder': ['starred'], 'incremental': False}
+        assert BookmarkService.accepted_arguments('saved-items', arguments) == {'folder': ['starred']}
+        assert InstapaperAPI.accepted_arguments('bookmarks', arguments) == arguments
+        assert BookmarkService.accepted_arguments('unknown', arguments) == arguments
@@ -0,0 +1,54 @@
+"""Tests for CollectionViewExtension.sort."""
+
+
+import unittest
+
+from tests.fakes import FakeNotionBackend, FakeNotionClient
+from thought.core import CollectionViewExtension
+from thought.writer import BatchWriter
+
+
+class TestCollectionViewSort(unittest.TestCase):
+    """Tests for sorting views and multi-select values."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.backend = FakeNotionBackend(rows=200)
+        self.client = FakeNotionClient(self.backend)
+
+    def view(self):
+        return CollectionViewExtension(FakeNotionClient(self.backend).get_collection_view(self.backend.url))
+
+    def unsorted(self):
+        tags = self.view().collection.asdataframe()['tags']
+        return sum(list(x) != sorted(x) for x in tags)
+
+    def test_sort(self):
+        """Test only rows out of order are rewritten, in batches, and the view sort is stored server side."""
+        unsorted = self.unsorted()
+        assert 0 < unsorted < 200
+
+        report = self.view().sort('tags', writer=BatchWriter(self.client, batch_size=20))
+        assert (report.rewritten, report.skipped) == (unsorted, 200 - unsorted)
+        assert report.stats.rows == unsorted
+        # transactions of 20 rows, then one for the view's sort
+        assert len(self.backend.transactions) == report.stats.transactions == -(-unsorted // 20) + 1
+        view = self.backend.records['collection_view'][self.backend.view_id]
+        assert view['query2']['sort'] == [{'direction': 'ascending', 'property': 'tags'}]
+        assert self.unsorted() == 0
+
+        report = self.view().sort('tags')
+        assert (report.rewritten, report.skipped) == (0, 200)
+
+    def test_dry_run(self):
+        """Test a dry run counts the rows to rewrite without writing."""
+        report = self.view().sort('tags', dry_run=True)
+        assert report.rewritten == self.unsorted()
+        assert not self.backend.transactions
+
+    def test_schema_values(self):
+        """Test multi-select options are ordered alongside the view sort."""
+        self.view().sort('Tags', sort_multiselect_values=False, sort_multiselect_schema_values=True, ascending=False)
+        options = self.backend.records['collection'][self.backend.collection_id]['schema']['tags']['options']
+        assert [x['value'] for x in options] == [f'tag{x}' for x in reversed(range(10))]
+        assert len(self.backend.transactions) == 1
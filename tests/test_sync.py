@@ -0,0 +1,75 @@
+"""Tests for CollectionExtension.sync and `thought.writer`."""
+
+
+import unittest
+
+import pandas as pd
+from notion.operations import build_operation
+from requests import HTTPError
+from tests.fakes import FakeHTTPServer, FakeNotionBackend, FakeNotionClient, HTTPNotionClient
+from thought.core import CollectionExtension
+from thought.transport import Transport
+from thought.writer import BatchWriter
+
+
+class TestCollectionSync(unittest.TestCase):
+    """Tests for planning and writing collection changes."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.backend = FakeNotionBackend(rows=12)
+        self.client = FakeNotionClient(self.backend)
+        self.extension = CollectionExtension(self.client.get_collection_view(self.backend.url).collection)
+        self.current = self.extension.asdataframe()
+
+    def changed(self):
+        dataframe = self.current.drop([10, 11]).reset_index()
+        dataframe.loc[0, 'title'] = 'Changed title'
+        dataframe.at[1, 'tags'] = ['tag1', 'brand-new-tag']
+        new = pd.DataFrame([{'title': 'New row', 'stars': 4, 'done': True}])
+        return pd.concat([dataframe, new], ignore_index=True)
+
+    def test_plan(self):
+        """Test only changed properties, new rows and dropped rows are planned."""
+        plan = self.extension.plan_sync(self.changed(), self.current)
+        assert plan.creates == [{'title': 'New row', 'stars': 4, 'done': True}]
+        assert plan.updates == {self.current.loc[0, 'id']: {'title': 'Changed title'},
+                                self.current.loc[1, 'id']: {'tags': ['tag1', 'brand-new-tag']}}
+        assert plan.archives == self.current.loc[10:, 'id'].to_list()
+        assert not self.extension.plan_sync(self.current, self.current)
+
+    def test_dry_run(self):
+        """Test a dry run writes nothing."""
+        plan = self.extension.sync(self.changed(), current_df=self.current, dry_run=True)
+        assert plan and plan.stats is None
+        assert not self.backend.transactions
+
+    def test_sync(self):
+        """Test changes are written in batched transactions and read back."""
+        writer = BatchWriter(self.client, batch_size=4, workers=2)
+        plan = self.extension.sync(self.changed(), current_df=self.current, writer=writer)
+        assert plan.stats.rows == 5
+        # one transaction adding the new tag option, then rows packed 4 operations at a time
+        assert plan.stats.transactions == len(self.backend.transactions) == 3
+
+        synced = CollectionExtension(FakeNotionClient(self.backend).get_collection_view(self.backend.url).collection)
+        synced = synced.asdataframe()
+        assert len(synced) == 11
+        assert synced.loc[0, 'title'] == 'Changed title'
+        assert synced.loc[1, 'tags'] == ['tag1', 'brand-new-tag']
+        assert synced.iloc[-1]['title'] == 'New row'
+
+    def test_rate_limit_retries(self):
+        """Test rate limited transactions are retried by the transport, and failed ones aren't resent."""
+        with FakeHTTPServer(respond=lambda path, body: self.backend.handle(path.lstrip('/'), body)) as server:
+            client = HTTPNotionClient(server.url, transport=Transport(backoff=0, default_rate_limit=(10000.0, 10000)))
+            server.failures.extend([(429, {'Retry-After': '0'})] * 2)
+            plan = self.extension.sync(self.changed(), current_df=self.current, writer=BatchWriter(client))
+            assert plan.stats.retries == 2
+            assert len(self.backend.transactions) == 2
+
+            server.failures.append((503, {}))
+            with self.assertRaises(HTTPError):
+                BatchWriter(client).write([[build_operation(self.current.loc[0, 'id'], ['alive'], False)]])
+            assert server.requests['/submitTransaction'] == 5
+            assert len(self.backend.transactions) == 2
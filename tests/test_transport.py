@@ -0,0 +1,103 @@
+"""Tests for `thought.transport`."""
+
+
+import socket
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from tests.fakes import FakeHTTPServer
+from thought.transport import TokenBucket, Transport, TransportMetrics
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Tests for TokenBucket rate limiting."""
+
+    def test_burst_then_rate(self):
+        """Test a burst of up to capacity passes at once, later tokens wait for the rate."""
+        bucket = TokenBucket(rate=50, capacity=3)
+        start = time.monotonic()
+        waits = [bucket.acquire() for _ in range(6)]
+        assert waits[:3] == [0.0, 0.0, 0.0]
+        assert time.monotonic() - start >= 3 / 50 * 0.9
+
+
+class TestTransportMetrics(unittest.TestCase):
+    """Tests for request metrics."""
+
+    def test_percentiles(self):
+        """Test latency percentiles interpolate between requests, per host or over every host."""
+        metrics = TransportMetrics()
+        for seconds in (0.1, 0.2, 0.3, 0.4):
+            metrics.record('www.notion.so', seconds)
+        metrics.record('www.instapaper.com', 0.5)
+        assert metrics.percentile(50, 'www.notion.so') == 0.25
+        assert metrics.percentile(50) == 0.3 and metrics.percentile(99, 'missing') == 0.0
+
+
+class TestTransport(unittest.TestCase):
+    """Tests for requests sent through a Transport mounted on a session."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.server = FakeHTTPServer().__enter__()
+        self.transport = Transport(backoff=0.01, max_retries=2)
+        self.session = self.transport.mount(requests.Session())
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.server.__exit__()
+
+    def test_retries_rate_limited(self):
+        """Test 429 and 503 responses are retried, honouring Retry-After, and counted."""
+        self.server.failures.extend([(429, {'Retry-After': '0'}), (503, {})])
+        response = self.session.post(self.server.url + 'loadPageChunk', json={})
+        assert response.status_code == 200
+        assert self.server.requests['/loadPageChunk'] == 3
+        metrics = self.transport.metrics
+        assert (metrics.requests, metrics.retries, metrics.failures) == (3, 2, 0)
+
+    def test_gives_up_after_max_retries(self):
+        """Test the last failed response is returned once retries run out."""
+        self.server.failures.extend([(429, {'Retry-After': '0'})] * 3)
+        response = self.session.post(self.server.url + 'submitTransaction', json={})
+        assert response.status_code == 429
+        assert self.transport.metrics.failures == 1
+
+    def test_unsafe_requests_only_retried_unsent(self):
+        """Test a transaction is retried when rate limited, but not after a server error or a dropped connection."""
+        self.server.failures.extend([(429, {'Retry-After': '0'}), (503, {})])
+        response = self.session.post(self.server.url + 'submitTransaction', json={})
+        assert response.status_code == 503 and response.retries == 1
+        assert self.server.requests['/submitTransaction'] == 2
+
+        self.server.failures.append((None, {}))
+        with self.assertRaises(requests.ConnectionError):
+            self.session.post(self.server.url + 'submitTransaction', json={})
+        assert self.server.requests['/submitTransaction'] == 3
+
+        # the same failure of an idempotent request is retried
+        self.server.failures.append((None, {}))
+        assert self.session.post(self.server.url + 'loadPageChunk', json={}).retries == 1
+
+    def test_unsent_requests_retried(self):
+        """Test a transaction whose connection was refused is retried."""
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            port = closed.getsockname()[1]
+        with self.assertRaises(requests.ConnectionError):
+            self.session.post(f'http://127.0.0.1:{port}/submitTransaction', json={})
+        assert (self.transport.metrics.retries, self.transport.metrics.failures) == (2, 1)
+
+    def test_rate_limit_per_host(self):
+        """Test concurrent requests to a host are held to its rate."""
+        transport = Transport(rate_limits={'127.0.0.1': (40, 1)})
+        session = transport.mount(requests.Session())
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: session.post(self.server.url, json={}), range(8)))
+        assert time.monotonic() - start >= 7 / 40 * 0.9
+        assert transport.metrics.requests == 8
+        assert transport.metrics.throttled_seconds > 0
+        assert 0 < transport.metrics.percentile(50) <= transport.metrics.percentile(99)
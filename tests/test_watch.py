@@ -0,0 +1,104 @@
+"""Tests for `thought.watch`."""
+
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from tests.fakes import SCHEMA, FakeNotionBackend, FakeNotionClient, synthetic_row
+from thought.cache import DuplicateIndex, SnapshotCache
+from thought.core import CollectionExtension
+from thought.dedupe import key_digests
+from thought.watch import Watcher
+
+DAY = 24 * 60 * 60 * 1000
+
+
+class TestWatcher(unittest.TestCase):
+    """Tests for incremental dedupe and sorting of edited rows."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = tempfile.TemporaryDirectory()
+        schema = dict(SCHEMA, edit={'name': 'Edited', 'type': 'last_edited_time'})
+        self.backend = FakeNotionBackend(rows=40, duplicate_rate=0.25, seed=2, schema=schema)
+        client = FakeNotionClient(self.backend)
+        self.cache = SnapshotCache(path=Path(self.directory.name) / 'snapshots.sqlite')
+        self.extension = CollectionExtension(client.get_collection_view(self.backend.url).collection, cache=self.cache)
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.directory.cleanup()
+
+    def watcher(self, **kwargs):
+        watcher = Watcher(self.extension, fields=['title', 'url', 'tags'], interval=0, **kwargs)
+        watcher.start()
+        return watcher
+
+    def test_start_dedupes_collection(self):
+        """Test starting a watch archives the duplicates a full hash dedupe finds."""
+        dataframe = self.extension.asdataframe()
+        expected = set(self.extension.dedupe(dataframe, comparison_fields=['title', 'url', 'tags'])['id'])
+        report = self.watcher().start()
+        assert report.processed == len(expected)
+        assert set(self.backend.row_ids) == expected
+
+    def test_poll_only_reads_edits(self):
+        """Test a poll only fetches rows edited since the watermark's day, and archives new duplicates of indexed rows."""
+        watcher = self.watcher()
+        kept = self.extension.asdataframe().iloc[0]
+        # edits are looked up from the day of the last one, so move the watermark to a day without the initial rows
+        self.backend.clock += DAY
+        self.backend.add_row(**synthetic_row(1000, seed=2))
+        watcher.poll()
+
+        rows = self.backend.requests['queryCollection.rows']
+        duplicate = self.backend.add_row(title=kept['title'], url=kept['url'], tags=kept['tags'])
+        unique = self.backend.add_row(**synthetic_row(1001, seed=2))
+        report = watcher.poll()
+        assert (report.edited, report.processed, report.archived) == (2, 2, [duplicate])
+        assert self.backend.requests['queryCollection.rows'] - rows == 3
+        assert unique in self.backend.row_ids and duplicate not in self.backend.row_ids
+        assert watcher.poll().edited == 0
+
+    def test_deleted_rows_leave_index(self):
+        """Test a row deleted outside the watch no longer keeps a new row with its values from being kept."""
+        watcher = self.watcher()
+        kept = self.extension.asdataframe().iloc[0]
+        self.backend.clock += DAY
+        self.extension.collection._client.get_block(kept['id']).remove()
+        watcher.poll()
+
+        replacement = self.backend.add_row(title=kept['title'], url=kept['url'], tags=kept['tags'])
+        report = watcher.poll()
+        assert report.processed and report.archived == []
+        assert replacement in self.backend.row_ids
+        assert kept['id'] not in DuplicateIndex(path=self.cache.path).groups(
+            self.extension.collection.id, watcher.fields, [replacement])
+
+    def test_restart_only_hashes_edits(self):
+        """Test a restarted watch reuses the persisted duplicate index, only hashing rows edited since."""
+        self.watcher()
+        self.backend.clock += DAY
+        self.backend.add_row(**synthetic_row(3000, seed=2))
+        with mock.patch('thought.core.key_digests', wraps=key_digests) as hashing:
+            self.watcher()
+        assert sum(len(x.args[0]) for x in hashing.call_args_list) == 1
+
+    def test_sorts_edited_rows(self):
+        """Test edited rows get their multi-select values sorted, and the rewrite settles on the next poll."""
+        watcher = self.watcher(sort_fields=['tags'], dedupe=False)
+        block_id = self.backend.add_row(title='Unsorted', tags=['tag9', 'tag1'])
+        assert watcher.poll().sorted == 1
+        assert self.extension.collection._client.get_block(block_id).tags == ['tag1', 'tag9']
+        report = watcher.poll()
+        assert (report.edited, report.sorted) == (1, 0)
+
+    def test_back_pressure(self):
+        """Test at most max_batch edited rows are processed per poll, the rest wait for the next polls."""
+        watcher = self.watcher(max_batch=2)
+        for number in range(5):
+            self.backend.add_row(**synthetic_row(2000 + number, seed=2))
+        assert [(x.processed, x.pending) for x in (watcher.poll(), watcher.poll(), watcher.poll())] == \
+            [(2, 3), (2, 1), (1, 0)]